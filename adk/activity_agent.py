@@ -21,8 +21,9 @@ from google.genai import types
 
 from callback import before_tool_callback, after_tool_callback
 from callback import before_agent_callback, after_agent_callback
+from callback import before_model_callback, after_model_callback
 
-from rag_tools import import_document_to_corpus_tool, retrieve_context_tool
+from rag_tools import import_document_to_corpus_tool, retrieve_context_tool, get_import_status_tool
 from gcs_tools import list_gcs_buckets_tool, list_blobs_in_bucket_tool
 
 from question_agent import question_agent_tool, question_agent
@@ -40,20 +41,25 @@ activity_agent = LlmAgent(
                  "3.  **Study evaluation** Test the user knowledge based on user prompt and RAG Searching. \n" \
                  "**COMMAND LOGIC**\n" \
                  "Identify the user's intent and perform one of the following actions:\n" \
-                 "- If the user select option 1. call tool 'list_blobs_in_bucket' passing 'bucket_name'={bucket_name}. "\
-                 " Then Always parse the tool output extract the list of blobs with size less than 7000000 and present them to the user. \n" \
+                 "- If the user select option 1. call tool 'list_blobs_in_bucket' passing 'bucket_name'={bucket_name} and 'max_size'=7000000. "\
+                 " Then present the returned blobs to the user. If 'next_page_token' is not null tell the user that more files are available: " \
+                 " if the user asks for them call the tool again with the same arguments and 'page_token' equal to 'next_page_token'. \n" \
                  "- If the user select option 2 ask for the filename to import. "\
-                 " Then call tool 'import_document_to_corpus' passing 'bucket_name'={bucket_name}, 'corpus_id'={corpus_id} and 'file_name' equal to the filename selected by the user. \n" \
+                 " Then call tool 'import_document_to_corpus' passing 'bucket_name'={bucket_name}, 'corpus_id'={corpus_id} and 'file_name' equal to the filename selected by the user. "\
+                 " The import runs in background: tell the user that the import started and the job id. \n" \
+                 "- If the user asks about the status of an import call tool 'get_import_status' passing the job id and report the status and the imported/failed/skipped counts. \n" \
                  "- If the user select option 3 delegate the conversation to 'question_agent'. \n" \
                  "Do not translate the 'question_agent' replies. \n" \
                  "**ERROR HANDLING**\n" \
                  "If the user requests an operation not listed above, reply: 'I can only assist with the three supported operations. Please select 1, 2, or 3.'",
-    tools = [list_blobs_in_bucket_tool, import_document_to_corpus_tool],
+    tools = [list_blobs_in_bucket_tool, import_document_to_corpus_tool, get_import_status_tool],
     sub_agents=[question_agent],
     before_tool_callback=before_tool_callback,  
     after_tool_callback=after_tool_callback,
     before_agent_callback=before_agent_callback,
-    after_agent_callback=after_agent_callback  
+    after_agent_callback=after_agent_callback,
+    before_model_callback=before_model_callback,
+    after_model_callback=after_model_callback
 )
 
 import asyncio
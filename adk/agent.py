@@ -1,15 +1,19 @@
 import os
+import json
+import shutil
 import uvicorn
 import uuid
 import time
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import StreamingResponse, Response
 from typing import Dict, Any, Optional
 
 # Google ADK imports
 from google.adk.agents import LlmAgent, Agent
 from google.adk.agents.callback_context import CallbackContext
+from google.adk.agents.run_config import RunConfig, StreamingMode
 from google.adk.models.google_llm import Gemini
 from google.adk.events import Event, EventActions
 from google.adk.runners import Runner, InMemoryRunner
@@ -22,11 +26,29 @@ from google.genai import types
 # import callbacks
 from callback import before_tool_callback, after_tool_callback
 from callback import before_agent_callback, after_agent_callback
+from callback import before_model_callback, after_model_callback
 
 #import agents
 from logger_agent import logger_agent
+from login_flow import login_flow_agent
 from activity_agent import activity_agent
 
+from rag_tools import retrieval_cache_stats, import_queue
+from blob_index import index_stats
+import tracing
+import metrics
+from usage import usage_recorder, GROUP_BY_COLUMNS
+from cassette import cassettes, recording
+from question_bank import question_bank
+from model_tiers import cascade_stats
+from bm25_index import bm25_store
+from pgvector_store import pgvector_store
+
+# persistent session service
+from pg_session_service import PostgresSessionService
+from db import close_pool
+from toolbox_client import close_toolbox
+
 APP_NAME = "RefreshApp"
 
 # 1. Load Environment Variables
@@ -35,6 +57,10 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 DEFAULT_CORPUS_NAME = os.getenv("DEFAULT_CORPUS_NAME")
 DEFAULT_BUCKET_NAME = os.getenv("DEFAULT_BUCKET_NAME")
 DEFAULT_CORPUS_ID = os.getenv("DEFAULT_CORPUS_ID")
+SESSION_SERVICE = os.getenv("SESSION_SERVICE", "memory")
+UVICORN_WORKERS = int(os.getenv("UVICORN_WORKERS", "1"))
+ROUTER_MODE = os.getenv("ROUTER_MODE", "llm")
+LOGIN_FLOW = os.getenv("LOGIN_FLOW", "llm")
 
 if not GOOGLE_API_KEY:
     raise ValueError("Please set your GOOGLE_API_KEY in a .env file or environment variables.")
@@ -62,6 +88,10 @@ check_login_status_tool = FunctionTool(func=check_login_status)
 # example : use tool 'check_login_status' NOT use tool 'check_login_status_tool'
 
 # Agents definition
+
+# 'code' runs the login steps in Python (login_flow.py), 'llm' lets logger_agent follow its prompt protocol
+login_agent = login_flow_agent if LOGIN_FLOW == "code" else logger_agent
+
 root_agent = LlmAgent(
     name="root_agent",
     model="gemini-2.5-flash-lite",  # Or another supported model
@@ -78,23 +108,65 @@ root_agent = LlmAgent(
                 #"   - IF `{'status': 'logged_in'}` -> call tool `activity_agent`.\n\n" \
                 #"Always forward the user with the tool reply",
                 "You must delegate the conversation. Do not reply to the user yourself.",
-    sub_agents=[logger_agent, activity_agent],
+    sub_agents=[login_agent, activity_agent],
     tools=[check_login_status_tool],
     #tools=[check_login_status_tool, AgentTool(logger_agent), AgentTool(activity_agent)],
     before_tool_callback=before_tool_callback,  
     after_tool_callback=after_tool_callback,
     before_agent_callback=before_agent_callback,
-    after_agent_callback=after_agent_callback   
+    after_agent_callback=after_agent_callback,
+    before_model_callback=before_model_callback,
+    after_model_callback=after_model_callback
 )
 
 # 2. RUNTIME: Initialize the Runner and Session Service
 
-session_service = InMemorySessionService()
+# 'postgres' keeps the sessions in the database so that the API can run on multiple workers
+# 'memory' keeps the sessions inside the process (single worker only)
+if SESSION_SERVICE == "postgres":
+    session_service = PostgresSessionService()
+else:
+    session_service = InMemorySessionService()
 runner = Runner(agent=root_agent, session_service=session_service, app_name=APP_NAME)
 
+# runners used by the deterministic router: they start directly from the sub-agents of root_agent
+logger_runner = Runner(agent=login_agent, session_service=session_service, app_name=APP_NAME)
+activity_runner = Runner(agent=activity_agent, session_service=session_service, app_name=APP_NAME)
+
+def select_runner(session) -> Runner:
+    """
+    Select the runner for the turn.
+    With ROUTER_MODE=direct the 'login_status' in session state is checked here, without the root_agent LLM call.
+    With ROUTER_MODE=llm, or if the login status is unknown, the turn goes through root_agent.
+    """
+    if ROUTER_MODE == "direct":
+        status = session.state.get('login_status')
+        if status == "True":
+            print("ROUTER: activity_agent")
+            return activity_runner
+        if status == "False":
+            print("ROUTER: logger_agent")
+            return logger_runner
+
+    print("ROUTER: root_agent")
+    return runner
+
 # 3. API: Create the FastAPI App
 app = FastAPI(title="Google ADK Agent API")
 
+@app.on_event("shutdown")
+async def shutdown():
+    # write the pending session events before leaving
+    if isinstance(session_service, PostgresSessionService):
+        await session_service.flush()
+    try:
+        await usage_recorder.flush()
+    except Exception as e:
+        print(f"USAGE FLUSH ERROR: {e}")
+    cassettes.flush()
+    await close_pool()
+    await close_toolbox()
+
 # Define the request model
 class ChatRequest(BaseModel):
     message: str
@@ -102,6 +174,104 @@ class ChatRequest(BaseModel):
     user_id: Optional[str] = None
     reset: Optional[str] = None
 
+async def prepare_session(request: ChatRequest):
+    """
+    Create or load the ADK session addressed by the request and refresh its 'session_id' state.
+    """
+    initial_state = {
+                    "login_status": "False",
+                    "username": "",
+                    "user_id": "0",
+                    "session_id": "0",
+                    "bucket_name": DEFAULT_BUCKET_NAME,
+                    "corpus_name": DEFAULT_CORPUS_NAME,
+                    "corpus_id": DEFAULT_CORPUS_ID
+                    }
+
+    # 1. Determine the Session ID
+    # If client didn't send one, generate a new UUID
+    current_session_id = request.session_id if (request.session_id and request.session_id != "0") else str(uuid.uuid4())
+    current_user_id = request.user_id if (request.user_id and request.user_id != "0") else "0"
+
+    if current_user_id == "0":
+        # happens before the login
+        try:
+            session = await session_service.create_session( app_name=APP_NAME, user_id=current_user_id, session_id=current_session_id, state=initial_state)
+            print("CREATE A NEW SESSION BEFORE LOGIN")
+        except:
+            session = await session_service.get_session( app_name=APP_NAME, user_id=current_user_id, session_id=current_session_id )
+            print("LOAD A PREVIOUS SESSION DURING LOGIN")
+    else:
+        # WORKAROUND WITH SUB-AGENTS
+        # sub-agent works better because keep session context. The drawback is that it maintains the control of the conversation.
+        # in order to restart from parent agent I need to restart the session
+        
+        if request.reset and request.reset == "True":
+            # case 1: after a study session start a new session with a different session_id
+            # in this way the control move back from question_agent to root_agent
+            initial_state['session_id'] = str(uuid.uuid4())
+            initial_state['user_id'] = current_user_id
+            initial_state['login_status'] = "True"
+        else:
+            # case 2: after the login start a new session changing the user_id
+            # in this way the control move back from logger_agent to root_agent
+            initial_state['session_id'] = current_session_id
+            initial_state['user_id'] = current_user_id
+            initial_state['login_status'] = "True"
+        
+        try:
+            session = await session_service.create_session( app_name=APP_NAME, user_id=current_user_id, session_id=current_session_id, state=initial_state)
+            print("CREATE A NEW SESSION AFTER LOGIN")
+        except:
+            session = await session_service.get_session( app_name=APP_NAME, user_id=current_user_id, session_id=current_session_id )
+            print("LOAD A PREVIOUS SESSION AFTER LOGIN")
+
+    # --- Create Event with Actions ---
+    state_changes = {
+        "session_id": session.id
+    }
+    actions_with_update = EventActions(state_delta=state_changes)
+    # This event might represent an internal system action, not just an agent response
+    system_event = Event(
+        invocation_id="inv_login_update",
+        author="system", # Or 'agent', 'tool' etc.
+        actions=actions_with_update,
+        timestamp=time.time()
+        # content might be None or represent the action taken
+    )
+    # --- Append the Event (This updates the state) ---
+    await session_service.append_event(session, system_event)
+    print(f"State after event: {session.state}")
+
+    return session
+
+async def build_reply(session, text: str) -> Dict[str, Any]:
+    """
+    Reload the session in order to get the updated state and build the reply returned to the client.
+    """
+    # the next turn may be served by another worker: persist the turn before replying
+    if isinstance(session_service, PostgresSessionService):
+        await session_service.flush()
+
+    session = await session_service.get_session( app_name=APP_NAME, user_id=session.user_id, session_id=session.id )
+
+    return {
+        "response": text, 
+        "session_id": session.state.get("session_id"),
+        "user_id": session.state.get("user_id"),
+        "login_status": session.state.get("login_status")
+    }
+
+def record_turn(turn_runner: Runner, start: float, invocation_id: Optional[str], status: str = "ok"):
+    """
+    Observe the duration of a turn and trace the time spent in each agent, model call and tool.
+    """
+    seconds = time.perf_counter() - start
+    metrics.observe_turn(turn_runner.agent.name, seconds, status)
+    tracing.record("turn", "error" if status == "error" else "info", runner=turn_runner.agent.name,
+                   invocation_id=invocation_id, status=status, duration_ms=round(seconds * 1000, 1),
+                   breakdown=metrics.pop_turn_breakdown(invocation_id))
+
 # Define the endpoint
 @app.post("/chat")
 async def chat_endpoint(request: ChatRequest):
@@ -111,110 +281,249 @@ async def chat_endpoint(request: ChatRequest):
     """
     try:
 
-        initial_state = {
-                        "login_status": "False",
-                        "username": "",
-                        "user_id": "0",
-                        "session_id": "0",
-                        "bucket_name": DEFAULT_BUCKET_NAME,
-                        "corpus_name": DEFAULT_CORPUS_NAME,
-                        "corpus_id": DEFAULT_CORPUS_ID
-                        }
-
         text = ""
-            
-        # Run the agent asynchronously
-        # The runner handles the conversation history automatically based on session_id
-
-        # 1. Determine the Session ID
-        # If client didn't send one, generate a new UUID
-        current_session_id = request.session_id if (request.session_id and request.session_id != "0") else str(uuid.uuid4())
-        current_user_id = request.user_id if (request.user_id and request.user_id != "0") else "0"
-
-        if current_user_id == "0":
-            # happens before the login
-            try:
-                session = await session_service.create_session( app_name=APP_NAME, user_id=current_user_id, session_id=current_session_id, state=initial_state)
-                print("CREATE A NEW SESSION BEFORE LOGIN")
-            except:
-                session = await session_service.get_session( app_name=APP_NAME, user_id=current_user_id, session_id=current_session_id )
-                print("LOAD A PREVIOUS SESSION DURING LOGIN")
-        else:
-            # WORKAROUND WITH SUB-AGENTS
-            # sub-agent works better because keep session context. The drawback is that it maintains the control of the conversation.
-            # in order to restart from parent agent I need to restart the session
-            
-            if request.reset and request.reset == "True":
-                # case 1: after a study session start a new session with a different session_id
-                # in this way the control move back from question_agent to root_agent
-                initial_state['session_id'] = str(uuid.uuid4())
-                initial_state['user_id'] = current_user_id
-                initial_state['login_status'] = "True"
-            else:
-                # case 2: after the login start a new session changing the user_id
-                # in this way the control move back from logger_agent to root_agent
-                initial_state['session_id'] = current_session_id
-                initial_state['user_id'] = current_user_id
-                initial_state['login_status'] = "True"
-            
-            try:
-                session = await session_service.create_session( app_name=APP_NAME, user_id=current_user_id, session_id=current_session_id, state=initial_state)
-                print("CREATE A NEW SESSION AFTER LOGIN")
-            except:
-                session = await session_service.get_session( app_name=APP_NAME, user_id=current_user_id, session_id=current_session_id )
-                print("LOAD A PREVIOUS SESSION AFTER LOGIN")
-
-        # --- Create Event with Actions ---
-        state_changes = {
-            "session_id": session.id
-        }
-        actions_with_update = EventActions(state_delta=state_changes)
-        # This event might represent an internal system action, not just an agent response
-        system_event = Event(
-            invocation_id="inv_login_update",
-            author="system", # Or 'agent', 'tool' etc.
-            actions=actions_with_update,
-            timestamp=time.time()
-            # content might be None or represent the action taken
-        )
-        # --- Append the Event (This updates the state) ---
-        await session_service.append_event(session, system_event)
-        print(f"State after event: {session.state}")
-
-        '''
-        print(f"--- Examining Session Properties ---")
-        print(f"ID (`id`):                          {session.id}")
-        print(f"Application Name (`app_name`):      {session.app_name}")
-        print(f"User ID (`user_id`):                {session.user_id}")
-        print(f"State (`state`):                    {session.state}") # Note: Only shows initial state here
-        print(f"Events (`events`):                  {session.events}") # Initially empty
-        print(f"Last Update (`last_update_time`):   {session.last_update_time:.2f}")
-        print(f"---------------------------------")
-        '''
+
+        session = await prepare_session(request)
 
         print(f"DEBUG: Running agent as User: {session.user_id} | Session: {session.id}")
 
         query_content = types.Content(role="user", parts=[types.Part(text=request.message)])
 
-        async for event in runner.run_async( user_id=session.user_id, session_id=session.id, new_message=query_content ):
-            if event.is_final_response() and event.content and event.content.parts:
-                text = event.content.parts[0].text
-                print(text)
-
-        # reload session in order to get the updated state
-        session = await session_service.get_session( app_name=APP_NAME, user_id=current_user_id, session_id=current_session_id )
+        turn_runner = select_runner(session)
+        start = time.perf_counter()
+        invocation_id = None
+        try:
+            # Run the agent asynchronously
+            # The runner handles the conversation history automatically based on session_id
+            async for event in turn_runner.run_async( user_id=session.user_id, session_id=session.id, new_message=query_content ):
+                invocation_id = event.invocation_id
+                if event.is_final_response() and event.content and event.content.parts:
+                    text = event.content.parts[0].text
+                    print(text)
+        except Exception:
+            record_turn(turn_runner, start, invocation_id, "error")
+            raise
+        record_turn(turn_runner, start, invocation_id)
+        if recording():
+            await cassettes.add_turn(session.id, session.user_id, request.message, request.reset, text, time.perf_counter() - start)
 
-        return {
-            "response": text, 
-            "session_id": session.state.get("session_id"),
-            "user_id": session.state.get("user_id"),
-            "login_status": session.state.get("login_status")
-        }
+        return await build_reply(session, text)
     
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Latency histograms and counters of turns, agents, model calls and tools in Prometheus format.
+    """
+    data, content_type = metrics.render()
+    return Response(content=data, media_type=content_type)
+
+@app.get("/usage")
+async def usage_endpoint(group_by: str = "agent", student_id: Optional[str] = None, session_id: Optional[str] = None,
+                         agent: Optional[str] = None, days: Optional[int] = None):
+    """
+    Model calls and tokens grouped by a comma separated list of agent, session, student, model, day.
+    Optional filters: student_id, session_id, agent and the last 'days' days.
+    """
+    dimensions = [g.strip() for g in group_by.split(",") if g.strip()]
+    unknown = [g for g in dimensions if g not in GROUP_BY_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown group_by {unknown}, use {list(GROUP_BY_COLUMNS)}")
+    try:
+        return await usage_recorder.totals(dimensions, student_id=student_id, session_id=session_id, agent=agent, days=days)
+    except Exception as e:
+        print(e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/stats/retrieval_cache")
+async def retrieval_cache_endpoint():
+    """
+    Hit/miss counters and size of the retrieve_context cache.
+    """
+    return retrieval_cache_stats()
+
+@app.get("/stats/bm25")
+async def bm25_endpoint():
+    """
+    Local BM25 indexes mapped by this worker (chunks, files, terms) and search / update counters.
+    """
+    return bm25_store.stats()
+
+@app.get("/stats/pgvector")
+async def pgvector_endpoint():
+    """
+    Retrieval backend, embedder and the pgvector import / search counters of this worker.
+    """
+    return pgvector_store.stats()
+
+@app.get("/stats/blob_index")
+async def blob_index_endpoint():
+    """
+    Size, age and last refresh changes of the in-process bucket indexes.
+    """
+    return index_stats()
+
+@app.get("/stats/trace")
+async def trace_stats_endpoint():
+    """
+    Counters of the trace events (recorded, sampled out, dropped by the writer).
+    """
+    return tracing.stats()
+
+@app.get("/stats/cassette")
+async def cassette_stats_endpoint():
+    """
+    Mode and counters of the model / tool call cassettes (recorded, replayed, misses, mismatches).
+    """
+    return cassettes.stats()
+
+@app.get("/stats/question_bank")
+async def question_bank_stats_endpoint():
+    """
+    Counters of the question bank of this worker (documents and questions generated, questions served from the bank, misses).
+    """
+    return question_bank.stats()
+
+@app.get("/stats/models")
+async def model_stats_endpoint():
+    """
+    Model tiers and routes, and the cascade counters of this worker per agent and step (accepted, escalated, reasons).
+    """
+    return cascade_stats.stats()
+
+@app.get("/trace")
+async def trace_endpoint(limit: int = Query(100, ge=1, le=tracing.TRACE_BUFFER_SIZE), session_id: Optional[str] = None, kind: Optional[str] = None):
+    """
+    Most recent trace events of this worker, optionally filtered by session and kind.
+    """
+    return tracing.recent(limit=limit, session_id=session_id, kind=kind)
+
+class TraceVerboseRequest(BaseModel):
+    session_id: str
+    user_id: str
+    enabled: bool = True
+
+@app.post("/trace/verbose")
+async def trace_verbose_endpoint(request: TraceVerboseRequest):
+    """
+    Turn on (or off) the verbose trace of a session: every event with the full tool arguments and results.
+    The flag is kept in the session state, so every worker serving the session sees it.
+    """
+    session = await session_service.get_session( app_name=APP_NAME, user_id=request.user_id, session_id=request.session_id )
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Session {request.session_id} not found")
+
+    system_event = Event(
+        invocation_id="inv_trace_verbose",
+        author="system",
+        actions=EventActions(state_delta={"trace_verbose": request.enabled}),
+        timestamp=time.time()
+    )
+    await session_service.append_event(session, system_event)
+    if isinstance(session_service, PostgresSessionService):
+        await session_service.flush()
+
+    return {"session_id": session.id, "trace_verbose": request.enabled}
+
+@app.get("/imports")
+async def imports_endpoint():
+    """
+    List the import jobs known by this worker (by every worker with IMPORT_JOBS_STORE=postgres).
+    """
+    return {"jobs": await import_queue.list()}
+
+@app.get("/imports/{job_id}")
+async def import_status_endpoint(job_id: str):
+    """
+    Status of an import job: queued / running / done / error, with the imported/failed/skipped counts.
+    """
+    job = await import_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Import job '{job_id}' not found")
+    return job
+
+def sse_message(event_name: str, data: Dict[str, Any]) -> str:
+    """
+    Format a single Server-Sent Events message.
+    """
+    return f"event: {event_name}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """
+    Streaming variant of /chat based on Server-Sent Events.
+    The reply is sent as a sequence of events:
+    - 'delta': partial model text as soon as it is generated
+    - 'tool_call' / 'tool_result': progress of the tools invoked by the agents
+    - 'final': the same fields returned by /chat (response, session_id, user_id, login_status)
+    - 'error': sent instead of 'final' if the turn fails
+    """
+    try:
+        session = await prepare_session(request)
+    except Exception as e:
+        print(e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    print(f"DEBUG: Streaming agent as User: {session.user_id} | Session: {session.id}")
+
+    query_content = types.Content(role="user", parts=[types.Part(text=request.message)])
+    run_config = RunConfig(streaming_mode=StreamingMode.SSE)
+    turn_runner = select_runner(session)
+
+    async def event_generator():
+        text = ""
+        start = time.perf_counter()
+        invocation_id = None
+        turn_done = False
+        try:
+            async for event in turn_runner.run_async( user_id=session.user_id, session_id=session.id, new_message=query_content, run_config=run_config ):
+                invocation_id = event.invocation_id
+                if event.partial:
+                    # partial chunks only carry the newly generated text
+                    if event.content and event.content.parts:
+                        delta = "".join(part.text for part in event.content.parts if part.text)
+                        if delta:
+                            yield sse_message("delta", {"agent": event.author, "text": delta})
+                    continue
+
+                for call in event.get_function_calls():
+                    yield sse_message("tool_call", {"agent": event.author, "name": call.name, "args": call.args})
+
+                for response in event.get_function_responses():
+                    yield sse_message("tool_result", {"agent": event.author, "name": response.name})
+
+                if event.is_final_response() and event.content and event.content.parts:
+                    text = event.content.parts[0].text
+                    print(text)
+
+            turn_done = True
+            record_turn(turn_runner, start, invocation_id)
+            if recording():
+                await cassettes.add_turn(session.id, session.user_id, request.message, request.reset, text, time.perf_counter() - start)
+            yield sse_message("final", await build_reply(session, text))
+
+        except Exception as e:
+            print(e)
+            if not turn_done:
+                record_turn(turn_runner, start, invocation_id, "error")
+            yield sse_message("error", {"detail": str(e)})
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 if __name__ == "__main__":
     # Run the server
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    if UVICORN_WORKERS > 1:
+        # multiple workers need an import string and a shared session service (SESSION_SERVICE=postgres)
+        if import_queue.store != "postgres":
+            raise ValueError("UVICORN_WORKERS > 1 needs IMPORT_JOBS_STORE=postgres: "
+                             "the status of an import job would be known only by the worker that accepted it.")
+        if metrics.PROMETHEUS_MULTIPROC_DIR:
+            # the workers write their metrics here: start from an empty directory
+            shutil.rmtree(metrics.PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+            os.makedirs(metrics.PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+        uvicorn.run("agent:app", host="0.0.0.0", port=8000, workers=UVICORN_WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,24 @@
+"""
+FastAPI app of agent.py wired to the local fakes of bench/fakes.py, served by the load test (bench/loadtest.py):
+
+    PYTHONPATH=bench:. uvicorn bench_app:app
+
+- the 'gemini-*' models of the agents resolve to ScriptedLlm instead of Gemini
+- the Vertex AI RAG calls of rag_tools.py go to the in-memory FakeRag
+- the documents read for the local BM25 index are the synthetic documents of the fake bucket
+- GCS and the toolbox are reached through STORAGE_EMULATOR_HOST and MCP_TOOLBOX_URL, set by the load test
+"""
+from google.adk.models.registry import LLMRegistry
+
+from fakes import ScriptedLlm, FakeRag, document_chunks
+
+LLMRegistry.register(ScriptedLlm)
+
+import rag_tools
+import question_bank
+
+rag_tools.rag = FakeRag()
+question_bank.rag = rag_tools.rag
+rag_tools.read_document = lambda gcs_uri: "\n\n".join(document_chunks(gcs_uri.rsplit("/", 1)[-1]))
+
+from agent import app
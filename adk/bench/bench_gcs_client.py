@@ -0,0 +1,139 @@
+"""
+Micro-benchmark of the GCS call sites: a new storage.Client per call (previous behaviour)
+versus the shared pooled client of gcs_client.py.
+
+It runs against a local fake GCS endpoint, so no Google Cloud project is needed:
+
+    python bench/bench_gcs_client.py --calls 200 --threads 8
+
+The fake endpoint uses anonymous credentials: the credential loading and token fetch that the shared
+client also saves in production are not part of the numbers.
+"""
+import os
+import sys
+import json
+import socket
+import time
+import argparse
+import threading
+import statistics
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+
+BUCKET_NAME = "bench-bucket"
+BLOB_COUNT = 50
+BLOB_NAMES = [f"file_{i:04d}.pdf" for i in range(BLOB_COUNT)]
+
+class FakeGcsHandler(BaseHTTPRequestHandler):
+    """
+    Minimal JSON API of GCS: list objects of a bucket (GET /storage/v1/b/{bucket}/o)
+    with prefix, startOffset and paging.
+    HTTP/1.1 keep-alive, like the real endpoint.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # headers and body are written separately: avoid the Nagle / delayed ACK stall on kept-alive connections
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == f"/storage/v1/b/{BUCKET_NAME}/o":
+            prefix = query.get("prefix", [""])[0]
+            start = query.get("pageToken", query.get("startOffset", [""]))[0]
+            page_size = int(query.get("maxResults", ["1000"])[0])
+
+            names = [n for n in BLOB_NAMES if n.startswith(prefix) and n >= start]
+            body = {
+                "kind": "storage#objects",
+                "items": [
+                    {
+                        "kind": "storage#object",
+                        "name": name,
+                        "bucket": BUCKET_NAME,
+                        "generation": str(1000 + BLOB_NAMES.index(name)),
+                        "size": str(1024 * (BLOB_NAMES.index(name) + 1)),
+                        "contentType": "application/pdf",
+                        "updated": "2025-11-30T12:00:00.000Z"
+                    }
+                    for name in names[:page_size]
+                ]
+            }
+            if len(names) > page_size:
+                body["nextPageToken"] = names[page_size]
+            self._reply(200, body)
+        else:
+            self._reply(404, {"error": {"code": 404, "message": "Not Found"}})
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_fake_gcs():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGcsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def run(label, call, calls, threads):
+    latencies = []
+
+    def timed():
+        start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+
+    # warm up (credentials, first connection)
+    call()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for f in [pool.submit(timed) for _ in range(calls)]:
+            f.result()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"{label:<28} calls={calls:<5} mean={statistics.mean(latencies)*1000:7.2f} ms  "
+          f"p50={latencies[len(latencies)//2]*1000:7.2f} ms  "
+          f"p95={latencies[int(len(latencies)*0.95)-1]*1000:7.2f} ms  "
+          f"throughput={calls/elapsed:8.1f} calls/s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    server = start_fake_gcs()
+    os.environ["STORAGE_EMULATOR_HOST"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ.setdefault("GOOGLE_CLOUD_PROJECT_ID", "bench-project")
+
+    # the adk modules read the environment at import time
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    from google.cloud import storage
+    from google.auth.credentials import AnonymousCredentials
+    from gcs_client import get_storage_client
+
+    def per_call_client():
+        client = storage.Client(project="bench-project", credentials=AnonymousCredentials(),
+                                client_options={"api_endpoint": os.environ["STORAGE_EMULATOR_HOST"]})
+        return list(client.list_blobs(BUCKET_NAME))
+
+    def shared_client():
+        return list(get_storage_client().list_blobs(BUCKET_NAME))
+
+    print(f"fake GCS at {os.environ['STORAGE_EMULATOR_HOST']}, {BLOB_COUNT} blobs, {args.threads} threads")
+    run("new client per call", per_call_client, args.calls, args.threads)
+    run("shared pooled client", shared_client, args.calls, args.threads)
+
+    server.shutdown()
@@ -0,0 +1,68 @@
+"""
+Benchmark of the two data paths of the login tools:
+MCP Toolbox for Database over HTTP (toolbox_client.py) versus asyncpg in process (pg_tools.py).
+
+It needs the 'postgres' and 'toolbox' containers running (docker compose up) and reads
+MCP_TOOLBOX_URL / DATABASE_URL from adk/.env; from the host use the exposed ports, e.g.:
+
+    MCP_TOOLBOX_URL=http://127.0.0.1:15000 DATABASE_URL=postgresql://postgres:<password>@127.0.0.1:15432/refresh \\
+        python bench/bench_login_db.py --calls 500 --concurrency 16
+
+Both paths run the read-only 'get-student-info' and 'get-last-session' tools.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+# the adk modules read the environment at import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pg_tools
+from db import close_pool
+from toolbox_client import load_tool, close_toolbox
+
+async def run(label, call, calls, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed():
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    # warm up (tool manifest, first connections)
+    await call()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[timed() for _ in range(calls)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"{label:<34} calls={calls:<5} mean={statistics.mean(latencies)*1000:7.2f} ms  "
+          f"p50={latencies[len(latencies)//2]*1000:7.2f} ms  "
+          f"p95={latencies[int(len(latencies)*0.95)-1]*1000:7.2f} ms  "
+          f"throughput={calls/elapsed:8.1f} calls/s")
+
+async def main(args):
+    toolbox_student = await load_tool("get-student-info")
+    toolbox_session = await load_tool("get-last-session")
+
+    await run("toolbox  get-student-info", lambda: toolbox_student(username=args.username), args.calls, args.concurrency)
+    await run("asyncpg  get-student-info", lambda: pg_tools.get_student_info(username=args.username), args.calls, args.concurrency)
+    await run("toolbox  get-last-session", lambda: toolbox_session(student_id=args.student_id), args.calls, args.concurrency)
+    await run("asyncpg  get-last-session", lambda: pg_tools.get_last_session(student_id=args.student_id), args.calls, args.concurrency)
+
+    await close_toolbox()
+    await close_pool()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--username", default="bench")
+    parser.add_argument("--student_id", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,375 @@
+"""
+Local stand-ins of the external services, used by the load test (bench/loadtest.py):
+
+- ScriptedLlm: model backend answering the agents with scripted tool calls and replies (no Gemini calls)
+- FakeRag: in-memory corpus and retriever with the subset of the vertexai.rag API used by rag_tools.py
+- FakeToolboxHandler: MCP Toolbox for Database endpoint serving the 'login-student' tool on an in-memory table
+- the fake GCS endpoint is the one of bench/bench_gcs_client.py
+
+Latencies of the fake services are read from the environment (seconds), so the load test can emulate the real ones:
+BENCH_MODEL_LATENCY, BENCH_RAG_LATENCY, BENCH_RAG_IMPORT_LATENCY, BENCH_TOOLBOX_LATENCY.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import socket
+import asyncio
+import threading
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import AsyncGenerator, Dict, Any, List, Optional
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types
+
+BENCH_MODEL_LATENCY = float(os.getenv("BENCH_MODEL_LATENCY", "0.3"))
+BENCH_RAG_LATENCY = float(os.getenv("BENCH_RAG_LATENCY", "0.1"))
+BENCH_RAG_IMPORT_LATENCY = float(os.getenv("BENCH_RAG_IMPORT_LATENCY", "1"))
+BENCH_TOOLBOX_LATENCY = float(os.getenv("BENCH_TOOLBOX_LATENCY", "0.005"))
+
+TOPICS = ["fire", "ladder", "chemicals", "electricity", "noise", "lifting", "helmet", "first aid"]
+
+def document_chunks(file_name: str) -> List[str]:
+    """
+    Synthetic content of a document of the fake bucket: a few chunks about the workplace safety topics.
+    """
+    seed = sum(ord(c) for c in file_name)
+    chunks = []
+    for i in range(4):
+        topic = TOPICS[(seed + i) % len(TOPICS)]
+        chunks.append(f"{file_name} section {i + 1}: safety rules about {topic}. "
+                      f"Workers must be trained on {topic} risks, use the protective equipment "
+                      f"required for {topic} and report every {topic} incident to the supervisor.")
+    return chunks
+
+# ------------------------------------------------------------------------------------------------
+# Model
+# ------------------------------------------------------------------------------------------------
+
+def _text(content: types.Content) -> str:
+    return " ".join(p.text for p in (content.parts or []) if p.text)
+
+def _last_student_message(contents: List[types.Content]) -> str:
+    # the events of the other agents are given to the model as 'For context:' user contents
+    for content in reversed(contents):
+        text = _text(content)
+        if content.role == "user" and text and not text.startswith("For context:"):
+            return text
+    return ""
+
+def _last_model_text(contents: List[types.Content]) -> str:
+    for content in reversed(contents):
+        if content.role == "model" and _text(content):
+            return _text(content)
+    return ""
+
+def _instruction(llm_request: LlmRequest) -> str:
+    instruction = llm_request.config.system_instruction if llm_request.config else None
+    if instruction is None:
+        return ""
+    if isinstance(instruction, str):
+        return instruction
+    return _text(instruction) if isinstance(instruction, types.Content) else str(instruction)
+
+def _argument(instruction: str, name: str) -> Optional[str]:
+    # the agent instructions contain "'bucket_name'=<value>" once the state placeholders are filled
+    match = re.search(rf"'{name}'=([\w.\-]+)", instruction)
+    return match.group(1) if match else None
+
+class ScriptedLlm(BaseLlm):
+    """
+    Scripted model backend: it plays the part of Gemini for the agents of this application.
+    The reply depends on the tools offered to the agent and on the last content of the request:
+    - root_agent: call 'check_login_status', then transfer to logger_agent / activity_agent
+    - activity_agent: 'list' -> 'list_blobs_in_bucket', 'import <file>' -> 'import_document_to_corpus',
+      'status <job id>' -> 'get_import_status', 'quiz' -> transfer to question_agent
+    - question_agent: 'retrieve_context' on the topic, then a question; the next message is graded
+    Each call waits BENCH_MODEL_LATENCY seconds and reports token counts estimated from the text length.
+    The login protocol of logger_agent is not scripted: use LOGIN_FLOW=code.
+    """
+
+    @classmethod
+    def supported_models(cls) -> List[str]:
+        return [r"gemini-.*"]
+
+    def respond(self, llm_request: LlmRequest) -> types.Content:
+        tools = set(llm_request.tools_dict)
+        contents = llm_request.contents or []
+        last = contents[-1] if contents else None
+        responses = [p.function_response for p in (last.parts or []) if p.function_response] if last else []
+        message = _last_student_message(contents)
+        instruction = _instruction(llm_request)
+
+        def call(name: str, **args) -> types.Content:
+            return types.Content(role="model", parts=[types.Part(function_call=types.FunctionCall(id=f"adk-{uuid.uuid4()}", name=name, args=args))])
+
+        def reply(text: str) -> types.Content:
+            return types.Content(role="model", parts=[types.Part(text=text)])
+
+        if responses:
+            response = responses[0]
+            result = response.response or {}
+            if response.name == "check_login_status":
+                logged_in = "logged_in" in json.dumps(result)
+                return call("transfer_to_agent", agent_name="activity_agent" if logged_in else "logger_agent")
+            if response.name == "retrieve_context":
+                context = str(result.get("result", result))
+                sentence = context.split("\n")[1] if "\n" in context else context
+                return reply(f"Domanda: secondo il documento, quali sono le regole principali? ({sentence[:120]})?")
+            return reply(f"Ecco il risultato di {response.name}: {json.dumps(result, default=str)[:400]}")
+
+        if "check_login_status" in tools:
+            return call("check_login_status")
+
+        lowered = message.lower()
+        activity_request = "quiz" not in lowered and any(w in lowered for w in ("list", "import", "status"))
+        if "retrieve_context" in tools:
+            if activity_request and "transfer_to_agent" in tools:
+                # back to the parent agent, like Gemini does when the student leaves the quiz
+                return call("transfer_to_agent", agent_name="activity_agent")
+            if _last_model_text(contents).endswith("?") and "quiz" not in lowered:
+                return reply("Punteggio: 4/5. La risposta copre le regole principali del documento.")
+            topic = re.sub(r"^.*\b(?:quiz|about|on)\b\s*", "", lowered).strip() or lowered
+            return call("retrieve_context", query=topic)
+
+        if "list_blobs_in_bucket" in tools:
+            bucket_name = _argument(instruction, "bucket_name") or "bench-bucket"
+            if "quiz" in lowered or lowered.strip() == "3":
+                if "transfer_to_agent" in tools:
+                    return call("transfer_to_agent", agent_name="question_agent")
+            elif "status" in lowered and "get_import_status" in tools:
+                return call("get_import_status", job_id=message.split()[-1])
+            elif "import" in lowered:
+                return call("import_document_to_corpus", corpus_id=_argument(instruction, "corpus_id") or "bench-corpus",
+                            bucket_name=bucket_name, file_name=message.split()[-1])
+            elif "list" in lowered or lowered.strip() == "1":
+                return call("list_blobs_in_bucket", bucket_name=bucket_name, max_size=7000000)
+
+        return reply("Ciao! Posso elencare i file (1), importare un file (2) o farti una domanda di verifica (3).")
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        await asyncio.sleep(BENCH_MODEL_LATENCY)
+        content = self.respond(llm_request)
+
+        prompt_tokens = sum(len(_text(c)) for c in (llm_request.contents or [])) // 4 + len(_instruction(llm_request)) // 4
+        response_tokens = max(1, len(_text(content)) // 4)
+        usage = types.GenerateContentResponseUsageMetadata(prompt_token_count=prompt_tokens, candidates_token_count=response_tokens,
+                                                           total_token_count=prompt_tokens + response_tokens)
+
+        text = _text(content)
+        if stream and text:
+            # a couple of partial chunks before the aggregated response, like the SSE streaming of Gemini
+            middle = len(text) // 2
+            for chunk in (text[:middle], text[middle:]):
+                yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text=chunk)]), partial=True)
+        yield LlmResponse(content=content, usage_metadata=usage, turn_complete=True)
+
+# ------------------------------------------------------------------------------------------------
+# RAG
+# ------------------------------------------------------------------------------------------------
+
+class FakeRag:
+    """
+    In-memory replacement of the 'vertexai.rag' module: corpora of imported files and a word overlap retriever.
+    Every worker process has its own corpora.
+    """
+
+    def __init__(self):
+        self._files: Dict[str, Dict[str, Any]] = {}   # corpus name -> rag file name -> file
+        self._lock = threading.Lock()
+
+    # configuration objects: the arguments are accepted and ignored
+    @staticmethod
+    def RagResource(**kwargs):
+        return SimpleNamespace(**kwargs)
+
+    @staticmethod
+    def ChunkingConfig(**kwargs):
+        return SimpleNamespace(**kwargs)
+
+    @staticmethod
+    def LlmParserConfig(**kwargs):
+        return SimpleNamespace(**kwargs)
+
+    @staticmethod
+    def TransformationConfig(**kwargs):
+        return SimpleNamespace(**kwargs)
+
+    def import_files(self, corpus_name: str, paths: List[str], **kwargs):
+        time.sleep(BENCH_RAG_IMPORT_LATENCY)
+        with self._lock:
+            files = self._files.setdefault(corpus_name, {})
+            now = datetime.now(timezone.utc)
+            for uri in paths:
+                display_name = uri.rsplit("/", 1)[-1]
+                name = f"{corpus_name}/ragFiles/{abs(hash(uri))}"
+                files[name] = SimpleNamespace(name=name, display_name=display_name, gcs_source=SimpleNamespace(uris=[uri]),
+                                              chunks=document_chunks(display_name), source_uri=uri,
+                                              create_time=files[name].create_time if name in files else now, update_time=now)
+        return SimpleNamespace(imported_rag_files_count=len(paths), failed_rag_files_count=0, skipped_rag_files_count=0)
+
+    def list_files(self, corpus_name: str):
+        with self._lock:
+            return list(self._files.get(corpus_name, {}).values())
+
+    def delete_file(self, name: str):
+        with self._lock:
+            for files in self._files.values():
+                files.pop(name, None)
+
+    def list_corpora(self):
+        with self._lock:
+            return [SimpleNamespace(name=name, display_name=name.rsplit("/", 1)[-1], description="bench corpus")
+                    for name in self._files]
+
+    def retrieval_query(self, text: str, rag_resources: List[Any] = None, rag_retrieval_config: Any = None, **kwargs):
+        time.sleep(BENCH_RAG_LATENCY)
+        words = set(re.findall(r"\w+", text.lower()))
+        corpora = [r.rag_corpus for r in (rag_resources or [])]
+        file_ids = {i for r in (rag_resources or []) for i in (getattr(r, "rag_file_ids", None) or [])}
+        top_k = getattr(rag_retrieval_config, "top_k", None) or 5
+
+        scored = []
+        with self._lock:
+            files = [f for corpus in corpora for f in self._files.get(corpus, {}).values()
+                     if not file_ids or f.name.rsplit("/", 1)[-1] in file_ids]
+        # an empty corpus answers from a default document, so the quiz works before the first import
+        sources = [(f.source_uri, f.chunks) for f in files]
+        if not sources and not file_ids:
+            sources = [("gs://bench-bucket/default.pdf", document_chunks("default.pdf"))]
+        for uri, chunks in sources:
+            for chunk in chunks:
+                overlap = len(words & set(re.findall(r"\w+", chunk.lower())))
+                if overlap:
+                    scored.append((overlap, uri, chunk))
+        scored.sort(key=lambda s: -s[0])
+
+        contexts = [SimpleNamespace(text=chunk, source_uri=uri, distance=1.0 / (1 + overlap))
+                    for overlap, uri, chunk in scored[:top_k]]
+        return SimpleNamespace(contexts=SimpleNamespace(contexts=contexts))
+
+# ------------------------------------------------------------------------------------------------
+# Toolbox
+# ------------------------------------------------------------------------------------------------
+
+MCP_PROTOCOL_VERSION = "2025-06-18"
+
+LOGIN_STUDENT_TOOL = {
+    "name": "login-student",
+    "description": "Login of a student in one step.",
+    "inputSchema": {
+        "type": "object",
+        "properties": {
+            "username": {"type": "string", "description": "The name of the student, in lowercase"},
+            "email": {"type": "string", "description": "The email of the student, '' if not provided"},
+            "session_name": {"type": "string", "description": "The name of the session to add, '' if not provided"},
+            "guid": {"type": "string", "description": "The session guid related to agent session service"}
+        },
+        "required": ["username", "email", "session_name", "guid"]
+    }
+}
+
+class LoginTable:
+    """
+    In-memory version of the students / sessions tables and of the public.login_student function (postgres/init.sql).
+    """
+
+    def __init__(self):
+        self.students: Dict[str, Dict[str, Any]] = {}
+        self.sessions: Dict[int, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def login_student(self, username: str, email: str, session_name: str, guid: str) -> Dict[str, Any]:
+        username = username.lower()
+        with self._lock:
+            student = self.students.get(username)
+            new_student = False
+            if student is None:
+                if not email:
+                    return {"status": "email_required", "username": username}
+                if any(s["email"] == email for s in self.students.values()):
+                    return {"status": "email_in_use", "username": username, "email": email}
+                student = {"id": len(self.students) + 1, "username": username, "email": email}
+                self.students[username] = student
+                new_student = True
+
+            session = self.sessions.get(student["id"])
+            new_session = False
+            if session is None:
+                if not session_name:
+                    return {"status": "session_name_required", "student_id": student["id"], "username": username,
+                            "new_student": new_student}
+                session = {"guid": guid, "name": session_name}
+                self.sessions[student["id"]] = session
+                new_session = True
+
+        return {"status": "ok", "student_id": student["id"], "username": username, "email": student["email"],
+                "guid": session["guid"], "session_name": session["name"], "new_student": new_student, "new_session": new_session}
+
+class FakeToolboxHandler(BaseHTTPRequestHandler):
+    """
+    Minimal MCP endpoint of the toolbox (JSON-RPC over HTTP, POST /mcp/ and /mcp/<toolset>):
+    initialize, tools/list and tools/call of 'login-student'. Protocol version 2025-06-18: clients asking for
+    a newer version are told to fall back to it.
+    """
+    protocol_version = "HTTP/1.1"
+    table = LoginTable()
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", "0")))
+        message = json.loads(body or b"{}")
+        method = message.get("method")
+        params = message.get("params") or {}
+        version = self.headers.get("MCP-Protocol-Version") or params.get("protocolVersion")
+
+        if "id" not in message:
+            # notification (notifications/initialized)
+            self._reply(202, None)
+            return
+
+        if version and version != MCP_PROTOCOL_VERSION:
+            self._reply(200, {"jsonrpc": "2.0", "id": message["id"], "error": {
+                "code": -32022, "message": "unsupported protocol version", "data": {"supported": [MCP_PROTOCOL_VERSION]}}})
+            return
+
+        if method == "initialize":
+            result = {"protocolVersion": MCP_PROTOCOL_VERSION, "capabilities": {"tools": {"listChanged": False}},
+                      "serverInfo": {"name": "fake-toolbox", "version": "bench"}}
+        elif method == "tools/list":
+            result = {"tools": [LOGIN_STUDENT_TOOL]}
+        elif method == "tools/call" and params.get("name") == "login-student":
+            time.sleep(BENCH_TOOLBOX_LATENCY)
+            args = params.get("arguments") or {}
+            login = self.table.login_student(args.get("username", ""), args.get("email", ""), args.get("session_name", ""), args.get("guid", ""))
+            result = {"content": [{"type": "text", "text": json.dumps([{"login": login}])}], "isError": False}
+        else:
+            self._reply(200, {"jsonrpc": "2.0", "id": message["id"], "error": {"code": -32601, "message": f"Unknown method {method}"}})
+            return
+
+        self._reply(200, {"jsonrpc": "2.0", "id": message["id"], "result": result})
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_fake_toolbox():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeToolboxHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
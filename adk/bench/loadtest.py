@@ -0,0 +1,360 @@
+"""
+Load test of the /chat API without Google services.
+
+It starts the fake GCS (bench_gcs_client.py) and the fake toolbox (fakes.py) in this process, serves bench_app.py
+(agent.py with the scripted model and the in-memory RAG) with uvicorn and drives concurrent simulated students
+through the whole flow: login (username, email, session name), file list, import, quiz question and answer.
+From the adk directory:
+
+    python bench/loadtest.py --students 50 --rounds 2 --workers 1 --json loadtest.json
+
+It reports throughput, p50/p95/p99 latency per step and the memory (RSS) of every worker.
+With --max-p95-ms, --max-error-rate and --min-throughput the exit code is 1 when a threshold is not met,
+so the load test can gate a pipeline.
+More than one worker needs the sessions shared between the workers: --session-service postgres with DATABASE_URL.
+The latencies of the fakes are set with --model-latency, --rag-latency and --import-latency.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+from typing import Dict, Any, List, Optional
+
+import aiohttp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ADK_DIR = os.path.dirname(BENCH_DIR)
+
+from bench_gcs_client import start_fake_gcs, BUCKET_NAME, BLOB_NAMES
+from fakes import start_fake_toolbox
+
+# step name, message, text expected in the reply
+LOGIN_STEPS = [
+    ("hello", "hello", "username"),
+    ("username", "my name is {username}", "email"),
+    ("email", "my email is {username}@bench.local", "session"),
+    ("session_name", "call it bench session", "Login completed")
+]
+
+def activity_steps(student: int, round_: int) -> List[tuple]:
+    file_name = BLOB_NAMES[(student + round_) % len(BLOB_NAMES)]
+    return [
+        ("list", "1. list the files", "list_blobs_in_bucket"),
+        ("import", f"2. import {file_name}", "import_document_to_corpus"),
+        ("quiz_question", "quiz about fire safety", "?"),
+        ("quiz_answer", "workers must be trained and use the protective equipment", "Punteggio")
+    ]
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def rss_kb(pid: int) -> Dict[str, int]:
+    """
+    Current (VmRSS) and peak (VmHWM) resident memory of a process, from /proc (Linux).
+    """
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key, value = line.split(":", 1)
+                    memory[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return memory
+
+def worker_pids(server_pid: int) -> List[int]:
+    """
+    The uvicorn worker processes: the children started by the server (multiprocessing spawn), or the server itself.
+    """
+    workers = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                cmdline = f.read()
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == server_pid and b"spawn_main" in cmdline:
+            workers.append(int(entry))
+    return workers or [server_pid]
+
+class Stats:
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.unexpected: Dict[str, int] = defaultdict(int)
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        turns = sum(len(v) for v in self.latencies.values())
+        errors = sum(self.errors.values())
+        all_latencies = [l for v in self.latencies.values() for l in v]
+
+        def summary(values):
+            return {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 1) if values else None,
+                "p95_ms": round(percentile(values, 95) * 1000, 1) if values else None,
+                "p99_ms": round(percentile(values, 99) * 1000, 1) if values else None,
+                "max_ms": round(max(values) * 1000, 1) if values else None
+            }
+
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "turns": turns,
+            "errors": errors,
+            "error_rate": round(errors / max(1, turns + errors), 4),
+            "unexpected_replies": sum(self.unexpected.values()),
+            "throughput_turns_s": round(turns / elapsed, 2) if elapsed else None,
+            "latency": summary(all_latencies),
+            "steps": {step: dict(summary(values), errors=self.errors.get(step, 0), unexpected=self.unexpected.get(step, 0))
+                      for step, values in self.latencies.items()}
+        }
+
+async def chat(http: aiohttp.ClientSession, url: str, stream: bool, body: Dict[str, Any]) -> Dict[str, Any]:
+    if not stream:
+        async with http.post(f"{url}/chat", json=body) as response:
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}: {await response.text()}")
+            return await response.json()
+
+    # /chat/stream: read the server-sent events until 'final' (or 'error')
+    async with http.post(f"{url}/chat/stream", json=body) as response:
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}: {await response.text()}")
+        event_name = None
+        async for line in response.content:
+            line = line.decode().strip()
+            if line.startswith("event:"):
+                event_name = line[6:].strip()
+            elif line.startswith("data:") and event_name in ("final", "error"):
+                data = json.loads(line[5:])
+                if event_name == "error":
+                    raise RuntimeError(data.get("detail"))
+                return data
+    raise RuntimeError("stream closed without a final event")
+
+async def run_student(http: aiohttp.ClientSession, url: str, student: int, args, stats: Stats):
+    username = f"bench{args.seed}_{student}"
+    state = {"session_id": None, "user_id": None}
+
+    async def turn(step: str, message: str, expected: str) -> bool:
+        body = {"message": message.format(username=username), "session_id": state["session_id"], "user_id": state["user_id"]}
+        start = time.perf_counter()
+        try:
+            reply = await chat(http, url, args.stream, body)
+        except Exception as e:
+            stats.errors[step] += 1
+            if args.verbose:
+                print(f"student {student} {step}: ERROR {e}")
+            return False
+        stats.latencies[step].append(time.perf_counter() - start)
+        state["session_id"] = reply.get("session_id") or state["session_id"]
+        state["user_id"] = reply.get("user_id") if reply.get("user_id") not in (None, "0") else state["user_id"]
+        if expected.lower() not in (reply.get("response") or "").lower():
+            stats.unexpected[step] += 1
+            if args.verbose:
+                print(f"student {student} {step}: unexpected reply {reply.get('response')!r}")
+        return True
+
+    for step, message, expected in LOGIN_STEPS:
+        if not await turn(step, message, expected):
+            return
+
+    for round_ in range(args.rounds):
+        for step, message, expected in activity_steps(student, round_):
+            if not await turn(step, message, expected):
+                return
+            if args.think_time:
+                await asyncio.sleep(args.think_time)
+
+async def drive(url: str, args, server_pid: int) -> Dict[str, Any]:
+    stats = Stats()
+    memory: Dict[int, Dict[str, int]] = {}
+    done = asyncio.Event()
+
+    async def sample_memory():
+        while not done.is_set():
+            for pid in worker_pids(server_pid):
+                memory[pid] = rss_kb(pid)
+            try:
+                await asyncio.wait_for(done.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+
+    connector = aiohttp.TCPConnector(limit=args.students)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as http:
+        sampler = asyncio.create_task(sample_memory())
+        semaphore = asyncio.Semaphore(args.students)
+
+        async def student_task(student):
+            # students start spread over the ramp up time
+            await asyncio.sleep(args.ramp_up * student / max(1, args.students))
+            async with semaphore:
+                await run_student(http, url, student, args, stats)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[student_task(s) for s in range(args.students)])
+        elapsed = time.perf_counter() - start
+
+        done.set()
+        await sampler
+        for pid in worker_pids(server_pid):
+            memory[pid] = rss_kb(pid)
+
+        async with http.get(f"{url}/metrics") as response:
+            metrics_text = await response.text()
+
+    report = stats.report(elapsed)
+    report["workers"] = [{"pid": pid, "rss_mb": round(m.get("VmRSS", 0) / 1024, 1), "peak_rss_mb": round(m.get("VmHWM", 0) / 1024, 1)}
+                         for pid, m in sorted(memory.items())]
+    report["model_calls"] = sum(float(line.rsplit(" ", 1)[1]) for line in metrics_text.splitlines()
+                                if line.startswith("refresh_model_calls_total{"))
+    return report
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float):
+    import urllib.request
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"the server exited with code {process.returncode}, see the server log")
+        try:
+            with urllib.request.urlopen(f"{url}/metrics", timeout=2):
+                return
+        except Exception:
+            time.sleep(0.5)
+    raise RuntimeError(f"the server did not start in {timeout} s")
+
+def check_gates(report: Dict[str, Any], args) -> List[str]:
+    failures = []
+    p95 = report["latency"]["p95_ms"]
+    if args.max_p95_ms is not None and (p95 is None or p95 > args.max_p95_ms):
+        failures.append(f"p95 {p95} ms > {args.max_p95_ms} ms")
+    if args.max_error_rate is not None and report["error_rate"] > args.max_error_rate:
+        failures.append(f"error rate {report['error_rate']} > {args.max_error_rate}")
+    if args.min_throughput is not None and (report["throughput_turns_s"] or 0) < args.min_throughput:
+        failures.append(f"throughput {report['throughput_turns_s']} turns/s < {args.min_throughput}")
+    if args.max_unexpected is not None and report["unexpected_replies"] > args.max_unexpected:
+        failures.append(f"unexpected replies {report['unexpected_replies']} > {args.max_unexpected}")
+    return failures
+
+def print_report(report: Dict[str, Any]):
+    print(f"\nturns={report['turns']}  errors={report['errors']}  unexpected={report['unexpected_replies']}  "
+          f"elapsed={report['elapsed_s']} s  throughput={report['throughput_turns_s']} turns/s  model calls={report['model_calls']:.0f}")
+    print(f"{'step':<16}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+    for step, s in list(report["steps"].items()) + [("ALL", report["latency"])]:
+        print(f"{step:<16}{s['count']:>7}{s['p50_ms'] or 0:>10}{s['p95_ms'] or 0:>10}{s['p99_ms'] or 0:>10}{s['max_ms'] or 0:>10}{s.get('errors', report['errors']):>8}")
+    for worker in report["workers"]:
+        print(f"worker pid={worker['pid']}  rss={worker['rss_mb']} MB  peak={worker['peak_rss_mb']} MB")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--students", type=int, default=20, help="concurrent simulated students")
+    parser.add_argument("--rounds", type=int, default=1, help="list / import / quiz rounds after the login")
+    parser.add_argument("--ramp-up", type=float, default=2, help="seconds over which the students start")
+    parser.add_argument("--think-time", type=float, default=0, help="pause of a student between two messages")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--stream", action="store_true", help="use /chat/stream instead of /chat")
+    parser.add_argument("--router", choices=["direct", "llm"], default="direct", help="ROUTER_MODE of the server")
+    parser.add_argument("--session-service", choices=["memory", "postgres"], default="memory")
+    parser.add_argument("--model-latency", type=float, default=0.3)
+    parser.add_argument("--rag-latency", type=float, default=0.1)
+    parser.add_argument("--import-latency", type=float, default=1)
+    parser.add_argument("--timeout", type=float, default=120, help="timeout of a turn")
+    parser.add_argument("--seed", default=str(int(time.time())), help="part of the usernames, to start with new students")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--server-log", default=os.path.join(tempfile.gettempdir(), "loadtest_server.log"))
+    parser.add_argument("--max-p95-ms", type=float)
+    parser.add_argument("--max-error-rate", type=float)
+    parser.add_argument("--min-throughput", type=float)
+    parser.add_argument("--max-unexpected", type=int)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.workers > 1 and args.session_service == "memory":
+        parser.error("more than one worker needs --session-service postgres (the sessions must be shared by the workers)")
+
+    gcs = start_fake_gcs()
+    toolbox = start_fake_toolbox()
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join([BENCH_DIR, ADK_DIR, os.environ.get("PYTHONPATH", "")]),
+               GOOGLE_API_KEY=os.environ.get("GOOGLE_API_KEY", "bench"),
+               GOOGLE_CLOUD_PROJECT_ID="bench-project",
+               GOOGLE_CLOUD_LOCATION="us-central1",
+               STORAGE_EMULATOR_HOST=f"http://127.0.0.1:{gcs.server_port}",
+               MCP_TOOLBOX_URL=f"http://127.0.0.1:{toolbox.server_port}",
+               DEFAULT_BUCKET_NAME=BUCKET_NAME,
+               DEFAULT_CORPUS_ID="bench-corpus",
+               DEFAULT_CORPUS_NAME="bench-corpus",
+               SESSION_SERVICE=args.session_service,
+               ROUTER_MODE=args.router,
+               LOGIN_FLOW="code",
+               LOGIN_DB_BACKEND="toolbox",
+               IMPORT_MANIFEST_ENABLED="False",
+               USAGE_ENABLED="False",
+               QUESTION_BANK_ENABLED="False",
+               TRACE_OUTPUT="none",
+               BENCH_MODEL_LATENCY=str(args.model_latency),
+               BENCH_RAG_LATENCY=str(args.rag_latency),
+               BENCH_RAG_IMPORT_LATENCY=str(args.import_latency))
+    if args.workers > 1:
+        env["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="loadtest_metrics_")
+    else:
+        env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+    print(f"fake GCS {env['STORAGE_EMULATOR_HOST']}, fake toolbox {env['MCP_TOOLBOX_URL']}, server {url} "
+          f"({args.workers} worker(s), log {args.server_log})")
+    with open(args.server_log, "w") as log:
+        server = subprocess.Popen([sys.executable, "-m", "uvicorn", "bench_app:app", "--host", "127.0.0.1", "--port", str(port),
+                                   "--workers", str(args.workers), "--log-level", "warning"],
+                                  cwd=ADK_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_ready(url, server, timeout=120)
+        print(f"{args.students} students, {args.rounds} round(s), {'/chat/stream' if args.stream else '/chat'}, router {args.router}")
+        report = asyncio.run(drive(url, args, server.pid))
+    finally:
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        gcs.shutdown()
+        toolbox.shutdown()
+
+    report["config"] = {k: v for k, v in vars(args).items() if k not in ("json", "server_log", "verbose")}
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failures = check_gates(report, args)
+    for failure in failures:
+        print(f"GATE FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Offline replay of recorded sessions (see cassette.py).
+
+Record the cassettes with a server running with CASSETTE_MODE=record (live services, or the load test:
+CASSETTE_MODE=record CASSETTE_DIR=/tmp/cassettes python bench/loadtest.py ...), then from the adk directory:
+
+    python bench/replay.py --cassettes /tmp/cassettes --latency recorded --concurrency 8
+
+It starts agent.py with CASSETTE_MODE=replay, so the model and tool calls are served from the cassettes
+(no Gemini, Vertex AI, GCS or toolbox calls), and sends the recorded /chat turns of every session again:
+the sessions run concurrently, the turns of a session in their recorded order.
+It reports the latency of the turns, the replies that differ from the recorded ones and the cassette counters
+(misses, request mismatches). With --profile the server runs under cProfile and writes the stats to that file.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import signal
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, Any, List
+
+import aiohttp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ADK_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ADK_DIR)
+
+from cassette import read_cassette
+from loadtest import free_port, percentile, wait_ready
+
+def load_sessions(directory: str) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Recorded turns of every session, in order.
+    """
+    sessions = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.jsonl.gz"))):
+        turns = [entry for entry in read_cassette(path) if entry["kind"] == "turn"]
+        if turns:
+            sessions[turns[0]["session_id"]] = turns
+    return sessions
+
+async def replay(url: str, sessions: Dict[str, List[Dict[str, Any]]], concurrency: int, timeout: float) -> Dict[str, Any]:
+    latencies = []
+    recorded = []
+    errors = 0
+    different = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def replay_session(turns):
+        nonlocal errors, different
+        async with semaphore:
+            for turn in turns:
+                body = {"message": turn["message"], "session_id": turn["session_id"], "user_id": turn["user_id"], "reset": turn.get("reset")}
+                start = time.perf_counter()
+                try:
+                    async with http.post(f"{url}/chat", json=body) as response:
+                        if response.status != 200:
+                            raise RuntimeError(f"HTTP {response.status}: {await response.text()}")
+                        reply = await response.json()
+                except Exception as e:
+                    print(f"session {turn['session_id']}: ERROR {e}")
+                    errors += 1
+                    return
+                latencies.append(time.perf_counter() - start)
+                recorded.append(turn["duration"])
+                if reply.get("response") != turn["response"]:
+                    different += 1
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*[replay_session(turns) for turns in sessions.values()])
+        elapsed = time.perf_counter() - start
+        async with http.get(f"{url}/stats/cassette") as response:
+            cassette_stats = await response.json()
+
+    def ms(values, p):
+        value = percentile(values, p)
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        "sessions": len(sessions),
+        "turns": len(latencies),
+        "errors": errors,
+        "different_replies": different,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_turns_s": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency": {"p50_ms": ms(latencies, 50), "p95_ms": ms(latencies, 95), "p99_ms": ms(latencies, 99)},
+        "recorded_latency": {"p50_ms": ms(recorded, 50), "p95_ms": ms(recorded, 95), "p99_ms": ms(recorded, 99)},
+        "cassette": cassette_stats
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cassettes", default="cassettes", help="directory of the recorded cassettes")
+    parser.add_argument("--latency", default="0", help="latency of every replayed call: 'recorded' or seconds")
+    parser.add_argument("--scale", type=float, default=1, help="factor applied to the replayed latency")
+    parser.add_argument("--concurrency", type=int, default=8, help="sessions replayed at the same time")
+    parser.add_argument("--timeout", type=float, default=120, help="timeout of a turn")
+    parser.add_argument("--router", choices=["direct", "llm"], default="direct", help="ROUTER_MODE of the recording server")
+    parser.add_argument("--login-flow", choices=["code", "llm"], default="code", help="LOGIN_FLOW of the recording server")
+    parser.add_argument("--profile", help="run the server under cProfile and write the stats to this file")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--server-log", default=os.path.join(tempfile.gettempdir(), "replay_server.log"))
+    args = parser.parse_args()
+
+    sessions = load_sessions(args.cassettes)
+    if not sessions:
+        parser.error(f"no recorded turns in {args.cassettes}")
+
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join([ADK_DIR, os.environ.get("PYTHONPATH", "")]),
+               GOOGLE_API_KEY=os.environ.get("GOOGLE_API_KEY", "replay"),
+               CASSETTE_MODE="replay",
+               CASSETTE_DIR=os.path.abspath(args.cassettes),
+               CASSETTE_REPLAY_LATENCY=args.latency,
+               CASSETTE_LATENCY_SCALE=str(args.scale),
+               SESSION_SERVICE="memory",
+               ROUTER_MODE=args.router,
+               LOGIN_FLOW=args.login_flow,
+               USAGE_ENABLED="False",
+               QUESTION_BANK_ENABLED="False",
+               TRACE_OUTPUT="none")
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+    command = [sys.executable]
+    if args.profile:
+        command += ["-m", "cProfile", "-o", os.path.abspath(args.profile)]
+    command += ["-m", "uvicorn", "agent:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+
+    print(f"{len(sessions)} sessions from {args.cassettes}, server {url} (log {args.server_log})")
+    with open(args.server_log, "w") as log:
+        server = subprocess.Popen(command, cwd=ADK_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_ready(url, server, timeout=120)
+        report = asyncio.run(replay(url, sessions, args.concurrency, args.timeout))
+    finally:
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    print(json.dumps(report, indent=2))
+    if args.profile:
+        print(f"profile written to {args.profile} (python -m pstats {args.profile})")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
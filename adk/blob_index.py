@@ -0,0 +1,153 @@
+import os
+import time
+import bisect
+import threading
+from collections import namedtuple
+from typing import Dict, Any, Optional, List, Iterator
+from dotenv import load_dotenv
+
+from gcs_client import get_storage_client
+
+load_dotenv()
+GCS_BLOB_INDEX_TTL = float(os.getenv("GCS_BLOB_INDEX_TTL", "300"))
+
+# In-process index of the blobs of each bucket, used by list_blobs_in_bucket instead of listing the bucket on every call.
+# Names are kept sorted, so prefix / folder queries and paging are answered locally with a binary search.
+# When the index is older than GCS_BLOB_INDEX_TTL, or has been invalidated (e.g. an import was triggered),
+# the current content is still served while a background thread lists the bucket again and applies the changes
+# (added / removed / changed generation) to the index.
+
+IndexedBlob = namedtuple("IndexedBlob", ["name", "size", "content_type", "generation", "updated"])
+
+class BucketIndex:
+
+    def __init__(self, bucket_name: str, ttl: float = GCS_BLOB_INDEX_TTL):
+        self.bucket_name = bucket_name
+        self.ttl = ttl
+        self.names: List[str] = []
+        self.blobs: Dict[str, IndexedBlob] = {}
+        self.refreshed_at: Optional[float] = None
+        self.refresh_seconds: Optional[float] = None
+        self.last_changes: Dict[str, int] = {}
+        self.last_error: Optional[str] = None
+        self._invalidated = False
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def is_stale(self) -> bool:
+        return self._invalidated or self.refreshed_at is None or time.time() - self.refreshed_at > self.ttl
+
+    def refresh(self):
+        """
+        List the bucket and apply the differences to the index.
+        """
+        start = time.time()
+        # an invalidation arriving while listing keeps the index stale for the next query
+        self._invalidated = False
+        try:
+            listed = {}
+            for blob in get_storage_client().list_blobs(self.bucket_name):
+                listed[blob.name] = IndexedBlob(blob.name, blob.size, blob.content_type, blob.generation, blob.updated)
+
+            with self._lock:
+                added = [n for n in listed if n not in self.blobs]
+                removed = [n for n in self.blobs if n not in listed]
+                changed = [n for n, b in listed.items() if n in self.blobs and self.blobs[n].generation != b.generation]
+
+                if added or removed:
+                    self.names = sorted(listed)
+                for name in removed:
+                    del self.blobs[name]
+                for name in added + changed:
+                    self.blobs[name] = listed[name]
+
+                self.refreshed_at = start
+                self.refresh_seconds = time.time() - start
+                self.last_changes = {"added": len(added), "removed": len(removed), "changed": len(changed)}
+                self.last_error = None
+
+            print(f"BLOB INDEX {self.bucket_name}: {len(self.names)} blob(s), changes {self.last_changes}")
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"BLOB INDEX {self.bucket_name} REFRESH ERROR: {e}")
+            if self.refreshed_at is None:
+                raise
+        finally:
+            self._refreshing = False
+
+    def ensure_loaded(self):
+        """
+        Load the index on first use (blocking). Afterwards a stale index triggers a background refresh.
+        """
+        if self.refreshed_at is None:
+            with self._load_lock:
+                if self.refreshed_at is None:
+                    self._refreshing = True
+                    self.refresh()
+        elif self.is_stale():
+            with self._lock:
+                if self._refreshing:
+                    return
+                self._refreshing = True
+            threading.Thread(target=self.refresh, name=f"blob-index-{self.bucket_name}", daemon=True).start()
+
+    def invalidate(self):
+        self._invalidated = True
+
+    def iter_blobs(self, prefix: Optional[str] = None, start_after: Optional[str] = None) -> Iterator[IndexedBlob]:
+        """
+        Iterate the blobs in name order, starting after 'start_after' and stopping at the end of 'prefix'.
+        """
+        prefix = prefix or ""
+        with self._lock:
+            names = self.names
+            blobs = self.blobs
+
+        if start_after and start_after >= prefix:
+            i = bisect.bisect_right(names, start_after)
+        else:
+            i = bisect.bisect_left(names, prefix)
+
+        while i < len(names) and names[i].startswith(prefix):
+            blob = blobs.get(names[i])
+            if blob is not None:
+                yield blob
+            i += 1
+
+    def staleness(self) -> Dict[str, Any]:
+        return {
+            "blob_count": len(self.names),
+            "refreshed_at": self.refreshed_at,
+            "age_seconds": round(time.time() - self.refreshed_at, 1) if self.refreshed_at else None,
+            "stale": self.is_stale(),
+            "refreshing": self._refreshing,
+            "refresh_seconds": self.refresh_seconds,
+            "last_changes": self.last_changes,
+            "last_error": self.last_error
+        }
+
+_indexes: Dict[str, BucketIndex] = {}
+_indexes_lock = threading.Lock()
+
+def get_index(bucket_name: str) -> BucketIndex:
+    """
+    Return the loaded index of a bucket, creating it on first use.
+    """
+    with _indexes_lock:
+        index = _indexes.get(bucket_name)
+        if index is None:
+            index = _indexes[bucket_name] = BucketIndex(bucket_name)
+    index.ensure_loaded()
+    return index
+
+def invalidate(bucket_name: str):
+    """
+    Mark the index of a bucket as stale, the next query refreshes it in background.
+    """
+    index = _indexes.get(bucket_name)
+    if index is not None:
+        index.invalidate()
+
+def index_stats() -> Dict[str, Any]:
+    return {name: index.staleness() for name, index in _indexes.items()}
@@ -0,0 +1,215 @@
+import os
+import re
+import json
+import math
+import mmap
+import heapq
+import fcntl
+import struct
+import tempfile
+import threading
+from array import array
+from collections import Counter, defaultdict
+from typing import Dict, Any, Optional, List, Tuple, Iterator
+from dotenv import load_dotenv
+
+load_dotenv()
+BM25_INDEX_ENABLED = os.getenv("BM25_INDEX_ENABLED", "True") == "True"
+BM25_INDEX_DIR = os.getenv("BM25_INDEX_DIR", "bm25")
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Local BM25 index of the chunks of the imported documents, one file per corpus: BM25_INDEX_DIR/<corpus id>.bm25
+# (see rag_tools.index_imported_files, which adds the chunks of every imported file).
+# File layout, little endian:
+#   b"BM25IDX1" | header length (uint32) | json header (sources, number of documents, average length,
+#   term -> [postings offset, document frequency]) | padding to 8 bytes |
+#   documents: 4 x uint32 per chunk (source index, length in tokens, text offset, text length) |
+#   postings: 2 x uint32 per (term, chunk) (chunk, term frequency), grouped by term | texts: utf-8
+# The file is memory-mapped: only the json header is parsed, the postings and the texts are read from the mapping.
+# Updates rewrite the file of the corpus (under a file lock, so that the workers do not lose each other's updates)
+# and replace it atomically; every worker maps it again when its inode or mtime changes.
+
+MAGIC = b"BM25IDX1"
+TOKEN_RE = re.compile(r"\w{2,}")
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+def build(path: str, documents: List[Tuple[str, str]]):
+    """
+    Write the index of the given (source uri, chunk text) documents to path, replacing it atomically.
+    """
+    sources: Dict[str, int] = {}
+    doc_table = array("I")
+    texts = bytearray()
+    postings_by_term: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+    total_length = 0
+    for doc_id, (source, text) in enumerate(documents):
+        tokens = tokenize(text)
+        encoded = text.encode("utf-8")
+        doc_table.extend([sources.setdefault(source, len(sources)), len(tokens), len(texts), len(encoded)])
+        texts += encoded
+        total_length += len(tokens)
+        for term, tf in Counter(tokens).items():
+            postings_by_term[term].append((doc_id, tf))
+
+    terms = {}
+    postings = array("I")
+    for term in sorted(postings_by_term):
+        terms[term] = [len(postings), len(postings_by_term[term])]
+        for doc_id, tf in postings_by_term[term]:
+            postings.extend([doc_id, tf])
+
+    header = json.dumps({
+        "documents": len(documents),
+        "average_length": total_length / len(documents) if documents else 0.0,
+        "sources": list(sources),
+        "terms": terms,
+        "postings_size": len(postings),
+    }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    prefix = MAGIC + struct.pack("<I", len(header)) + header
+    prefix += b"\0" * (-len(prefix) % 8)
+
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(prefix)
+        f.write(doc_table.tobytes())
+        f.write(postings.tobytes())
+        f.write(texts)
+    os.replace(tmp, path)
+
+class Bm25Index:
+    """
+    Read-only, memory-mapped index of a corpus.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a BM25 index")
+        (header_length,) = struct.unpack_from("<I", self._map, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(self._map[start:start + header_length])
+        offset = start + header_length
+        offset += -offset % 8
+
+        self.documents = header["documents"]
+        self.average_length = header["average_length"] or 1.0
+        self.sources = header["sources"]
+        self._terms = header["terms"]
+        view = memoryview(self._map)
+        self._docs = view[offset:offset + self.documents * 16].cast("I")
+        offset += self.documents * 16
+        self._postings = view[offset:offset + header["postings_size"] * 4].cast("I")
+        self._texts = offset + header["postings_size"] * 4
+
+    def text(self, doc_id: int) -> str:
+        start = self._texts + self._docs[doc_id * 4 + 2]
+        return self._map[start:start + self._docs[doc_id * 4 + 3]].decode("utf-8")
+
+    def source(self, doc_id: int) -> str:
+        return self.sources[self._docs[doc_id * 4]]
+
+    def search(self, query: str, top_k: int) -> List[Tuple[float, int]]:
+        """
+        The top_k chunks for the query: (BM25 score, chunk id), best first.
+        """
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            entry = self._terms.get(term)
+            if entry is None:
+                continue
+            offset, frequency = entry
+            idf = math.log(1 + (self.documents - frequency + 0.5) / (frequency + 0.5))
+            for i in range(offset, offset + 2 * frequency, 2):
+                doc_id, tf = self._postings[i], self._postings[i + 1]
+                norm = 1 - BM25_B + BM25_B * self._docs[doc_id * 4 + 1] / self.average_length
+                scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+        return [(score, doc_id) for doc_id, score in heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])]
+
+    def iter_documents(self) -> Iterator[Tuple[str, str]]:
+        for doc_id in range(self.documents):
+            yield self.source(doc_id), self.text(doc_id)
+
+class Bm25Store:
+    """
+    Indexes of the corpora, mapped on first use and mapped again when another worker rewrites them.
+    """
+
+    def __init__(self, directory: str = BM25_INDEX_DIR):
+        self.directory = directory
+        self._indexes: Dict[str, Tuple[Tuple[int, int], Bm25Index]] = {}
+        self._lock = threading.Lock()
+        self._counters = {"searches": 0, "updates": 0, "loads": 0}
+
+    def path(self, corpus_id: str) -> str:
+        safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in corpus_id)
+        return os.path.join(self.directory, f"{safe}.bm25")
+
+    def get(self, corpus_id: str) -> Optional[Bm25Index]:
+        """
+        The index of a corpus, None if nothing was indexed yet.
+        """
+        path = self.path(corpus_id)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        version = (st.st_ino, st.st_mtime_ns)
+        with self._lock:
+            loaded = self._indexes.get(corpus_id)
+            if loaded is None or loaded[0] != version:
+                # the previous mapping is released when its last reader is done with it
+                loaded = (version, Bm25Index(path))
+                self._indexes[corpus_id] = loaded
+                self._counters["loads"] += 1
+            return loaded[1]
+
+    def replace_documents(self, corpus_id: str, chunks: Dict[str, List[str]]) -> int:
+        """
+        Replace the chunks of the given source uris in the index of the corpus. Blocking call.
+        Returns the number of chunks of the index.
+        """
+        path = self.path(corpus_id)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            index = self.get(corpus_id)
+            documents = [(source, text) for source, text in index.iter_documents() if source not in chunks] if index else []
+            documents += [(source, text) for source, texts in chunks.items() for text in texts]
+            build(path, documents)
+        with self._lock:
+            self._counters["updates"] += 1
+        return len(documents)
+
+    def missing(self, corpus_id: str, sources: List[str]) -> List[str]:
+        """
+        The source uris without chunks in the index of the corpus. Blocking call.
+        """
+        index = self.get(corpus_id)
+        indexed = set(index.sources) if index else set()
+        return [source for source in sources if source not in indexed]
+
+    def search(self, corpus_id: str, query: str, top_k: int) -> List[Dict[str, Any]]:
+        """
+        The top_k chunks of the corpus for the query, best first: dicts with text, source_uri and score.
+        """
+        index = self.get(corpus_id)
+        with self._lock:
+            self._counters["searches"] += 1
+        if index is None:
+            return []
+        return [{"text": index.text(doc_id), "source_uri": index.source(doc_id), "score": round(score, 4)}
+                for score, doc_id in index.search(query, top_k)]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            indexes = {corpus_id: {"chunks": index.documents, "sources": len(index.sources), "terms": len(index._terms)}
+                       for corpus_id, (_, index) in self._indexes.items()}
+            return dict(self._counters, enabled=BM25_INDEX_ENABLED, dir=self.directory, indexes=indexes)
+
+bm25_store = Bm25Store()
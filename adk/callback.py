@@ -1,17 +1,67 @@
 from google.adk.tools import BaseTool
 from google.adk.tools.tool_context import ToolContext, CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.adk.agents.run_config import StreamingMode
 from typing import Dict, Any, Optional
 
+import tracing
+import metrics
+from usage import usage_recorder
+from cassette import cassettes, recording, replaying, live_tool, digest
+import model_tiers
+
+# The callbacks record structured trace events (see tracing.py) instead of printing to stdout:
+# tool arguments and results are 'debug' payloads, sampled and truncated unless the session is verbose.
+# They also time every agent run, model call and tool call (see metrics.py) and count the tokens of the model calls (see usage.py).
+# With CASSETTE_MODE=record / replay the model and tool calls are recorded to / served from the cassettes (see cassette.py).
+# The model of each call is chosen by the routes of model_tiers.py, trying the cheaper tiers of a cascade first.
+
+def _session_id(context: CallbackContext) -> Optional[str]:
+    try:
+        return context._invocation_context.session.id
+    except AttributeError:
+        return None
+
+def _verbose(context: CallbackContext) -> bool:
+    return bool(context.state.get("trace_verbose", False))
+
+def _duration_ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+def _request_summary(llm_request: LlmRequest) -> list:
+    # the part of the request that identifies a model call in the cassettes (no call ids, no tool results)
+    summary = []
+    for content in llm_request.contents or []:
+        for part in content.parts or []:
+            if part.text:
+                summary.append([content.role, part.text])
+            elif part.function_call:
+                summary.append([content.role, part.function_call.name, part.function_call.args])
+            elif part.function_response:
+                summary.append([content.role, part.function_response.name])
+    return summary
+
 async def before_tool_callback(
             tool: BaseTool,
             args: dict[str, Any],
             tool_context: ToolContext
             ):
-    print(f"\n[TOOL IN] 🛠️ CALLING TOOL: {tool.name}")
-    print(f"[TOOL IN] 📥 ARGUMENTS: {args}")
-    print(f"[TOOL IN] 📥 INVOCATION: {tool_context}")
-    print("----------------------------------------------------")
-    # You can even modify args here if needed for testing
+    call_id = getattr(tool_context, "function_call_id", None)
+    metrics.start_span(("tool", call_id or tool_context.invocation_id, tool.name))
+
+    verbose = _verbose(tool_context)
+    tracing.record("tool_call", "info", verbose, session_id=_session_id(tool_context),
+                   invocation_id=tool_context.invocation_id, agent=tool_context.agent_name, tool=tool.name)
+    tracing.record("tool_args", "debug", verbose, payload=args, session_id=_session_id(tool_context),
+                   invocation_id=tool_context.invocation_id, tool=tool.name)
+
+    if replaying() and not live_tool(tool.name):
+        # the recorded response replaces the tool call
+        entry = await cassettes.next(_session_id(tool_context), ("tool", tool_context.agent_name, tool.name), digest(args))
+        if entry is None:
+            return {"status": "error", "message": f"No recorded call of tool '{tool.name}' in the cassette"}
+        response = entry["response"]
+        return response if isinstance(response, dict) else {"result": response}
 
 async def after_tool_callback(
             tool: BaseTool,
@@ -20,18 +70,115 @@ async def after_tool_callback(
             tool_context: ToolContext
             ):
     try:
-        print(f"[TOOL OUT] 📤 RESULT from {tool.name}: {tool_response}\n")
-        print("----------------------------------------------------")
+        call_id = getattr(tool_context, "function_call_id", None)
+        seconds, _ = metrics.end_span(("tool", call_id or tool_context.invocation_id, tool.name))
+
+        status = tool_response.get("status") if isinstance(tool_response, dict) else None
+        if seconds is not None:
+            metrics.observe_tool(tool_context.invocation_id, tool.name, seconds, "error" if status == "error" else "ok")
+        if recording() and not live_tool(tool.name):
+            cassettes.add_tool(_session_id(tool_context), tool_context.agent_name, tool.name, args, tool_response, seconds or 0.0)
+
+        verbose = _verbose(tool_context)
+        tracing.record("tool_result", "error" if status == "error" else "info", verbose,
+                       session_id=_session_id(tool_context), invocation_id=tool_context.invocation_id,
+                       agent=tool_context.agent_name, tool=tool.name, status=status, duration_ms=_duration_ms(seconds))
+        tracing.record("tool_response", "debug", verbose, payload=tool_response, session_id=_session_id(tool_context),
+                       invocation_id=tool_context.invocation_id, tool=tool.name)
     except Exception as e:
-        print(e)
+        tracing.record("callback_error", "error", error=str(e))
 
 async def before_agent_callback(
             callback_context: CallbackContext
             ):
-    print(f"\n[AGENT IN] : {callback_context.agent_name}")
-    print("----------------------------------------------------")
+    metrics.start_span(("agent", callback_context.invocation_id, callback_context.agent_name))
+    tracing.record("agent_in", "info", _verbose(callback_context), session_id=_session_id(callback_context),
+                   invocation_id=callback_context.invocation_id, agent=callback_context.agent_name)
 
 async def after_agent_callback(
             callback_context: CallbackContext
             ):
-    print(f"\n[AGENT OUT] : {callback_context.agent_name}s")
\ No newline at end of file
+    seconds, _ = metrics.end_span(("agent", callback_context.invocation_id, callback_context.agent_name))
+    if seconds is not None:
+        metrics.observe_agent(callback_context.invocation_id, callback_context.agent_name, seconds)
+    tracing.record("agent_out", "info", _verbose(callback_context), session_id=_session_id(callback_context),
+                   invocation_id=callback_context.invocation_id, agent=callback_context.agent_name,
+                   duration_ms=_duration_ms(seconds))
+
+async def before_model_callback(
+            callback_context: CallbackContext,
+            llm_request: LlmRequest
+            ):
+    run_config = callback_context._invocation_context.run_config
+    streaming = run_config is not None and run_config.streaming_mode == StreamingMode.SSE
+    step, models = model_tiers.select(callback_context.agent_name, llm_request, streaming)
+    if models:
+        llm_request.model = models[0]
+
+    # the request digest is kept with the span until the response is recorded by after_model_callback
+    request_digest = digest(_request_summary(llm_request)) if recording() or replaying() else None
+    span = ("model", callback_context.invocation_id, callback_context.agent_name)
+    metrics.start_span(span, model=llm_request.model or "", request_digest=request_digest)
+
+    if replaying():
+        # the recorded response replaces the model call (after_model_callback is not called)
+        entry = await cassettes.next(_session_id(callback_context), ("model", callback_context.agent_name), request_digest)
+        if entry is None:
+            llm_response = LlmResponse(error_code="CASSETTE_MISS",
+                                       error_message=f"No recorded model call of '{callback_context.agent_name}' in the cassette")
+        else:
+            llm_response = LlmResponse.model_validate(entry["response"])
+        _end_model_call(callback_context, llm_response)
+        return llm_response
+
+    # cascade: the response of a cheaper tier replaces the call of the next one unless it is escalated
+    for next_model in models[1:]:
+        try:
+            llm_response = await model_tiers.call_model(llm_request.model, llm_request)
+        except Exception as e:
+            llm_response = LlmResponse(error_code="CASCADE_ERROR", error_message=str(e))
+        reason = model_tiers.escalation_reason(llm_request, llm_response)
+        model_tiers.cascade_stats.observe(callback_context.agent_name, step, llm_request.model, reason)
+        seconds, labels = _end_model_call(callback_context, llm_response)
+        if reason is None:
+            _record_model_call(callback_context, labels, llm_response, seconds)
+            return llm_response
+        tracing.record("model_escalation", "info", _verbose(callback_context), session_id=_session_id(callback_context),
+                       invocation_id=callback_context.invocation_id, agent=callback_context.agent_name, step=step,
+                       model=llm_request.model, next_model=next_model, reason=reason)
+        llm_request.model = next_model
+        metrics.start_span(span, model=next_model, request_digest=request_digest)
+
+async def after_model_callback(
+            callback_context: CallbackContext,
+            llm_response: LlmResponse
+            ):
+    if llm_response.partial:
+        # streaming chunk: the call ends with the last (non partial) response
+        return
+    seconds, labels = _end_model_call(callback_context, llm_response)
+    _record_model_call(callback_context, labels, llm_response, seconds)
+
+def _record_model_call(callback_context: CallbackContext, labels: Dict[str, Any], llm_response: LlmResponse, seconds: Optional[float]):
+    if seconds is not None and recording():
+        cassettes.add(_session_id(callback_context), {
+            "kind": "model",
+            "agent": callback_context.agent_name,
+            "digest": labels.get("request_digest"),
+            "response": llm_response.model_dump(mode="json", exclude_none=True),
+            "duration": round(seconds, 4)
+        })
+
+def _end_model_call(callback_context: CallbackContext, llm_response: LlmResponse):
+    seconds, labels = metrics.end_span(("model", callback_context.invocation_id, callback_context.agent_name))
+    if seconds is None:
+        return None, labels
+    status = "error" if llm_response.error_code else "ok"
+    model = labels.get("model", "")
+    usage_recorder.record(callback_context.state.get("user_id", "0"), _session_id(callback_context),
+                          callback_context.agent_name, model, llm_response.usage_metadata)
+    metrics.observe_model(callback_context.invocation_id, callback_context.agent_name, model, seconds, status)
+    tracing.record("model_call", "error" if status == "error" else "info", _verbose(callback_context),
+                   session_id=_session_id(callback_context), invocation_id=callback_context.invocation_id,
+                   agent=callback_context.agent_name, model=model, status=status, duration_ms=_duration_ms(seconds))
+    return seconds, labels
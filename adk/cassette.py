@@ -0,0 +1,176 @@
+import os
+import gzip
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import deque, defaultdict
+from typing import Dict, Any, Optional, List, Callable, Awaitable, Tuple, Set
+from dotenv import load_dotenv
+
+from tool_executor import run_blocking
+
+load_dotenv()
+# 'off', 'record' (write the model and tool calls of every session) or 'replay' (serve them back from the cassettes)
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off")
+CASSETTE_DIR = os.getenv("CASSETTE_DIR", "cassettes")
+# replay latency of each call: 'recorded' (the duration measured when recording) or a number of seconds
+CASSETTE_REPLAY_LATENCY = os.getenv("CASSETTE_REPLAY_LATENCY", "0")
+CASSETTE_LATENCY_SCALE = float(os.getenv("CASSETTE_LATENCY_SCALE", "1"))
+# tools that only read or change the session state (agent transfer, login state): always run, never recorded
+CASSETTE_LIVE_TOOLS = set(os.getenv("CASSETTE_LIVE_TOOLS",
+                                    "transfer_to_agent,check_login_status,update_login,update_username,get_active_user").split(","))
+
+# Record / replay of the model and tool calls, for repeatable end-to-end runs without Gemini, Vertex AI and GCS.
+# One cassette per session: CASSETTE_DIR/<session id>.jsonl.gz, a gzip json lines file with the model calls
+# (request digest, response, duration), the tool calls (arguments, response, duration) and the /chat turns
+# (message, reply) of the session, in order. Entries are buffered per session and appended at the end of each turn,
+# in the tool thread pool.
+# On replay the calls of a session are served in the recorded order, per agent (model) and per agent and tool (tools):
+# a request whose digest differs from the recorded one is still served and counted as a mismatch.
+# The tape of a session is dropped from memory once all its calls have been served.
+# bench/replay.py sends the recorded turns again to a server running with CASSETTE_MODE=replay.
+
+def recording() -> bool:
+    return CASSETTE_MODE == "record"
+
+def replaying() -> bool:
+    return CASSETTE_MODE == "replay"
+
+def live_tool(name: str) -> bool:
+    return name in CASSETTE_LIVE_TOOLS
+
+def digest(value: Any) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def cassette_path(session_id: str) -> str:
+    safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in session_id)
+    return os.path.join(CASSETTE_DIR, f"{safe}.jsonl.gz")
+
+def read_cassette(path: str) -> List[Dict[str, Any]]:
+    """
+    Entries of a cassette file (a sequence of gzip members, one per turn).
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+class Cassettes:
+
+    def __init__(self):
+        self._pending: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._tapes: Dict[str, Dict[Tuple, deque]] = {}
+        # sessions whose tape was served entirely: not loaded again
+        self._consumed: Set[str] = set()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._counters = {"recorded": 0, "replayed": 0, "misses": 0, "mismatches": 0}
+
+    # ---------------------------------------------------------------- record
+
+    def add(self, session_id: Optional[str], entry: Dict[str, Any]):
+        if not session_id:
+            return
+        entry["ts"] = round(time.time(), 3)
+        with self._lock:
+            self._pending[session_id].append(entry)
+            self._counters["recorded"] += 1
+
+    def add_tool(self, session_id: Optional[str], agent: str, tool: str, args: Dict[str, Any], response: Any, seconds: float):
+        self.add(session_id, {"kind": "tool", "agent": agent, "tool": tool, "digest": digest(args), "args": args,
+                              "response": response, "duration": round(seconds, 4)})
+
+    async def add_turn(self, session_id: str, user_id: str, message: str, reset: Optional[str], response: str, seconds: float):
+        """
+        Record a /chat turn and append the entries of the session to its cassette, off the event loop.
+        """
+        self.add(session_id, {"kind": "turn", "user_id": user_id, "session_id": session_id, "message": message,
+                              "reset": reset, "response": response, "duration": round(seconds, 4)})
+        await run_blocking("cassette", self.flush, session_id)
+
+    def flush(self, session_id: Optional[str] = None):
+        """
+        Append the pending entries of a session (of all the sessions if None) to the cassettes.
+        """
+        with self._lock:
+            sessions = [session_id] if session_id else list(self._pending)
+            batches = {s: self._pending.pop(s) for s in sessions if self._pending.get(s)}
+        if not batches:
+            return
+        os.makedirs(CASSETTE_DIR, exist_ok=True)
+        # one writer at a time: the gzip members of two flushes of a session must not interleave
+        with self._write_lock:
+            for session, entries in batches.items():
+                with gzip.open(cassette_path(session), "at", encoding="utf-8") as f:
+                    for entry in entries:
+                        f.write(json.dumps(entry, default=str, ensure_ascii=False) + "\n")
+
+    # ---------------------------------------------------------------- replay
+
+    def _tape(self, session_id: str) -> Dict[Tuple, deque]:
+        with self._lock:
+            if session_id in self._consumed:
+                return defaultdict(deque)
+            tape = self._tapes.get(session_id)
+            if tape is None:
+                tape = defaultdict(deque)
+                path = cassette_path(session_id)
+                if os.path.exists(path):
+                    for entry in read_cassette(path):
+                        if entry["kind"] == "model":
+                            tape[("model", entry["agent"])].append(entry)
+                        elif entry["kind"] == "tool":
+                            tape[("tool", entry["agent"], entry["tool"])].append(entry)
+                self._tapes[session_id] = tape
+            return tape
+
+    async def next(self, session_id: Optional[str], key: Tuple, request_digest: str) -> Optional[Dict[str, Any]]:
+        """
+        Pop the next recorded call of the session with this key, after the replay latency. None if there is none.
+        """
+        session_id = session_id or ""
+        tape = self._tape(session_id)
+        with self._lock:
+            entry = tape[key].popleft() if tape.get(key) else None
+            if not any(tape.values()) and self._tapes.get(session_id) is tape:
+                del self._tapes[session_id]
+                self._consumed.add(session_id)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["replayed"] += 1
+            if entry.get("digest") != request_digest:
+                self._counters["mismatches"] += 1
+
+        if CASSETTE_REPLAY_LATENCY == "recorded":
+            delay = entry.get("duration", 0) * CASSETTE_LATENCY_SCALE
+        else:
+            delay = float(CASSETTE_REPLAY_LATENCY) * CASSETTE_LATENCY_SCALE
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return entry
+
+    async def call(self, session_id: Optional[str], agent: str, name: str, args: Dict[str, Any],
+                   func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run a call made outside the ADK callbacks (e.g. the login flow) through the cassette:
+        recorded in record mode, served from the cassette in replay mode.
+        """
+        if replaying():
+            entry = await self.next(session_id, ("tool", agent, name), digest(args))
+            if entry is None:
+                raise RuntimeError(f"Cassette miss: {name} in session {session_id}")
+            return entry["response"]
+
+        start = time.perf_counter()
+        result = await func()
+        if recording():
+            self.add_tool(session_id, agent, name, args, result, time.perf_counter() - start)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._counters, mode=CASSETTE_MODE, dir=CASSETTE_DIR, pending_sessions=len(self._pending),
+                        loaded_tapes=len(self._tapes), consumed_tapes=len(self._consumed))
+
+cassettes = Cassettes()
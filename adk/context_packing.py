@@ -0,0 +1,125 @@
+import os
+import re
+from typing import Dict, Any, Optional, List, Set
+from dotenv import load_dotenv
+
+load_dotenv()
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+# contexts with a vector distance above this value are dropped; empty: no threshold
+RETRIEVAL_MAX_DISTANCE = float(os.getenv("RETRIEVAL_MAX_DISTANCE") or "inf")
+# approximate number of tokens of the text returned by retrieve_context
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "1500"))
+# contexts sharing at least this fraction of their word shingles with a better context are dropped
+RETRIEVAL_DEDUPE_THRESHOLD = float(os.getenv("RETRIEVAL_DEDUPE_THRESHOLD", "0.8"))
+
+# Packing of the contexts returned by the RAG engine into the text given to the model by retrieve_context.
+# The documents are imported with chunk_overlap=200 (see rag_tools.import_files_to_corpus), so neighbouring
+# chunks of a file repeat up to 200 tokens of text:
+# 1. contexts farther than RETRIEVAL_MAX_DISTANCE are dropped
+# 2. chunks of the same file that overlap (the end of one is the start of the other) or contain each other are merged
+# 3. near-duplicates (e.g. the same paragraph in two files) are dropped, comparing 5-word shingles
+# 4. the blocks are added best first (lowest distance) until RETRIEVAL_TOKEN_BUDGET; the block crossing the
+#    budget is cut at a word boundary
+
+# shortest text shared by two chunks to merge them
+MIN_OVERLAP_CHARS = 40
+SHINGLE_SIZE = 5
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+def _merge(first: str, second: str) -> Optional[str]:
+    """
+    'first' followed by 'second' without the text they share, None if the end of 'first' is not the start of 'second'.
+    """
+    if len(first) < MIN_OVERLAP_CHARS or len(second) < MIN_OVERLAP_CHARS:
+        return None
+    probe = second[:MIN_OVERLAP_CHARS]
+    position = first.find(probe)
+    while position != -1:
+        tail = first[position:]
+        if second.startswith(tail):
+            return first[:position] + second
+        position = first.find(probe, position + 1)
+    return None
+
+def _merge_file_chunks(blocks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # blocks of a single file, best first: merge until no pair overlaps
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(blocks)):
+            for j in range(i + 1, len(blocks)):
+                a, b = blocks[i]["text"], blocks[j]["text"]
+                text = a if b in a else b if a in b else _merge(a, b) or _merge(b, a)
+                if text is not None:
+                    blocks[i] = {"text": text, "source": blocks[i]["source"], "distance": blocks[i]["distance"]}
+                    del blocks[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return blocks
+
+def _shingles(text: str) -> Set[str]:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def _is_duplicate(shingles: Set[str], kept: List[Set[str]]) -> bool:
+    # share of the shingles of the smaller text found in the other one
+    for other in kept:
+        common = len(shingles & other)
+        if common and common / min(len(shingles), len(other)) >= RETRIEVAL_DEDUPE_THRESHOLD:
+            return True
+    return False
+
+def _cut(text: str, tokens: int) -> str:
+    limit = tokens * 4
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(" ", 0, limit)
+    return text[:cut if cut > 0 else limit].rstrip() + " ..."
+
+def pack_contexts(contexts: List[Any], token_budget: int = RETRIEVAL_TOKEN_BUDGET) -> List[Dict[str, Any]]:
+    """
+    Merge, dedupe and pack the contexts of a retrieval response (objects with text, source_uri and distance).
+    Returns the blocks to give to the model, best first: dicts with text, source and distance.
+    """
+    blocks = []
+    for ctx in contexts:
+        distance = ctx.distance if getattr(ctx, "distance", None) is not None else 0.0
+        if ctx.text and distance <= RETRIEVAL_MAX_DISTANCE:
+            blocks.append({"text": ctx.text.strip(), "source": getattr(ctx, "source_uri", "") or "", "distance": distance})
+    blocks.sort(key=lambda b: b["distance"])
+
+    by_source: Dict[str, List[Dict[str, Any]]] = {}
+    for block in blocks:
+        by_source.setdefault(block["source"], []).append(block)
+    blocks = sorted((b for group in by_source.values() for b in _merge_file_chunks(group)), key=lambda b: b["distance"])
+
+    packed = []
+    kept = []
+    remaining = token_budget
+    for block in blocks:
+        shingles = _shingles(block["text"])
+        if _is_duplicate(shingles, kept):
+            continue
+        tokens = estimate_tokens(block["text"])
+        if tokens > remaining:
+            # only a meaningful part of the block is added
+            if remaining >= 100 or not packed:
+                packed.append(dict(block, text=_cut(block["text"], remaining)))
+            break
+        kept.append(shingles)
+        packed.append(block)
+        remaining -= tokens
+    return packed
+
+def format_contexts(blocks: List[Dict[str, Any]]) -> str:
+    context = ""
+    for i, block in enumerate(blocks):
+        source = block["source"].rsplit("/", 1)[-1]
+        context += f"Context {i+1}" + (f" ({source})" if source else "") + f":\n{block['text']}\n\n"
+    return context
@@ -0,0 +1,47 @@
+import os
+import asyncio
+import asyncpg
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_POOL_MIN_SIZE = int(os.getenv("DATABASE_POOL_MIN_SIZE", "1"))
+DATABASE_POOL_MAX_SIZE = int(os.getenv("DATABASE_POOL_MAX_SIZE", "10"))
+
+# Shared asyncpg connection pool used by every component talking directly to the 'postgres' container.
+# The pool is created lazily on first use, inside the running event loop.
+
+_pool: Optional[asyncpg.Pool] = None
+_pool_lock = asyncio.Lock()
+
+async def get_pool() -> asyncpg.Pool:
+    """
+    Return the process-wide connection pool, creating it on first use.
+    """
+    global _pool
+
+    if _pool is not None:
+        return _pool
+
+    async with _pool_lock:
+        if _pool is None:
+            if not DATABASE_URL:
+                raise ValueError("Please set DATABASE_URL in a .env file or environment variables.")
+            _pool = await asyncpg.create_pool(
+                DATABASE_URL,
+                min_size=DATABASE_POOL_MIN_SIZE,
+                max_size=DATABASE_POOL_MAX_SIZE
+            )
+            print(f"DB POOL CREATED (min={DATABASE_POOL_MIN_SIZE}, max={DATABASE_POOL_MAX_SIZE})")
+    return _pool
+
+async def close_pool():
+    """
+    Close the process-wide connection pool if it has been created.
+    """
+    global _pool
+
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
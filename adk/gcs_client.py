@@ -0,0 +1,69 @@
+import os
+import threading
+import requests
+import google.auth
+from google.auth.credentials import AnonymousCredentials
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import storage
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+GOOGLE_CLOUD_PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT_ID")
+GCS_HTTP_POOL_SIZE = int(os.getenv("GCS_HTTP_POOL_SIZE", "32"))
+# host:port of a local fake GCS server (benchmarks / offline tests)
+STORAGE_EMULATOR_HOST = os.getenv("STORAGE_EMULATOR_HOST")
+
+GCS_SCOPES = ["https://www.googleapis.com/auth/devstorage.full_control"]
+
+# Process-wide Google Cloud Storage client shared by every GCS call site.
+# Credentials are loaded once, the access token is refreshed lazily by the authorized session when it
+# expires, and HTTP connections are kept alive in a pool of GCS_HTTP_POOL_SIZE connections, so the
+# tool threads running concurrently do not open new connections on every call.
+
+_client: Optional[storage.Client] = None
+_client_lock = threading.Lock()
+
+def _build_client() -> storage.Client:
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=GCS_HTTP_POOL_SIZE)
+
+    if STORAGE_EMULATOR_HOST:
+        credentials = AnonymousCredentials()
+        session = requests.Session()
+        client_options = {"api_endpoint": STORAGE_EMULATOR_HOST if "://" in STORAGE_EMULATOR_HOST else f"http://{STORAGE_EMULATOR_HOST}"}
+    else:
+        credentials, _ = google.auth.default(scopes=GCS_SCOPES)
+        session = AuthorizedSession(credentials)
+        client_options = None
+
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return storage.Client(
+        project=GOOGLE_CLOUD_PROJECT_ID,
+        credentials=credentials,
+        _http=session,
+        client_options=client_options
+    )
+
+def get_storage_client() -> storage.Client:
+    """
+    Return the shared storage client, creating it on first use.
+    """
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_client()
+                print(f"GCS CLIENT CREATED (pool size={GCS_HTTP_POOL_SIZE})")
+    return _client
+
+def reset_storage_client():
+    """
+    Drop the shared client, the next call of get_storage_client() creates a new one.
+    """
+    global _client
+
+    with _client_lock:
+        _client = None
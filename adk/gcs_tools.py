@@ -2,12 +2,21 @@ from google.cloud import storage
 from google.api_core.exceptions import GoogleAPIError
 from google.adk.tools import FunctionTool
 from typing import Dict, Any, Optional
+from tool_executor import offload
+from gcs_client import get_storage_client
+import blob_index
 import os
+import base64
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
 load_dotenv()
 GCS_LIST_BUCKETS_MAX_RESULTS = int(os.getenv("GCS_LIST_BUCKETS_MAX_RESULTS"))
 GCS_LIST_BLOBS_MAX_RESULTS = int(os.getenv("GCS_LIST_BLOBS_MAX_RESULTS"))
+# maximum number of blobs examined by a single list_blobs_in_bucket call, whatever the filters
+GCS_LIST_BLOBS_SCAN_LIMIT = int(os.getenv("GCS_LIST_BLOBS_SCAN_LIMIT", "5000"))
+# 0 disables the in-process blob index: every call lists the bucket through the GCS API
+GCS_BLOB_INDEX_TTL = float(os.getenv("GCS_BLOB_INDEX_TTL", "300"))
 GOOGLE_CLOUD_PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT_ID")
 GOOGLE_APPLICATION_CREDENTIALS = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
 
@@ -30,8 +39,8 @@ def list_gcs_buckets(
     if max_results is None:
         max_results = GCS_LIST_BUCKETS_MAX_RESULTS
     try:
-        # Initialize the client
-        client = storage.Client(project=GOOGLE_CLOUD_PROJECT_ID)
+        # Shared client (see gcs_client.py)
+        client = get_storage_client()
         
         # List the buckets with optional filtering
         bucket_iterator = client.list_buckets(prefix=prefix, max_results=max_results)
@@ -65,70 +74,146 @@ def list_gcs_buckets(
             "message": f"An unexpected error occurred: {str(e)}"
         }
     
+def encode_page_token(blob_name: str) -> str:
+    return base64.urlsafe_b64encode(blob_name.encode()).decode()
+
+def decode_page_token(page_token: str) -> str:
+    return base64.urlsafe_b64decode(page_token.encode()).decode()
+
+def parse_timestamp(value: str) -> datetime:
+    timestamp = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+def blob_matches(blob, min_size: Optional[int], max_size: Optional[int],
+                 content_type: Optional[str], updated_since: Optional[datetime]) -> bool:
+    """
+    Check the filters of list_blobs_in_bucket on a single blob.
+    """
+    size = blob.size or 0
+    if min_size is not None and size < min_size:
+        return False
+    if max_size is not None and size >= max_size:
+        return False
+    if content_type and not (blob.content_type or "").startswith(content_type):
+        return False
+    if updated_since and (blob.updated is None or blob.updated < updated_since):
+        return False
+    return True
+
 def list_blobs_in_bucket(
     bucket_name: str,
     prefix: Optional[str] = None,
     delimiter: Optional[str] = None,
-    max_results: Optional[int] = None
+    max_results: Optional[int] = None,
+    max_size: Optional[int] = None,
+    min_size: Optional[int] = None,
+    content_type: Optional[str] = None,
+    updated_since: Optional[str] = None,
+    page_token: Optional[str] = None
 ) -> Dict[str, Any]:
     """
-    Lists blobs (files) in a Google Cloud Storage bucket.
+    Lists blobs (files) in a Google Cloud Storage bucket. Filters are applied by the tool, only matching files are returned.
     
     Args:
         bucket_name: The name of the bucket to list blobs from
         prefix: Optional prefix to filter blobs by name
         delimiter: Optional delimiter for hierarchy simulation (e.g., '/' for folders)
-        max_results: Maximum number of results to return (default: 100)
+        max_results: Maximum number of files to return in this page (default: 50)
+        max_size: Optional, return only files smaller than this size in bytes
+        min_size: Optional, return only files with at least this size in bytes
+        content_type: Optional content type or content type prefix (e.g., 'application/pdf' or 'image/')
+        updated_since: Optional ISO 8601 timestamp, return only files updated since then
+        page_token: Optional 'next_page_token' returned by a previous call, to get the next page
         
     Returns:
-        A dictionary containing the list of blobs and prefixes (if delimiter is used)
+        A dictionary containing the list of blobs, prefixes (if delimiter is used)
+        and 'next_page_token' if more files are available
     """
     if max_results is None:
         max_results = GCS_LIST_BLOBS_MAX_RESULTS
+    max_results = max(1, max_results)
     try:
-        # Initialize the client
-        client = storage.Client(project=GOOGLE_CLOUD_PROJECT_ID)
-        
-        # Get the bucket
-        bucket = client.bucket(bucket_name)
-        
-        # List blobs with optional filtering
-        blobs = client.list_blobs(
-            bucket_name, 
-            prefix=prefix, 
-            delimiter=delimiter,
-            max_results=max_results
-        )
+        since = parse_timestamp(updated_since) if updated_since else None
+        start_after = decode_page_token(page_token) if page_token else None
+
+        index = None
+        if GCS_BLOB_INDEX_TTL > 0:
+            # answer from the in-process index of the bucket (see blob_index.py)
+            index = blob_index.get_index(bucket_name)
+            blobs = index.iter_blobs(prefix=prefix, start_after=start_after)
+        else:
+            # Shared client (see gcs_client.py)
+            client = get_storage_client()
+            
+            # List blobs starting from the cursor: the filters are applied while iterating the listing
+            blobs = client.list_blobs(
+                bucket_name, 
+                prefix=prefix, 
+                delimiter=delimiter,
+                start_offset=start_after
+            )
         
         # Process the results
         blob_list = []
         prefix_list = []
+        folders = set()
+        next_page_token = None
+        scanned = 0
+        last_name = start_after
         
         # Save actual blobs
         for blob in blobs:
+            if blob.name == start_after:
+                # start_offset is inclusive: skip the last blob of the previous page
+                continue
+
+            if index is not None and delimiter:
+                # the index holds the flat list of names: group the nested ones in folders like the GCS API
+                rest = blob.name[len(prefix or ""):]
+                pos = rest.find(delimiter)
+                if pos >= 0:
+                    folders.add((prefix or "") + rest[:pos + len(delimiter)])
+                    continue
+
+            if len(blob_list) >= max_results or scanned >= GCS_LIST_BLOBS_SCAN_LIMIT:
+                # more blobs to examine: the next page starts after the last one examined
+                next_page_token = encode_page_token(last_name)
+                break
+
+            scanned += 1
+            last_name = blob.name
+            if not blob_matches(blob, min_size, max_size, content_type, since):
+                continue
+
             blob_list.append({
                 "name": blob.name,
                 "size": blob.size,
                 "updated": blob.updated.isoformat() if blob.updated else None,
                 "content_type": blob.content_type,
-                "public_url": f"https://storage.googleapis.com/{bucket_name}/{blob.name}",
                 "gcs_uri": f"gs://{bucket_name}/{blob.name}"
             })
         
         # If using delimiter, also save prefixes (folders)
         if delimiter:
-            prefix_list = list(blobs.prefixes)
+            prefix_list = sorted(folders if index is not None else blobs.prefixes)
         
-        return {
+        reply = {
             "status": "success",
             "bucket_name": bucket_name,
             "blobs": blob_list,
             "prefixes": prefix_list,
             "count": len(blob_list),
             "prefix_count": len(prefix_list),
+            "next_page_token": next_page_token,
             "message": f"Found {len(blob_list)} file(s) and {len(prefix_list)} folder(s) in bucket '{bucket_name}'"
                       + (f" with prefix '{prefix}'" if prefix else "")
+                      + (". More files are available with 'page_token'" if next_page_token else "")
         }
+        if index is not None:
+            reply["index"] = {k: v for k, v in index.staleness().items() if k in ("age_seconds", "stale", "refreshing")}
+        return reply
     except GoogleAPIError as e:
         return {
             "status": "error",
@@ -142,8 +227,28 @@ def list_blobs_in_bucket(
             "message": f"An unexpected error occurred: {str(e)}"
         }
 
-list_gcs_buckets_tool = FunctionTool(func=list_gcs_buckets)
-list_blobs_in_bucket_tool = FunctionTool(func=list_blobs_in_bucket)
+def get_blob_metadata(gcs_uri: str) -> Optional[Dict[str, Any]]:
+    """
+    Get generation, md5 hash and size of a blob identified by its GCS URI (gs://bucket-name/file-name).
+    Returns None if the blob does not exist.
+    """
+    bucket_name, blob_name = gcs_uri[5:].split("/", 1)
+
+    client = get_storage_client()
+    blob = client.bucket(bucket_name).get_blob(blob_name)
+    if blob is None:
+        return None
+
+    return {
+        "gcs_uri": gcs_uri,
+        "generation": blob.generation,
+        "md5_hash": blob.md5_hash,
+        "size": blob.size
+    }
+
+# the functions make blocking GCS calls: the tools run them in the tool thread pool
+list_gcs_buckets_tool = FunctionTool(func=offload(list_gcs_buckets))
+list_blobs_in_bucket_tool = FunctionTool(func=offload(list_blobs_in_bucket))
 
 if __name__ == "__main__":
     buckets = list_gcs_buckets()
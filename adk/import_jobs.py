@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Callable, Awaitable
+from dotenv import load_dotenv
+
+from db import get_pool
+
+load_dotenv()
+IMPORT_BATCH_WINDOW = float(os.getenv("IMPORT_BATCH_WINDOW", "2"))
+IMPORT_MAX_BATCH_SIZE = int(os.getenv("IMPORT_MAX_BATCH_SIZE", "25"))
+IMPORT_JOBS_KEPT = int(os.getenv("IMPORT_JOBS_KEPT", "500"))
+# 'memory' (the status of a job is known only by the worker that accepted it) or 'postgres' (table public.import_jobs,
+# readable by every worker: needed with UVICORN_WORKERS > 1)
+IMPORT_JOBS_STORE = os.getenv("IMPORT_JOBS_STORE", "memory")
+
+# Background queue for document imports.
+# The import tool only enqueues a job and returns its id. A worker task waits IMPORT_BATCH_WINDOW seconds
+# to collect the jobs submitted meanwhile, groups the GCS URIs by corpus and runs one batched import
+# per corpus (at most IMPORT_MAX_BATCH_SIZE URIs each).
+# Jobs are run by the worker process that accepted them. With IMPORT_JOBS_STORE=postgres every status change is
+# also written to public.import_jobs, so that the status can be read from any worker.
+
+class ImportJobQueue:
+    """
+    Args:
+        import_func: coroutine function (corpus_id, gcs_uris) returning a dictionary with
+                     'imported', 'failed' and 'skipped' counts, or raising an exception
+    """
+
+    def __init__(self,
+                 import_func: Callable[[str, List[str]], Awaitable[Dict[str, Any]]],
+                 batch_window: float = IMPORT_BATCH_WINDOW,
+                 max_batch_size: int = IMPORT_MAX_BATCH_SIZE,
+                 jobs_kept: int = IMPORT_JOBS_KEPT,
+                 store: str = IMPORT_JOBS_STORE):
+        self.import_func = import_func
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.jobs_kept = jobs_kept
+        self.store = store
+
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._queued: List[str] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def submit(self, corpus_id: str, gcs_uri: str) -> Dict[str, Any]:
+        """
+        Enqueue the import of a GCS URI. If the same URI is already queued for the corpus the existing job is returned.
+        Must be called from the event loop.
+        """
+        for job_id in self._queued:
+            job = self._jobs[job_id]
+            if job["corpus_id"] == corpus_id and job["gcs_uri"] == gcs_uri:
+                return job
+
+        job = {
+            "job_id": str(uuid.uuid4()),
+            "status": "queued",
+            "corpus_id": corpus_id,
+            "gcs_uri": gcs_uri,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "batch_size": None,
+            "imported": None,
+            "failed": None,
+            "skipped": None,
+            "unknown": None,
+            "error_message": None
+        }
+        self._jobs[job["job_id"]] = job
+        self._queued.append(job["job_id"])
+        self._trim()
+        await self._save([job])
+
+        self._start_worker()
+        self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        A job of this worker, or of any worker with IMPORT_JOBS_STORE=postgres. None if it is unknown.
+        """
+        job = self._jobs.get(job_id)
+        if job is not None or self.store != "postgres":
+            return job
+        pool = await get_pool()
+        row = await pool.fetchval("SELECT job FROM public.import_jobs WHERE job_id=$1", job_id)
+        return json.loads(row) if row else None
+
+    async def list(self) -> List[Dict[str, Any]]:
+        """
+        The most recent jobs of this worker, or of all the workers with IMPORT_JOBS_STORE=postgres.
+        """
+        if self.store != "postgres":
+            return list(self._jobs.values())
+        pool = await get_pool()
+        rows = await pool.fetch("SELECT job FROM public.import_jobs ORDER BY created DESC LIMIT $1", self.jobs_kept)
+        return [json.loads(r["job"]) for r in reversed(rows)]
+
+    async def _save(self, jobs: List[Dict[str, Any]]):
+        if self.store != "postgres" or not jobs:
+            return
+        try:
+            pool = await get_pool()
+            await pool.executemany(
+                "INSERT INTO public.import_jobs (job_id, created, job) VALUES ($1, to_timestamp($2), $3::jsonb) "
+                "ON CONFLICT (job_id) DO UPDATE SET job = EXCLUDED.job",
+                [(job["job_id"], job["created"], json.dumps(job)) for job in jobs]
+            )
+        except Exception as e:
+            # the import goes on: only the status seen by the other workers is stale
+            print(f"IMPORT JOB STORE ERROR: {e}")
+
+    def _trim(self):
+        # forget the oldest finished jobs
+        finished = [k for k, j in self._jobs.items() if j["status"] in ("done", "error")]
+        for job_id in finished[:max(0, len(self._jobs) - self.jobs_kept)]:
+            del self._jobs[job_id]
+
+    def _start_worker(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # collect the jobs submitted in the batching window
+            await asyncio.sleep(self.batch_window)
+            self._wakeup.clear()
+
+            queued, self._queued = self._queued, []
+            by_corpus: Dict[str, List[Dict[str, Any]]] = {}
+            for job_id in queued:
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    by_corpus.setdefault(job["corpus_id"], []).append(job)
+
+            for corpus_id, jobs in by_corpus.items():
+                for i in range(0, len(jobs), self.max_batch_size):
+                    await self._run_batch(corpus_id, jobs[i:i + self.max_batch_size])
+
+    async def _run_batch(self, corpus_id: str, jobs: List[Dict[str, Any]]):
+        uris = [job["gcs_uri"] for job in jobs]
+        started = time.time()
+        for job in jobs:
+            job["status"] = "running"
+            job["started"] = started
+            job["batch_size"] = len(uris)
+        await self._save(jobs)
+
+        print(f"IMPORT BATCH: {len(uris)} file(s) to corpus {corpus_id}")
+
+        try:
+            result = await self.import_func(corpus_id, uris)
+        except Exception as e:
+            print(f"IMPORT BATCH ERROR: {e}")
+            for job in jobs:
+                job["status"] = "error"
+                job["error_message"] = str(e)
+                job["finished"] = time.time()
+            await self._save(jobs)
+            return
+
+        # counts of every URI of the batch: a URI without counts is an error, not the counts of the whole batch
+        per_uri = result.get("files", {})
+        for job in jobs:
+            counts = per_uri.get(job["gcs_uri"])
+            if counts is None:
+                counts = {"error_message": f"No import result for {job['gcs_uri']}"}
+            job["imported"] = counts.get("imported")
+            job["failed"] = counts.get("failed")
+            job["skipped"] = counts.get("skipped")
+            # in the corpus, but not known to be replaced by this import
+            job["unknown"] = counts.get("unknown", 0)
+            job["status"] = "error" if counts.get("error_message") else "done"
+            job["error_message"] = counts.get("error_message")
+            job["finished"] = time.time()
+        await self._save(jobs)
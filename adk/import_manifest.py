@@ -0,0 +1,42 @@
+from typing import Dict, Any, List, Optional
+
+from db import get_pool
+
+# Manifest of the GCS blobs imported into the RAG corpora (table public.import_manifest).
+# For each (corpus, GCS URI) it records the blob generation / md5 at import time and the RAG file created,
+# so that unchanged blobs are not parsed and embedded again and changed blobs replace their old RAG file.
+
+async def lookup(corpus_id: str, gcs_uris: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Return the manifest entries of the given URIs, keyed by URI.
+    """
+    pool = await get_pool()
+    rows = await pool.fetch(
+        "SELECT gcs_uri, generation, md5_hash, rag_file_id FROM public.import_manifest "
+        "WHERE corpus_id=$1 AND gcs_uri = ANY($2::varchar[])",
+        corpus_id, gcs_uris
+    )
+    return {r["gcs_uri"]: dict(r) for r in rows}
+
+async def record(corpus_id: str, entries: List[Dict[str, Any]]):
+    """
+    Insert or replace the manifest entries. Each entry contains gcs_uri, generation, md5_hash and rag_file_id.
+    """
+    if not entries:
+        return
+    pool = await get_pool()
+    await pool.executemany(
+        "INSERT INTO public.import_manifest (corpus_id, gcs_uri, generation, md5_hash, rag_file_id, imported_at) "
+        "VALUES ($1, $2, $3, $4, $5, now()) "
+        "ON CONFLICT (corpus_id, gcs_uri) DO UPDATE SET generation = EXCLUDED.generation, md5_hash = EXCLUDED.md5_hash, "
+        "rag_file_id = EXCLUDED.rag_file_id, imported_at = EXCLUDED.imported_at",
+        [(corpus_id, e["gcs_uri"], e["generation"], e["md5_hash"], e["rag_file_id"]) for e in entries]
+    )
+
+def is_unchanged(entry: Optional[Dict[str, Any]], metadata: Optional[Dict[str, Any]]) -> bool:
+    """
+    True if the blob described by 'metadata' is the one recorded in the manifest 'entry'.
+    """
+    if not entry or not metadata or not entry.get("rag_file_id"):
+        return False
+    return entry["generation"] == metadata["generation"] and entry["md5_hash"] == metadata["md5_hash"]
@@ -20,11 +20,13 @@ from google.adk.tools.tool_context import ToolContext
 from google.genai import types
 
 # to use MCP Toolbox for Database
-from toolbox_core import ToolboxSyncClient
+from toolbox_client import LazyToolboxToolset
+import pg_tools
 
 # import callbacks
 from callback import before_tool_callback, after_tool_callback
 from callback import before_agent_callback, after_agent_callback
+from callback import before_model_callback, after_model_callback
 
 # DEFINE THE FUNCTION TOOLS
 
@@ -72,11 +74,13 @@ update_username_tool = FunctionTool(func=update_username)
 get_active_user_tool = FunctionTool(func=get_active_user)
 
 # DEFINE THE MCP TOOLS
-# 2. connect to MCP Toolbox server
+# 2. MCP Toolbox toolset: loaded from the server the first time the agent runs (see toolbox_client.py)
+# with LOGIN_DB_BACKEND=asyncpg the same tools run in process on the database pool (see pg_tools.py)
 load_dotenv()
-MCP_TOOLBOX_URL = os.getenv("MCP_TOOLBOX_URL")
-toolbox = ToolboxSyncClient(MCP_TOOLBOX_URL)
-mcp_tools = toolbox.load_toolset('login-toolset')
+if pg_tools.LOGIN_DB_BACKEND == "asyncpg":
+    login_toolset = pg_tools.toolsets['login-toolset']
+else:
+    login_toolset = [LazyToolboxToolset('login-toolset')]
 
 # 3. create Agents
 # remember to keep attention to punctuation and spaces between each sentence
@@ -91,20 +95,21 @@ logger_agent = LlmAgent(
                  "STEP 1. call 'get_active_user' tool. OBSERVE the JSON output:\n"
                  " -If parameter 'username' is equal to '' ask for the username. Mandatory: call 'update_username' tool with the reply provided. \n" \
                  " -If parameter 'username' is NOT equal to '' skip to step 2. \n" \
-                 "STEP 2. Use the appropriate tool to get student info. convert the username to lowercase before using tools.\n" \
-                 " -if the student exists you will receive student's data in json format. skip to step 4. \n" \
-                 " -if the student does not exist you will receive null reply. go to step 3. \n" \
-                 "STEP 3. Ask for the student's email. Mandatory: use the appropriate tool to add the student. Use the provided username as argument.\n" \
-                 "STEP 4. Use the appropriate tool to get the last session for the student. provide the student id you retrieved: \n" \
-                 " -If the session exists you will receive session's data in json format. go to step 5. \n" \
-                 " -If the session does not exist you will receive null reply. ask for a session name and use 'add-session' tool to add a new session. Argument guid={session_id}. \n" \
-                "STEP 5. Call 'update_login' tool to update active login information. \n" \
-                "STEP 6. Reply with a message confirming the login and session name. \n",
-    tools=mcp_tools + [get_active_user_tool, update_login_tool, update_username_tool],
+                 "STEP 2. Call 'login-student' tool. convert the username to lowercase before using tools. " \
+                 "Use email='' and session_name='' unless the student provided them in this step. Argument guid={session_id}. OBSERVE the 'status' of the JSON output:\n" \
+                 " -if status is 'email_required' the student does not exist: ask for the student's email and call 'login-student' tool again with the provided email. \n" \
+                 " -if status is 'email_in_use' the email belongs to another student: ask for a different email and call 'login-student' tool again. \n" \
+                 " -if status is 'session_name_required' the student has no session: ask for a session name and call 'login-student' tool again with the provided session name. \n" \
+                 " -if status is 'ok' go to step 3. \n" \
+                "STEP 3. Call 'update_login' tool to update active login information. Use the 'student_id' and 'guid' of the 'login-student' reply. \n" \
+                "STEP 4. Reply with a message confirming the login and session name. \n",
+    tools=login_toolset + [get_active_user_tool, update_login_tool, update_username_tool],
     before_tool_callback=before_tool_callback,  
     after_tool_callback=after_tool_callback,
     before_agent_callback=before_agent_callback,
-    after_agent_callback=after_agent_callback  
+    after_agent_callback=after_agent_callback,
+    before_model_callback=before_model_callback,
+    after_model_callback=after_model_callback
 )
 
 import asyncio
@@ -0,0 +1,219 @@
+import os
+import re
+import json
+from typing import AsyncGenerator, Dict, Any, Optional
+from dotenv import load_dotenv
+
+# Google ADK imports
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.genai import Client, types
+
+from toolbox_client import load_tool
+from usage import usage_recorder
+from cassette import cassettes
+import pg_tools
+
+# import callbacks
+from callback import before_agent_callback, after_agent_callback
+
+load_dotenv()
+LOGIN_EXTRACTION_MODEL = os.getenv("LOGIN_EXTRACTION_MODEL", "gemini-2.5-flash-lite")
+
+# Deterministic login flow, used instead of the logger_agent LLM protocol with LOGIN_FLOW=code.
+# The steps (ask username -> login-student tool -> ask email / session name -> update login state) run in Python:
+# a login costs one database round trip per message, and the model is called only when the
+# username, email or session name cannot be read from the message with the patterns below.
+
+ASK_USERNAME = "Hi! Please tell me your username to log in."
+ASK_EMAIL = "Welcome {username}! You are a new student: please tell me your email."
+ASK_OTHER_EMAIL = "The email {email} belongs to another student: please tell me a different email."
+ASK_SESSION_NAME = "Please tell me a name for your first study session."
+LOGIN_DONE = "Login completed. Welcome {username}! Your study session is '{session_name}'."
+LOGIN_ERROR = "Sorry, the login service is not available right now. Please try again."
+
+# explicit forms, read from any message (e.g. the first one)
+USERNAME_PATTERN = re.compile(r"\b(?:my name is|username(?: is)?|user\s*[:=]|mi chiamo)\s*[:=]?\s*([\w.\-]{2,100})", re.IGNORECASE)
+# free forms, read only after the username was asked: "Hi, I am ready to start" is not a username
+FREE_USERNAME_PATTERN = re.compile(r"\b(?:i am|i'm|sono)\s*[:=]?\s*([\w.\-]{2,100})", re.IGNORECASE)
+SINGLE_WORD_PATTERN = re.compile(r"^[\w.\-]{2,100}$")
+EMAIL_PATTERN = re.compile(r"[\w.+\-]+@[\w\-]+(?:\.[\w\-]+)+")
+QUOTED_PATTERN = re.compile(r"[\"'`“‘]([^\"'`”’]{1,100})[\"'`”’]")
+SESSION_NAME_PATTERN = re.compile(r"\b(?:call it|name it|session name is|chiamala|nome(?: della sessione)? è)\s*[:=]?\s*(.{1,100})$", re.IGNORECASE)
+GREETING_PATTERN = re.compile(r"^(?:hi|hello|hey|ciao|salve|buongiorno|buonasera|good (?:morning|afternoon|evening)|ok|okay|yes|no|thanks|thank you|grazie)(?: there| again)?[\s.!?,]*$", re.IGNORECASE)
+
+def extract_username(text: str, expected: bool) -> Optional[str]:
+    match = USERNAME_PATTERN.search(text) or (expected and FREE_USERNAME_PATTERN.search(text))
+    if match:
+        return match.group(1)
+    word = text.strip().strip(".!?,;")
+    if expected and SINGLE_WORD_PATTERN.match(word) and not GREETING_PATTERN.match(word):
+        return word
+    return None
+
+def extract_email(text: str) -> Optional[str]:
+    match = EMAIL_PATTERN.search(text)
+    return match.group(0) if match else None
+
+def extract_session_name(text: str) -> Optional[str]:
+    # called only after the session name was asked (login_step 'session_name'); a greeting is not a session name
+    text = text.strip()
+    if GREETING_PATTERN.match(text):
+        return None
+    match = QUOTED_PATTERN.search(text) or SESSION_NAME_PATTERN.search(text)
+    if match:
+        return match.group(1).strip().strip(".!?")
+    if 0 < len(text.split()) <= 5:
+        return text.strip(".!?")
+    return None
+
+_genai_client: Optional[Client] = None
+
+async def extract_with_llm(field: str, text: str, ctx: Optional[InvocationContext] = None) -> Optional[str]:
+    """
+    Ask the model to extract a value ('username', 'email' or 'session name') from a free text message.
+    Returns None if the message doesn't contain it.
+    """
+    global _genai_client
+    if _genai_client is None:
+        _genai_client = Client()
+
+    prompt = f"Extract the {field} from the following message of a student. " \
+             f"Reply with a json object {{\"value\": \"...\"}}, use null if the message doesn't contain a {field}.\n" \
+             f"MESSAGE: {text}"
+
+    async def call():
+        response = await _genai_client.aio.models.generate_content(
+            model=LOGIN_EXTRACTION_MODEL,
+            contents=prompt,
+            config=types.GenerateContentConfig(temperature=0, response_mime_type="application/json")
+        )
+        if ctx is not None:
+            usage_recorder.record(ctx.session.state.get("user_id", "0"), ctx.session.id, ctx.agent.name,
+                                  LOGIN_EXTRACTION_MODEL, response.usage_metadata)
+        return response.text
+
+    try:
+        if ctx is not None:
+            reply = await cassettes.call(ctx.session.id, ctx.agent.name, "extract_with_llm", {"field": field, "text": text}, call)
+        else:
+            reply = await call()
+        value = json.loads(reply).get("value")
+        return str(value).strip() if value else None
+    except Exception as e:
+        print(f"LOGIN EXTRACTION ERROR ({field}): {e}")
+        return None
+
+def parse_login_reply(reply: str) -> Dict[str, Any]:
+    """
+    The toolbox returns the rows of 'SELECT public.login_student(...) AS login' as a json list.
+    """
+    rows = json.loads(reply) if isinstance(reply, str) else reply
+    login = rows[0]["login"]
+    return json.loads(login) if isinstance(login, str) else login
+
+class LoginFlowAgent(BaseAgent):
+    """
+    Login agent running the login protocol in code. The current step is kept in the 'login_step' state.
+    """
+
+    async def login_student(self, ctx: InvocationContext, username: str, email: str, session_name: str, guid: str) -> Dict[str, Any]:
+        args = {"username": username, "email": email, "session_name": session_name, "guid": guid}
+
+        async def call():
+            if pg_tools.LOGIN_DB_BACKEND == "asyncpg":
+                return await pg_tools.login_student(**args)
+            tool = await load_tool("login-student")
+            return await tool(**args)
+
+        # not a tool of an LlmAgent: the call goes through the cassette here (see cassette.py)
+        reply = await cassettes.call(ctx.session.id, self.name, "login-student", args, call)
+        print(f"LOGIN FLOW login-student: {reply}")
+        return parse_login_reply(reply)
+
+    def reply(self, ctx: InvocationContext, text: str, state_delta: Dict[str, Any]) -> Event:
+        return Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=text)]),
+            actions=EventActions(state_delta=state_delta)
+        )
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        state = ctx.session.state
+        text = ""
+        if ctx.user_content and ctx.user_content.parts:
+            text = " ".join(p.text for p in ctx.user_content.parts if p.text)
+
+        step = state.get("login_step")
+        username = state.get("username", "")
+        email = ""
+        session_name = ""
+        delta = {}
+
+        # STEP 1: username
+        if not username:
+            username = extract_username(text, expected=(step == "username"))
+            if not username and step == "username":
+                username = await extract_with_llm("username", text, ctx)
+            if not username:
+                yield self.reply(ctx, ASK_USERNAME, {"login_step": "username"})
+                return
+            username = username.lower()
+            delta["username"] = username
+            # the first message may already contain the email
+            email = extract_email(text) or ""
+        elif step == "email":
+            email = extract_email(text) or await extract_with_llm("email", text, ctx) or ""
+            if not email:
+                yield self.reply(ctx, ASK_EMAIL.format(username=username), {"login_step": "email"})
+                return
+        elif step == "session_name":
+            session_name = extract_session_name(text) or await extract_with_llm("session name", text, ctx) or ""
+            if not session_name:
+                yield self.reply(ctx, ASK_SESSION_NAME, {"login_step": "session_name"})
+                return
+        if email:
+            delta["email"] = email
+
+        # STEP 2: get or add student and session in one round trip
+        try:
+            login = await self.login_student(ctx, username, email or state.get("email", ""), session_name, state.get("session_id", "0"))
+        except Exception as e:
+            print(f"LOGIN FLOW ERROR: {e}")
+            yield self.reply(ctx, LOGIN_ERROR, delta)
+            return
+
+        status = login.get("status")
+        if status == "email_required":
+            delta["login_step"] = "email"
+            yield self.reply(ctx, ASK_EMAIL.format(username=username), delta)
+        elif status == "email_in_use":
+            delta["login_step"] = "email"
+            delta["email"] = ""
+            yield self.reply(ctx, ASK_OTHER_EMAIL.format(email=login.get("email")), delta)
+        elif status == "session_name_required":
+            delta["login_step"] = "session_name"
+            yield self.reply(ctx, ASK_SESSION_NAME, delta)
+        elif status == "ok":
+            # STEP 3: update login state (same as the 'update_login' tool)
+            delta.update({
+                "login_step": None,
+                "user_id": str(login["student_id"]),
+                "session_id": login["guid"],
+                "login_status": "True"
+            })
+            print("LOGIN TRUE")
+            yield self.reply(ctx, LOGIN_DONE.format(username=username, session_name=login.get("session_name")), delta)
+        else:
+            print(f"LOGIN FLOW UNEXPECTED REPLY: {login}")
+            yield self.reply(ctx, LOGIN_ERROR, delta)
+
+login_flow_agent = LoginFlowAgent(
+    name="logger_agent",
+    description="you respond to user after login",
+    before_agent_callback=before_agent_callback,
+    after_agent_callback=after_agent_callback
+)
@@ -0,0 +1,113 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple, Hashable
+from dotenv import load_dotenv
+
+# PROMETHEUS_MULTIPROC_DIR is read by prometheus_client when it is imported
+load_dotenv()
+
+from prometheus_client import Counter, Histogram, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import REGISTRY
+
+# directory shared by the uvicorn workers: with UVICORN_WORKERS > 1 the metrics of every worker are aggregated
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Latency metrics of the turns, exposed in Prometheus format on GET /metrics.
+# The callbacks open and close a span for every agent run, model call and tool call (see callback.py);
+# each span is observed in its histogram and added to the breakdown of its turn (invocation), which
+# chat_endpoint records when the turn ends.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+TURN_SECONDS = Histogram("refresh_turn_seconds", "Duration of a /chat turn", ["runner", "status"], buckets=LATENCY_BUCKETS)
+AGENT_SECONDS = Histogram("refresh_agent_seconds", "Duration of an agent run", ["agent"], buckets=LATENCY_BUCKETS)
+MODEL_SECONDS = Histogram("refresh_model_call_seconds", "Duration of a model call", ["agent", "model"], buckets=LATENCY_BUCKETS)
+TOOL_SECONDS = Histogram("refresh_tool_seconds", "Duration of a tool call", ["tool", "status"], buckets=LATENCY_BUCKETS)
+
+TURNS = Counter("refresh_turns_total", "Turns served", ["runner", "status"])
+MODEL_CALLS = Counter("refresh_model_calls_total", "Model calls", ["agent", "model", "status"])
+TOOL_CALLS = Counter("refresh_tool_calls_total", "Tool calls", ["tool", "status"])
+TOKENS = Counter("refresh_model_tokens_total", "Tokens of the model calls", ["agent", "model", "kind"])
+CASCADE = Counter("refresh_model_cascade_total", "Responses of the cheaper models of a cascade, accepted or escalated (by reason)",
+                  ["agent", "step", "model", "outcome"])
+
+MAX_OPEN_SPANS = 10000
+
+# open spans, oldest first: key -> (start time, labels)
+_spans: "OrderedDict[Hashable, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+# per-turn breakdown, oldest turn first: invocation id -> {"agent:<name>": seconds, "model:<agent>": seconds, "tool:<name>": seconds}
+_turns: "OrderedDict[str, Dict[str, float]]" = OrderedDict()
+_lock = threading.Lock()
+
+def start_span(key: Hashable, **labels):
+    with _lock:
+        _spans[key] = (time.perf_counter(), labels)
+        _spans.move_to_end(key)
+        while len(_spans) > MAX_OPEN_SPANS:
+            # oldest spans never closed (e.g. a tool raising before the after callback); the open ones are kept
+            _spans.popitem(last=False)
+
+def end_span(key: Hashable) -> Tuple[Optional[float], Dict[str, Any]]:
+    """
+    Close a span. Returns its duration in seconds (None if it was not open) and the labels given at start.
+    """
+    with _lock:
+        span = _spans.pop(key, None)
+    if span is None:
+        return None, {}
+    start, labels = span
+    return time.perf_counter() - start, labels
+
+def _add_to_turn(invocation_id: Optional[str], part: str, seconds: float):
+    if not invocation_id:
+        return
+    with _lock:
+        breakdown = _turns.setdefault(invocation_id, {})
+        breakdown[part] = breakdown.get(part, 0.0) + seconds
+        while len(_turns) > MAX_OPEN_SPANS:
+            # turns never recorded by chat_endpoint: the oldest are dropped
+            _turns.popitem(last=False)
+
+def observe_agent(invocation_id: str, agent: str, seconds: float):
+    AGENT_SECONDS.labels(agent=agent).observe(seconds)
+    _add_to_turn(invocation_id, f"agent:{agent}", seconds)
+
+def observe_model(invocation_id: str, agent: str, model: str, seconds: float, status: str = "ok"):
+    MODEL_SECONDS.labels(agent=agent, model=model).observe(seconds)
+    MODEL_CALLS.labels(agent=agent, model=model, status=status).inc()
+    _add_to_turn(invocation_id, f"model:{agent}", seconds)
+
+def observe_cascade(agent: str, step: str, model: str, outcome: str):
+    CASCADE.labels(agent=agent, step=step, model=model, outcome=outcome).inc()
+
+def observe_tool(invocation_id: str, tool: str, seconds: float, status: str = "ok"):
+    TOOL_SECONDS.labels(tool=tool, status=status).observe(seconds)
+    TOOL_CALLS.labels(tool=tool, status=status).inc()
+    _add_to_turn(invocation_id, f"tool:{tool}", seconds)
+
+def observe_turn(runner: str, seconds: float, status: str = "ok"):
+    TURN_SECONDS.labels(runner=runner, status=status).observe(seconds)
+    TURNS.labels(runner=runner, status=status).inc()
+
+def pop_turn_breakdown(invocation_id: Optional[str]) -> Dict[str, float]:
+    """
+    Return (and forget) the time spent in each agent, model and tool during a turn, in milliseconds.
+    """
+    if not invocation_id:
+        return {}
+    with _lock:
+        breakdown = _turns.pop(invocation_id, {})
+    return {part: round(seconds * 1000, 1) for part, seconds in breakdown.items()}
+
+def render() -> Tuple[bytes, str]:
+    """
+    Metrics in Prometheus text format, with their content type.
+    """
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,161 @@
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, Any, Optional, List, Tuple
+from dotenv import load_dotenv
+
+from google.genai import types
+from google.adk.models import LlmRequest, LlmResponse
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.registry import LLMRegistry
+
+import metrics
+
+load_dotenv()
+# comma separated list of tier=model
+MODEL_TIERS = os.getenv("MODEL_TIERS", "lite=gemini-2.5-flash-lite,flash=gemini-2.5-flash,pro=gemini-2.5-pro")
+# comma separated list of agent[.step]=route; a route is a tier (or model) or a cascade of tiers, e.g. "lite>pro".
+# Agents and steps without a route use the model of the agent.
+MODEL_ROUTES = os.getenv("MODEL_ROUTES", "")
+# a cascade response with an average log probability below this value is escalated to the next tier
+CASCADE_MIN_AVG_LOGPROB = float(os.getenv("CASCADE_MIN_AVG_LOGPROB", "-0.5"))
+
+# Model selection per agent and per step of the agent, applied by before_model_callback (see callback.py).
+# The step of a model call is found from the request:
+# - 'tool_result': the agent gets the result of one of its tools (e.g. presents the file list, writes a question)
+# - 'answer': the student replies to a question of the agent (e.g. answer to the quiz question)
+# - 'message': any other student message (e.g. a menu choice)
+# A cascade "lite>pro" calls the lite model first: its response is used unless it is malformed
+# (error, empty, unknown tool, missing tool arguments, truncated) or has low confidence (average log probability
+# below CASCADE_MIN_AVG_LOGPROB); then the next tier is called. The escalations are counted per agent, step and
+# reason (GET /stats/models and refresh_model_cascade_total on /metrics).
+# The cheaper tiers are called without streaming: on streamed turns (/chat/stream) the cascade is not run and the
+# last tier of the route is streamed, so that the student gets the text as it is generated.
+
+def _parse_pairs(value: str) -> Dict[str, str]:
+    pairs = {}
+    for item in value.split(","):
+        if "=" in item:
+            key, model = item.split("=", 1)
+            pairs[key.strip()] = model.strip()
+    return pairs
+
+_tiers = _parse_pairs(MODEL_TIERS)
+_routes = _parse_pairs(MODEL_ROUTES)
+
+def resolve(route: str) -> List[str]:
+    """
+    Models of a route, in cascade order: "lite>pro" -> ["gemini-2.5-flash-lite", "gemini-2.5-pro"].
+    """
+    return [_tiers.get(tier.strip(), tier.strip()) for tier in route.split(">") if tier.strip()]
+
+def step_of(llm_request: LlmRequest) -> str:
+    student = False
+    transferred = False
+    for content in reversed(llm_request.contents or []):
+        parts = content.parts or []
+        if any(p.function_response for p in parts):
+            return "message" if student else "tool_result"
+        text = " ".join(p.text for p in parts if p.text)
+        if content.role == "user":
+            # the events of the other agents (e.g. the transfer from activity_agent) are given as 'For context:' contents
+            if student:
+                return "message"
+            if text.startswith("For context:"):
+                # another agent handled the message first and transferred it to this one
+                transferred = True
+            else:
+                student = True
+            continue
+        # last reply of this agent before the student message
+        return "answer" if student and not transferred and "?" in text else "message"
+    return "message"
+
+def select(agent: str, llm_request: LlmRequest, streaming: bool = False) -> Tuple[str, List[str]]:
+    """
+    Step of the model call and models of its route (empty: the model of the agent).
+    A streamed call gets only the last model of a cascade.
+    """
+    step = step_of(llm_request)
+    route = _routes.get(f"{agent}.{step}") or _routes.get(agent) or _routes.get("*")
+    models = resolve(route) if route else []
+    return step, models[-1:] if streaming else models
+
+def _required_args(tool: Any) -> List[str]:
+    try:
+        declaration = tool._get_declaration()
+    except Exception:
+        return []
+    if declaration is None:
+        return []
+    if declaration.parameters is not None:
+        return list(declaration.parameters.required or [])
+    return list((declaration.parameters_json_schema or {}).get("required", []))
+
+def escalation_reason(llm_request: LlmRequest, llm_response: LlmResponse) -> Optional[str]:
+    """
+    Why a cascade response must be escalated to the next tier, None if it can be used.
+    """
+    if llm_response.error_code:
+        return "error"
+    if llm_response.finish_reason not in (None, types.FinishReason.STOP):
+        return "truncated"
+    parts = llm_response.content.parts if llm_response.content else None
+    if not parts:
+        return "empty"
+    calls = [p.function_call for p in parts if p.function_call]
+    for call in calls:
+        tool = llm_request.tools_dict.get(call.name)
+        if tool is None:
+            return "unknown_tool"
+        if any(arg not in (call.args or {}) for arg in _required_args(tool)):
+            return "missing_args"
+    if not calls and not "".join(p.text or "" for p in parts).strip():
+        return "empty"
+    if llm_response.avg_logprobs is not None and llm_response.avg_logprobs < CASCADE_MIN_AVG_LOGPROB:
+        return "low_confidence"
+    return None
+
+_llms: Dict[str, BaseLlm] = {}
+
+async def call_model(model: str, llm_request: LlmRequest) -> Optional[LlmResponse]:
+    """
+    Call a model of a cascade with a copy of the request (not streamed). Returns its last response.
+    """
+    llm = _llms.get(model)
+    if llm is None:
+        llm = _llms[model] = LLMRegistry.new_llm(model)
+    request = llm_request.model_copy(update={"model": model, "config": llm_request.config.model_copy(deep=True),
+                                             "contents": list(llm_request.contents)})
+    llm_response = None
+    async for llm_response in llm.generate_content_async(request, stream=False):
+        pass
+    return llm_response or LlmResponse(error_code="NO_RESPONSE", error_message=f"No response from {model}")
+
+class CascadeStats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # "agent.step" -> counters
+        self._counters: Dict[str, Dict[str, Any]] = defaultdict(lambda: {"calls": 0, "accepted": 0, "escalated": 0, "reasons": defaultdict(int)})
+
+    def observe(self, agent: str, step: str, model: str, reason: Optional[str]):
+        with self._lock:
+            counters = self._counters[f"{agent}.{step}"]
+            counters["calls"] += 1
+            if reason is None:
+                counters["accepted"] += 1
+            else:
+                counters["escalated"] += 1
+                counters["reasons"][reason] += 1
+        metrics.observe_cascade(agent, step, model, reason or "accepted")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            cascade = {
+                key: dict(c, reasons=dict(c["reasons"]), escalation_rate=round(c["escalated"] / c["calls"], 3) if c["calls"] else None)
+                for key, c in self._counters.items()
+            }
+        return {"tiers": _tiers, "routes": _routes, "cascade": cascade}
+
+cascade_stats = CascadeStats()
@@ -0,0 +1,312 @@
+import os
+import copy
+import json
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Set
+from dotenv import load_dotenv
+
+# Google ADK imports
+from google.adk.events import Event
+from google.adk.errors.already_exists_error import AlreadyExistsError
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+from google.adk.sessions.state import State
+
+from db import get_pool
+
+load_dotenv()
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "1000"))
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "0.5"))
+SESSION_FLUSH_BATCH_SIZE = int(os.getenv("SESSION_FLUSH_BATCH_SIZE", "100"))
+
+# Session service backed by the 'postgres' container (tables public.adk_sessions and public.adk_events).
+#
+# - read-through cache: hot sessions are kept in memory (LRU). A cache hit is revalidated with a single
+#   primary key lookup on 'update_time', so a session updated by another worker is reloaded.
+# - write-behind: append_event only updates the cached session and queues the event. Pending events and
+#   their merged state deltas are written in batches by a background task, or when flush() is called.
+
+class PostgresSessionService(BaseSessionService):
+
+    def __init__(self,
+                 cache_max_entries: int = SESSION_CACHE_MAX_ENTRIES,
+                 flush_interval: float = SESSION_FLUSH_INTERVAL,
+                 flush_batch_size: int = SESSION_FLUSH_BATCH_SIZE):
+        self.cache_max_entries = cache_max_entries
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+
+        # (app_name, user_id, session_id) -> Session
+        self._cache: "OrderedDict[tuple, Session]" = OrderedDict()
+        # (app_name, user_id, session_id) -> {"events": [...], "state_delta": {...}, "update_time": float}
+        self._pending: Dict[tuple, Dict[str, Any]] = {}
+        self._pending_count = 0
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        # flushes started by append_event when the batch is full: referenced until done
+        self._flush_tasks: Set[asyncio.Task] = set()
+
+    # ---------------------------------------------------------------- cache helpers
+
+    def _cache_put(self, key: tuple, session: Session):
+        self._cache[key] = session
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.cache_max_entries:
+            # evict the least recently used sessions, never the ones with unwritten events
+            evictable = [k for k in self._cache if k not in self._pending]
+            for old_key in evictable[:len(self._cache) - self.cache_max_entries]:
+                del self._cache[old_key]
+
+    @staticmethod
+    def _copy_session(session: Session, config: Optional[GetSessionConfig] = None) -> Session:
+        """
+        Return a copy of the cached session that the caller can mutate. Events are immutable and are shared.
+        """
+        events = list(session.events)
+        if config:
+            if config.after_timestamp is not None:
+                events = [e for e in events if e.timestamp >= config.after_timestamp]
+            if config.num_recent_events is not None:
+                events = events[-config.num_recent_events:] if config.num_recent_events > 0 else []
+
+        return Session(
+            id=session.id,
+            app_name=session.app_name,
+            user_id=session.user_id,
+            state=copy.deepcopy(session.state),
+            events=events,
+            last_update_time=session.last_update_time
+        )
+
+    # ---------------------------------------------------------------- BaseSessionService
+
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[Dict[str, Any]] = None,
+        session_id: Optional[str] = None
+    ) -> Session:
+        session_id = session_id.strip() if session_id and session_id.strip() else str(uuid.uuid4())
+        state = {k: v for k, v in (state or {}).items() if not k.startswith(State.TEMP_PREFIX)}
+        now = time.time()
+
+        pool = await get_pool()
+        row = await pool.fetchrow(
+            "INSERT INTO public.adk_sessions (app_name, user_id, id, state, update_time) "
+            "VALUES ($1, $2, $3, $4::jsonb, $5) ON CONFLICT DO NOTHING RETURNING id",
+            app_name, user_id, session_id, json.dumps(state), now
+        )
+        if row is None:
+            raise AlreadyExistsError(f"Session with id {session_id} already exists.")
+
+        session = Session(id=session_id, app_name=app_name, user_id=user_id, state=state, last_update_time=now)
+        self._cache_put((app_name, user_id, session_id), session)
+
+        return self._copy_session(session)
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None
+    ) -> Optional[Session]:
+        key = (app_name, user_id, session_id)
+        cached = self._cache.get(key)
+
+        if cached is not None and key in self._pending:
+            # local unwritten events: the cached copy is the most recent one
+            self._cache.move_to_end(key)
+            return self._copy_session(cached, config)
+
+        pool = await get_pool()
+
+        if cached is not None:
+            update_time = await pool.fetchval(
+                "SELECT update_time FROM public.adk_sessions WHERE app_name=$1 AND user_id=$2 AND id=$3",
+                app_name, user_id, session_id
+            )
+            if update_time is None:
+                self._cache.pop(key, None)
+                return None
+            if update_time <= cached.last_update_time:
+                self._cache.move_to_end(key)
+                return self._copy_session(cached, config)
+
+        # cache miss or stale entry: load the whole session
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT state, update_time FROM public.adk_sessions WHERE app_name=$1 AND user_id=$2 AND id=$3",
+                app_name, user_id, session_id
+            )
+            if row is None:
+                self._cache.pop(key, None)
+                return None
+            event_rows = await conn.fetch(
+                "SELECT event FROM public.adk_events WHERE app_name=$1 AND user_id=$2 AND session_id=$3 ORDER BY id",
+                app_name, user_id, session_id
+            )
+
+        session = Session(
+            id=session_id,
+            app_name=app_name,
+            user_id=user_id,
+            state=json.loads(row["state"]),
+            events=[Event.model_validate_json(r["event"]) for r in event_rows],
+            last_update_time=row["update_time"]
+        )
+        self._cache_put(key, session)
+
+        return self._copy_session(session, config)
+
+    async def list_sessions(self, *, app_name: str, user_id: Optional[str] = None) -> ListSessionsResponse:
+        await self.flush()
+        pool = await get_pool()
+        if user_id is None:
+            rows = await pool.fetch(
+                "SELECT user_id, id, state, update_time FROM public.adk_sessions WHERE app_name=$1 ORDER BY update_time",
+                app_name
+            )
+        else:
+            rows = await pool.fetch(
+                "SELECT user_id, id, state, update_time FROM public.adk_sessions WHERE app_name=$1 AND user_id=$2 ORDER BY update_time",
+                app_name, user_id
+            )
+
+        sessions = [
+            Session(id=r["id"], app_name=app_name, user_id=r["user_id"], state=json.loads(r["state"]), last_update_time=r["update_time"])
+            for r in rows
+        ]
+        return ListSessionsResponse(sessions=sessions)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        key = (app_name, user_id, session_id)
+        pending = self._pending.pop(key, None)
+        if pending:
+            self._pending_count -= len(pending["events"])
+        self._cache.pop(key, None)
+
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    "DELETE FROM public.adk_events WHERE app_name=$1 AND user_id=$2 AND session_id=$3",
+                    app_name, user_id, session_id
+                )
+                await conn.execute(
+                    "DELETE FROM public.adk_sessions WHERE app_name=$1 AND user_id=$2 AND id=$3",
+                    app_name, user_id, session_id
+                )
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+
+        # update the caller's session object (state delta + events list)
+        event = await super().append_event(session=session, event=event)
+        session.last_update_time = event.timestamp
+
+        key = (session.app_name, session.user_id, session.id)
+
+        state_delta = {}
+        if event.actions and event.actions.state_delta:
+            state_delta = {k: v for k, v in event.actions.state_delta.items() if not k.startswith(State.TEMP_PREFIX)}
+
+        # keep the cached copy aligned with the caller's one
+        cached = self._cache.get(key)
+        if cached is not None and cached is not session:
+            cached.state.update(state_delta)
+            cached.events.append(event)
+            cached.last_update_time = event.timestamp
+        elif cached is None:
+            self._cache_put(key, self._copy_session(session))
+
+        # queue the write
+        pending = self._pending.setdefault(key, {"events": [], "state_delta": {}, "update_time": 0.0})
+        pending["events"].append(event)
+        pending["state_delta"].update(state_delta)
+        pending["update_time"] = max(pending["update_time"], event.timestamp)
+        self._pending_count += 1
+
+        if self._pending_count >= self.flush_batch_size:
+            task = asyncio.get_running_loop().create_task(self.flush())
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_done)
+        else:
+            self._start_flusher()
+
+        return event
+
+    # ---------------------------------------------------------------- write-behind
+
+    def _flush_done(self, task: asyncio.Task):
+        self._flush_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"SESSION FLUSH ERROR: {task.exception()}")
+            # the batch is pending again: the background task retries it
+            self._start_flusher()
+
+    def _start_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"SESSION FLUSH ERROR: {e}")
+
+    async def flush(self) -> None:
+        """
+        Write all the pending events and state deltas in a single transaction.
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return
+
+            batch = self._pending
+            self._pending = {}
+            self._pending_count = 0
+
+            event_rows: List[tuple] = []
+            session_rows: List[tuple] = []
+            for (app_name, user_id, session_id), pending in batch.items():
+                for event in pending["events"]:
+                    event_rows.append((app_name, user_id, session_id, event.id, event.timestamp, event.model_dump_json(exclude_none=True)))
+                session_rows.append((app_name, user_id, session_id, json.dumps(pending["state_delta"]), pending["update_time"]))
+
+            try:
+                pool = await get_pool()
+                async with pool.acquire() as conn:
+                    async with conn.transaction():
+                        await conn.executemany(
+                            "INSERT INTO public.adk_events (app_name, user_id, session_id, event_id, timestamp, event) "
+                            "VALUES ($1, $2, $3, $4, $5, $6::jsonb)",
+                            event_rows
+                        )
+                        await conn.executemany(
+                            "UPDATE public.adk_sessions SET state = state || $4::jsonb, update_time = GREATEST(update_time, $5) "
+                            "WHERE app_name=$1 AND user_id=$2 AND id=$3",
+                            session_rows
+                        )
+            except Exception:
+                # put the batch back in front of anything queued meanwhile, it will be retried by the next flush
+                for key, pending in batch.items():
+                    newer = self._pending.get(key)
+                    if newer:
+                        pending["events"].extend(newer["events"])
+                        pending["state_delta"].update(newer["state_delta"])
+                        pending["update_time"] = max(pending["update_time"], newer["update_time"])
+                    self._pending[key] = pending
+                self._pending_count = sum(len(p["events"]) for p in self._pending.values())
+                raise
+
+            print(f"SESSION FLUSH: {len(event_rows)} event(s) for {len(session_rows)} session(s)")
@@ -0,0 +1,102 @@
+import os
+import json
+from typing import List, Any
+from dotenv import load_dotenv
+
+from google.adk.tools import FunctionTool
+
+from db import get_pool
+
+load_dotenv()
+# 'toolbox' calls the MCP Toolbox for Database over HTTP, 'asyncpg' runs the same queries in process
+LOGIN_DB_BACKEND = os.getenv("LOGIN_DB_BACKEND", "toolbox")
+
+# In-process version of the login tools of toolbox/tools.yaml, on the shared asyncpg pool (db.py).
+# Tool names, parameters and statements are the ones of tools.yaml, and the replies have the same format
+# (json list of rows, 'null' when there are no rows), so the agents work with either backend.
+# asyncpg prepares each statement once per pooled connection and reuses it (statement cache).
+
+def rows_to_json(rows: List[Any]) -> str:
+    if not rows:
+        return "null"
+    return json.dumps([dict(r) for r in rows], default=str)
+
+async def get_student_info(username: str) -> str:
+    """
+    Get the data for a particular student. If the student exist reply with the student data in json format. If the student does't exist reply with 'null'
+
+    Args:
+        username: The name of the user
+    """
+    pool = await get_pool()
+    rows = await pool.fetch("SELECT * FROM public.students WHERE username=$1", username)
+    return rows_to_json(rows)
+
+async def add_student(username: str, email: str) -> str:
+    """
+    Add a student.
+
+    Args:
+        username: The name of the student to add
+        email: The email of the student to add
+    """
+    pool = await get_pool()
+    rows = await pool.fetch(
+        "INSERT INTO public.students (id, username, email, created_at, updated_at) "
+        "VALUES(nextval('users_id_seq'::regclass), $1, $2, now(), now()) returning id;",
+        username, email
+    )
+    return rows_to_json(rows)
+
+async def add_session(student_id: int, name: str, guid: str) -> str:
+    """
+    Add a session.
+
+    Args:
+        student_id: The id of the user who own the session
+        name: The name of the session
+        guid: The session guid related to agent session service
+    """
+    pool = await get_pool()
+    rows = await pool.fetch(
+        "INSERT INTO public.sessions (id, student_id, name, guid) VALUES(nextval('sessions_id_seq'::regclass), $1, $2, $3) returning id;",
+        student_id, name, guid
+    )
+    return rows_to_json(rows)
+
+async def get_last_session(student_id: int) -> str:
+    """
+    Get the last session for a specific student identified by it's 'student_id'. If a session exists reply with session data in json format. If a session doen't exist reply with 'null'
+
+    Args:
+        student_id: The id of the user who own the session
+    """
+    pool = await get_pool()
+    rows = await pool.fetch("SELECT guid, name FROM public.sessions where student_id=$1 ORDER BY id DESC LIMIT 1;", student_id)
+    return rows_to_json(rows)
+
+async def login_student(username: str, email: str, session_name: str, guid: str) -> str:
+    """
+    Login of a student in one step. Get the student (or add it when 'email' is provided) and get the last session of the student (or add it when 'session_name' is provided). Reply with a json object whose 'status' is 'ok' (student_id, guid and session_name of the session), 'email_required' (the student doesn't exist, ask for the email), 'session_name_required' (the student has no session, ask for a session name) or 'email_in_use' (the email belongs to another student).
+
+    Args:
+        username: The name of the student, in lowercase
+        email: The email of the student, '' if not provided
+        session_name: The name of the session to add, '' if not provided
+        guid: The session guid related to agent session service
+    """
+    pool = await get_pool()
+    login = await pool.fetchval("SELECT public.login_student($1, $2, $3, $4)::text AS login;", username, email, session_name, guid)
+    # asyncpg returns json as text: decode it, like the toolbox does
+    return json.dumps([{"login": json.loads(login)}])
+
+# FunctionTool takes the tool name from the function name: use the toolbox name
+login_student.__name__ = "login-student"
+
+# only login-student is in a toolset (see tools.yaml)
+login_student_tool = FunctionTool(func=login_student)
+
+# same content of the toolsets of tools.yaml
+toolsets = {
+    "login-toolset": [login_student_tool]
+}
@@ -0,0 +1,286 @@
+import io
+import os
+import re
+import math
+import hashlib
+from abc import ABC, abstractmethod
+from types import SimpleNamespace
+from typing import Dict, Any, Optional, List
+from dotenv import load_dotenv
+
+from google.genai import Client, types
+
+from db import get_pool
+from tool_executor import run_blocking
+from gcs_client import get_storage_client
+from gcs_tools import get_blob_metadata
+
+load_dotenv()
+# 'vertex' (Vertex AI RAG corpus) or 'pgvector' (table public.document_chunks of the postgres container)
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "vertex")
+# 'genai' (Gemini / Vertex AI embedding model), 'local' (sentence-transformers model on CPU) or 'hashing' (no model)
+EMBEDDER = os.getenv("EMBEDDER", "genai")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "gemini-embedding-001")
+# must match the vector(...) column of public.document_chunks
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "768"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+PGVECTOR_CHUNK_SIZE = int(os.getenv("PGVECTOR_CHUNK_SIZE", "1024"))
+PGVECTOR_CHUNK_OVERLAP = int(os.getenv("PGVECTOR_CHUNK_OVERLAP", "200"))
+PGVECTOR_EF_SEARCH = int(os.getenv("PGVECTOR_EF_SEARCH", "40"))
+PGVECTOR_PARSING_MODEL = os.getenv("PGVECTOR_PARSING_MODEL", "gemini-2.5-flash-lite")
+# written with every chunk (embedder column): the chunks of another embedder are imported again and never searched
+EMBEDDER_ID = f"{EMBEDDER}:{EMBEDDING_MODEL}"
+
+# Retrieval backend on pgvector, used in place of the Vertex AI RAG corpus with RETRIEVAL_BACKEND=pgvector
+# (see rag_tools.retrieve_context and rag_tools.run_import_batch).
+# Import: the blob is downloaded, its text extracted (text files as they are, PDFs with pypdf if installed,
+# otherwise with PGVECTOR_PARSING_MODEL like the LLM parser of the Vertex AI import), split in chunks of about
+# PGVECTOR_CHUNK_SIZE tokens overlapping by PGVECTOR_CHUNK_OVERLAP, embedded and stored in public.document_chunks
+# with the generation and md5 of the blob: an unchanged blob is skipped, a changed one replaces its chunks.
+# Search: nearest chunks by cosine distance through the HNSW index of the table.
+# The embedder is pluggable (EMBEDDER): every chunk of the table must come from the same model. After a change of
+# EMBEDDER or EMBEDDING_MODEL the unchanged blobs are embedded again on their next import, and the search only
+# compares the query with the chunks of the current embedder.
+
+# ------------------------------------------------------------------------------------------------
+# Embedders
+# ------------------------------------------------------------------------------------------------
+
+class Embedder(ABC):
+
+    def __init__(self, model: str, dimensions: int):
+        self.model = model
+        self.dimensions = dimensions
+
+    @abstractmethod
+    def embed(self, texts: List[str], query: bool = False) -> List[List[float]]:
+        """
+        Embeddings of the texts (documents, or a query if query is True). Blocking call.
+        """
+
+class GenaiEmbedder(Embedder):
+
+    def __init__(self, model: str, dimensions: int):
+        super().__init__(model, dimensions)
+        self.client = Client()
+
+    def embed(self, texts: List[str], query: bool = False) -> List[List[float]]:
+        response = self.client.models.embed_content(
+            model=self.model,
+            contents=texts,
+            config=types.EmbedContentConfig(task_type="RETRIEVAL_QUERY" if query else "RETRIEVAL_DOCUMENT",
+                                            output_dimensionality=self.dimensions)
+        )
+        return [_normalize(e.values) for e in response.embeddings]
+
+class LocalEmbedder(Embedder):
+    # e.g. EMBEDDING_MODEL=sentence-transformers/paraphrase-multilingual-mpnet-base-v2 (768 dimensions)
+
+    def __init__(self, model: str, dimensions: int):
+        super().__init__(model, dimensions)
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError("EMBEDDER=local needs the sentence-transformers package (pip install sentence-transformers)") from e
+        self._model = SentenceTransformer(model, device="cpu")
+        if self._model.get_sentence_embedding_dimension() != dimensions:
+            raise ValueError(f"{model} has {self._model.get_sentence_embedding_dimension()} dimensions, EMBEDDING_DIMENSIONS is {dimensions}")
+
+    def embed(self, texts: List[str], query: bool = False) -> List[List[float]]:
+        return self._model.encode(texts, batch_size=EMBEDDING_BATCH_SIZE, normalize_embeddings=True).tolist()
+
+class HashingEmbedder(Embedder):
+    # signed feature hashing of the words: no model and no network call, for tests and offline runs
+
+    def embed(self, texts: List[str], query: bool = False) -> List[List[float]]:
+        vectors = []
+        for text in texts:
+            vector = [0.0] * self.dimensions
+            for word in re.findall(r"\w{2,}", text.lower()):
+                h = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+                vector[h % self.dimensions] += 1.0 if h >> 63 else -1.0
+            vectors.append(_normalize(vector))
+        return vectors
+
+EMBEDDERS = {"genai": GenaiEmbedder, "local": LocalEmbedder, "hashing": HashingEmbedder}
+
+def _normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+def _vector_literal(vector: List[float]) -> str:
+    return "[" + ",".join(f"{x:.7g}" for x in vector) + "]"
+
+_embedder: Optional[Embedder] = None
+
+def get_embedder() -> Embedder:
+    global _embedder
+    if _embedder is None:
+        if EMBEDDER not in EMBEDDERS:
+            raise ValueError(f"Unknown EMBEDDER '{EMBEDDER}', expected one of {', '.join(EMBEDDERS)}")
+        _embedder = EMBEDDERS[EMBEDDER](EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+    return _embedder
+
+# ------------------------------------------------------------------------------------------------
+# Documents
+# ------------------------------------------------------------------------------------------------
+
+def _pdf_text(data: bytes) -> str:
+    try:
+        from pypdf import PdfReader
+        text = "\n".join(page.extract_text() or "" for page in PdfReader(io.BytesIO(data)).pages)
+        if text.strip():
+            return text
+    except ImportError:
+        pass
+    # no pypdf or no text layer (scanned document): the parsing model reads the PDF
+    response = Client().models.generate_content(
+        model=PGVECTOR_PARSING_MODEL,
+        contents=[types.Part.from_bytes(data=data, mime_type="application/pdf"),
+                  "Extract the full text of this document as plain text, in reading order, without comments."]
+    )
+    return response.text or ""
+
+def read_document(gcs_uri: str) -> str:
+    """
+    Download a blob and extract its text. Blocking call.
+    """
+    bucket_name, blob_name = gcs_uri[5:].split("/", 1)
+    data = get_storage_client().bucket(bucket_name).blob(blob_name).download_as_bytes()
+    name = blob_name.lower()
+    if name.endswith(".pdf"):
+        return _pdf_text(data)
+    text = data.decode("utf-8", errors="replace")
+    if name.endswith((".html", ".htm")):
+        text = re.sub(r"<(script|style)[^>]*>.*?</\1>|<[^>]+>", " ", text, flags=re.S | re.I)
+    return text
+
+def chunk_text(text: str) -> List[str]:
+    """
+    Chunks of about PGVECTOR_CHUNK_SIZE tokens (4 characters per token) overlapping by PGVECTOR_CHUNK_OVERLAP,
+    cut at word boundaries.
+    """
+    text = re.sub(r"\n{3,}", "\n\n", re.sub(r"[ \t\r\f\v]+", " ", text)).strip()
+    size, overlap = PGVECTOR_CHUNK_SIZE * 4, PGVECTOR_CHUNK_OVERLAP * 4
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            cut = text.rfind(" ", start + size // 2, end)
+            end = cut if cut > 0 else end
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+        space = text.find(" ", start, end)
+        start = space + 1 if space != -1 else start
+    return [c for c in chunks if c]
+
+# ------------------------------------------------------------------------------------------------
+# Store
+# ------------------------------------------------------------------------------------------------
+
+class PgVectorStore:
+
+    def __init__(self):
+        self._counters = {"searches": 0, "imported": 0, "skipped": 0, "failed": 0, "chunks": 0}
+
+    async def import_file(self, corpus_id: str, gcs_uri: str) -> str:
+        """
+        Import a blob in the corpus. Returns 'imported', 'skipped' (unchanged since the last import) or 'failed'.
+        """
+        try:
+            metadata = await run_blocking("import_document_to_corpus", get_blob_metadata, gcs_uri)
+            if metadata is None:
+                raise FileNotFoundError(gcs_uri)
+            version = f"{metadata['generation']}:{metadata['md5_hash']}"
+
+            pool = await get_pool()
+            current = await pool.fetchval(
+                "SELECT source_version FROM public.document_chunks WHERE corpus_id=$1 AND source_uri=$2 AND embedder=$3 LIMIT 1",
+                corpus_id, gcs_uri, EMBEDDER_ID
+            )
+            if current == version:
+                print(f"IMPORT SKIPPED (unchanged): {gcs_uri}")
+                return "skipped"
+
+            text = await run_blocking("import_document_to_corpus", read_document, gcs_uri)
+            chunks = chunk_text(text)
+            embedder = get_embedder()
+            vectors = []
+            for i in range(0, len(chunks), EMBEDDING_BATCH_SIZE):
+                vectors += await run_blocking("embed", embedder.embed, chunks[i:i + EMBEDDING_BATCH_SIZE])
+
+            async with pool.acquire() as connection:
+                async with connection.transaction():
+                    await connection.execute("DELETE FROM public.document_chunks WHERE corpus_id=$1 AND source_uri=$2", corpus_id, gcs_uri)
+                    await connection.executemany(
+                        "INSERT INTO public.document_chunks (corpus_id, source_uri, source_version, chunk_index, content, embedding, embedder) "
+                        "VALUES ($1, $2, $3, $4, $5, $6::vector, $7)",
+                        [(corpus_id, gcs_uri, version, i, chunk, _vector_literal(vector), EMBEDDER_ID)
+                         for i, (chunk, vector) in enumerate(zip(chunks, vectors))]
+                    )
+            self._counters["chunks"] += len(chunks)
+            print(f"IMPORTED {gcs_uri}: {len(chunks)} chunk(s)")
+            return "imported"
+        except Exception as e:
+            print(f"PGVECTOR IMPORT ERROR {gcs_uri}: {e}")
+            return "failed"
+
+    async def import_files(self, corpus_id: str, gcs_uris: List[str]) -> Dict[str, Any]:
+        """
+        Import a batch of blobs, with the same result as rag_tools.run_import_batch.
+        """
+        result = {"imported": 0, "failed": 0, "skipped": 0, "files": {}}
+        for uri in gcs_uris:
+            outcome = await self.import_file(corpus_id, uri)
+            result[outcome] += 1
+            self._counters[outcome] += 1
+            result["files"][uri] = {key: int(key == outcome) for key in ("imported", "failed", "skipped")}
+        return result
+
+    async def search(self, corpus_id: str, query: str, top_k: int, max_distance: float = float("inf")) -> List[Any]:
+        """
+        The top_k chunks of the corpus nearest to the query (cosine distance), as contexts with text, source_uri and distance.
+        """
+        self._counters["searches"] += 1
+        vector = (await run_blocking("embed", get_embedder().embed, [query], True))[0]
+        pool = await get_pool()
+        async with pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.execute(f"SET LOCAL hnsw.ef_search = {PGVECTOR_EF_SEARCH}")
+                # keep scanning the index when the corpus filter discards the nearest chunks
+                await connection.execute("SET LOCAL hnsw.iterative_scan = relaxed_order")
+                rows = await connection.fetch(
+                    "SELECT content, source_uri, embedding <=> $1::vector AS distance FROM public.document_chunks "
+                    "WHERE corpus_id = $2 AND embedder = $4 ORDER BY embedding <=> $1::vector LIMIT $3",
+                    _vector_literal(vector), corpus_id, top_k, EMBEDDER_ID
+                )
+        if not rows:
+            # vectors of another model are not comparable with the query: the corpus must be imported again
+            other = await pool.fetchval(
+                "SELECT embedder FROM public.document_chunks WHERE corpus_id = $1 AND embedder <> $2 LIMIT 1",
+                corpus_id, EMBEDDER_ID
+            )
+            if other is not None:
+                raise ValueError(f"The chunks of corpus {corpus_id} were embedded with {other}, not {EMBEDDER_ID}: import its documents again")
+        return [SimpleNamespace(text=r["content"], source_uri=r["source_uri"], distance=r["distance"])
+                for r in sorted(rows, key=lambda r: r["distance"]) if r["distance"] <= max_distance]
+
+    async def file_chunks(self, corpus_id: str, gcs_uri: str, limit: Optional[int] = None) -> List[str]:
+        """
+        Chunks of an imported blob, in document order.
+        """
+        pool = await get_pool()
+        rows = await pool.fetch(
+            "SELECT content FROM public.document_chunks WHERE corpus_id=$1 AND source_uri=$2 ORDER BY chunk_index LIMIT $3",
+            corpus_id, gcs_uri, limit
+        )
+        return [r["content"] for r in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._counters, backend=RETRIEVAL_BACKEND, embedder=EMBEDDER, model=EMBEDDING_MODEL,
+                    dimensions=EMBEDDING_DIMENSIONS, embedder_id=EMBEDDER_ID)
+
+pgvector_store = PgVectorStore()
@@ -21,11 +21,20 @@ from google.genai import types
 
 from callback import before_tool_callback, after_tool_callback
 from callback import before_agent_callback, after_agent_callback
+from callback import before_model_callback, after_model_callback
 
 from rag_tools import import_document_to_corpus_tool, retrieve_context_tool
+from question_bank import serve_from_bank
 
 generate_content_config=types.GenerateContentConfig(temperature=2)
 
+async def question_before_model_callback(callback_context: CallbackContext, llm_request):
+    # a question of the question bank is served without calling the model
+    response = await serve_from_bank(callback_context, llm_request)
+    if response is not None:
+        return response
+    return await before_model_callback(callback_context, llm_request)
+
 question_agent = Agent(
     name="question_agent",
     generate_content_config = generate_content_config,
@@ -47,7 +56,9 @@ question_agent = Agent(
     before_tool_callback=before_tool_callback,  
     after_tool_callback=after_tool_callback,
     before_agent_callback=before_agent_callback,
-    after_agent_callback=after_agent_callback 
+    after_agent_callback=after_agent_callback,
+    before_model_callback=question_before_model_callback,
+    after_model_callback=after_model_callback
 
 )
 
@@ -0,0 +1,287 @@
+import os
+import re
+import json
+import hashlib
+import asyncio
+from typing import Dict, Any, Optional, List, Set
+from pydantic import BaseModel
+from dotenv import load_dotenv
+
+from vertexai import rag
+from vertexai.rag.utils import resources
+from google.genai import Client, types
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+
+from db import get_pool
+from tool_executor import run_blocking
+from usage import usage_recorder
+from cassette import cassettes
+from pgvector_store import pgvector_store, RETRIEVAL_BACKEND
+import tracing
+
+load_dotenv()
+GOOGLE_CLOUD_PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT_ID")
+GOOGLE_CLOUD_LOCATION = os.getenv("GOOGLE_CLOUD_LOCATION")
+QUESTION_BANK_ENABLED = os.getenv("QUESTION_BANK_ENABLED", "True") == "True"
+QUESTION_BANK_MODEL = os.getenv("QUESTION_BANK_MODEL", "gemini-2.5-flash")
+QUESTION_BANK_CHUNKS_PER_FILE = int(os.getenv("QUESTION_BANK_CHUNKS_PER_FILE", "8"))
+QUESTION_BANK_CONCURRENCY = int(os.getenv("QUESTION_BANK_CONCURRENCY", "2"))
+
+# Bank of quiz questions (tables public.question_bank and public.question_bank_served).
+# After an import (rag_tools.run_import_batch) the chunks of each imported document are retrieved from the corpus
+# and a background task asks the model for a question, its answer key and a topic for every chunk.
+# When the student asks for a quiz, question_agent looks for an unseen question of the bank matching the topic
+# (full text search on topic and keywords) and serves it without calling the model; on a miss the question
+# is generated live as before (retrieve_context, then the model).
+
+# retrieval query used to get the most informative chunks of a document
+CHUNKS_QUERY = "main rules, definitions, obligations, procedures and numbers"
+
+# words of the quiz requests that are not topics
+STOP_WORDS = {"quiz", "about", "question", "questions", "test", "the", "and", "for", "with", "want", "please",
+              "domanda", "domande", "una", "sul", "sulla", "sulle", "sui", "per", "voglio", "fammi", "dammi", "argomento", "favore"}
+
+GENERATION_PROMPT = "You write quiz questions for workplace safety students. For each numbered text below write one question " \
+                    "that can be answered only with the information of that text, and its answer key. " \
+                    "Question and answer key must be in Italian. 'topic' is the subject of the question in 1-3 lowercase words, " \
+                    "'keywords' are 3-8 lowercase words related to the subject, in Italian and in English, separated by spaces. " \
+                    "'chunk' is the number of the text.\n\n"
+
+class BankQuestion(BaseModel):
+    chunk: int
+    topic: str
+    keywords: str
+    question: str
+    answer_key: str
+
+def corpus_resource_name(corpus_id: str) -> str:
+    return f"projects/{GOOGLE_CLOUD_PROJECT_ID}/locations/{GOOGLE_CLOUD_LOCATION}/ragCorpora/{corpus_id}"
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha1(text.encode()).hexdigest()
+
+def topic_query(text: str) -> Optional[str]:
+    """
+    Full text query (words in OR) of the topic asked by the student, None if the message has no topic words.
+    """
+    words = [w for w in re.findall(r"\w{3,}", text.lower()) if w not in STOP_WORDS]
+    return " | ".join(dict.fromkeys(words)) if words else None
+
+def fetch_chunks(corpus_id: str, gcs_uri: str) -> List[str]:
+    """
+    Retrieve the most informative chunks of the RAG file imported from a GCS URI. Blocking call.
+    """
+    # rag_tools imports this module: imported here
+    from rag_tools import find_rag_files
+
+    corpus_name = corpus_resource_name(corpus_id)
+    file_ids = [name.rsplit("/", 1)[-1] for name in find_rag_files(corpus_id, [gcs_uri]).values()]
+    if not file_ids:
+        return []
+
+    response = rag.retrieval_query(
+        rag_resources=[rag.RagResource(rag_corpus=corpus_name, rag_file_ids=file_ids)],
+        text=CHUNKS_QUERY,
+        rag_retrieval_config=resources.RagRetrievalConfig(top_k=QUESTION_BANK_CHUNKS_PER_FILE)
+    )
+    if not (response.contexts and response.contexts.contexts):
+        return []
+    return [ctx.text for ctx in response.contexts.contexts if ctx.text]
+
+_genai_client: Optional[Client] = None
+
+async def generate_questions(chunks: List[str]) -> List[BankQuestion]:
+    """
+    Ask the model for a question, answer key and topic for each chunk, in one call.
+    """
+    global _genai_client
+    if _genai_client is None:
+        _genai_client = Client()
+
+    prompt = GENERATION_PROMPT + "\n\n".join(f"TEXT {i}:\n{chunk}" for i, chunk in enumerate(chunks))
+    response = await _genai_client.aio.models.generate_content(
+        model=QUESTION_BANK_MODEL,
+        contents=prompt,
+        config=types.GenerateContentConfig(temperature=0.7, response_mime_type="application/json",
+                                           response_schema=list[BankQuestion])
+    )
+    usage_recorder.record("0", "", "question_bank", QUESTION_BANK_MODEL, response.usage_metadata)
+    if response.parsed is not None:
+        return list(response.parsed)
+    return [BankQuestion(**item) for item in json.loads(response.text)]
+
+async def store(corpus_id: str, source_uri: str, chunks: List[str], questions: List[BankQuestion]) -> int:
+    """
+    Add the questions of a document to the bank, replacing the ones generated from a previous version of it.
+    """
+    rows = [
+        (corpus_id, q.topic.strip().lower()[:200], q.keywords.strip().lower()[:500], source_uri, chunk_hash(chunks[q.chunk]),
+         q.question.strip(), q.answer_key.strip())
+        for q in questions if 0 <= q.chunk < len(chunks) and q.question.strip() and q.answer_key.strip()
+    ]
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            await connection.execute(
+                "DELETE FROM public.question_bank WHERE corpus_id=$1 AND source_uri=$2 AND chunk_hash <> ALL($3::varchar[])",
+                corpus_id, source_uri, [chunk_hash(c) for c in chunks]
+            )
+            await connection.executemany(
+                "INSERT INTO public.question_bank (corpus_id, topic, keywords, source_uri, chunk_hash, question, answer_key) "
+                "VALUES ($1, $2, $3, $4, $5, $6, $7) ON CONFLICT DO NOTHING",
+                rows
+            )
+    return len(rows)
+
+async def known_chunks(corpus_id: str, hashes: List[str]) -> Set[str]:
+    pool = await get_pool()
+    rows = await pool.fetch("SELECT DISTINCT chunk_hash FROM public.question_bank WHERE corpus_id=$1 AND chunk_hash = ANY($2::varchar[])",
+                            corpus_id, hashes)
+    return {r["chunk_hash"] for r in rows}
+
+async def next_question(corpus_id: str, topic: str, student_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Pick a question of the bank matching the topic that the student has not seen yet, and mark it as served.
+    Returns None when there is none.
+    """
+    query = topic_query(topic)
+    if not query:
+        return None
+    pool = await get_pool()
+    row = await pool.fetchrow(
+        "WITH q AS ("
+        "  SELECT b.id, b.topic, b.question, b.answer_key, b.source_uri FROM public.question_bank b"
+        "  WHERE b.corpus_id = $1"
+        "    AND to_tsvector('simple', b.topic || ' ' || b.keywords) @@ to_tsquery('simple', $2)"
+        "    AND NOT EXISTS (SELECT 1 FROM public.question_bank_served s WHERE s.student_id = $3 AND s.question_id = b.id)"
+        "  ORDER BY ts_rank(to_tsvector('simple', b.topic || ' ' || b.keywords), to_tsquery('simple', $2)) DESC, random()"
+        "  LIMIT 1"
+        "), served AS ("
+        "  INSERT INTO public.question_bank_served (student_id, question_id) SELECT $3, id FROM q ON CONFLICT DO NOTHING"
+        ") SELECT * FROM q",
+        corpus_id, query, student_id
+    )
+    return dict(row) if row else None
+
+class QuestionBankBuilder:
+    """
+    Background generation of the questions of the imported documents, at most QUESTION_BANK_CONCURRENCY documents at a time.
+    """
+
+    def __init__(self, concurrency: int = QUESTION_BANK_CONCURRENCY):
+        self.concurrency = concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._counters = {"scheduled": 0, "documents": 0, "questions": 0, "unchanged": 0, "errors": 0,
+                          "hits": 0, "misses": 0}
+
+    def schedule(self, corpus_id: str, gcs_uris: List[str]):
+        """
+        Start the generation of the questions of the given documents. Must be called from the event loop.
+        """
+        if not QUESTION_BANK_ENABLED:
+            return
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        for uri in gcs_uris:
+            self._counters["scheduled"] += 1
+            task = asyncio.get_running_loop().create_task(self._build(corpus_id, uri))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _build(self, corpus_id: str, gcs_uri: str):
+        async with self._semaphore:
+            try:
+                if RETRIEVAL_BACKEND == "pgvector":
+                    chunks = await pgvector_store.file_chunks(corpus_id, gcs_uri, QUESTION_BANK_CHUNKS_PER_FILE)
+                else:
+                    chunks = await run_blocking("question_bank", fetch_chunks, corpus_id, gcs_uri)
+                known = await known_chunks(corpus_id, [chunk_hash(c) for c in chunks])
+                if chunks and len(known) == len(set(chunk_hash(c) for c in chunks)):
+                    # same chunks as the previous import: the questions are still valid
+                    self._counters["unchanged"] += 1
+                    return
+                questions = await generate_questions(chunks) if chunks else []
+                stored = await store(corpus_id, gcs_uri, chunks, questions)
+                self._counters["documents"] += 1
+                self._counters["questions"] += stored
+                print(f"QUESTION BANK: {stored} question(s) from {gcs_uri}")
+            except Exception as e:
+                self._counters["errors"] += 1
+                print(f"QUESTION BANK ERROR {gcs_uri}: {e}")
+
+    def record_hit(self):
+        self._counters["hits"] += 1
+
+    def record_miss(self):
+        self._counters["misses"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._counters, running=len(self._tasks), enabled=QUESTION_BANK_ENABLED)
+
+question_bank = QuestionBankBuilder()
+
+def _student_message(llm_request: LlmRequest) -> Optional[str]:
+    # the message of the student if this is the first model call of the turn (no tool called yet)
+    for content in reversed(llm_request.contents or []):
+        parts = content.parts or []
+        if content.role != "user" or any(p.function_call or p.function_response for p in parts):
+            return None
+        text = " ".join(p.text for p in parts if p.text)
+        # the events of the other agents (e.g. the transfer from activity_agent) are given as 'For context:' contents
+        if text and not text.startswith("For context:"):
+            return text
+    return None
+
+def _awaiting_answer(llm_request: LlmRequest) -> bool:
+    # the last reply of the agent is a question generated live: the message is its answer
+    for content in reversed(llm_request.contents or []):
+        if content.role == "model":
+            text = " ".join(p.text for p in (content.parts or []) if p.text)
+            if text:
+                return "?" in text
+    return False
+
+async def serve_from_bank(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+    """
+    before_model_callback of question_agent: reply with a question of the bank, without calling the model,
+    when the student asks for a quiz on a topic covered by the bank. When the student answers it, the answer key
+    is added to the instructions of the model call grading the answer.
+    """
+    if not QUESTION_BANK_ENABLED:
+        return None
+    state = callback_context.state
+    session_id = callback_context._invocation_context.session.id
+
+    pending = state.get("quiz_bank_question")
+    if pending:
+        llm_request.append_instructions([
+            f"The student is answering this question of the question bank: {pending['question']}\n"
+            f"ANSWER KEY: {pending['answer_key']}\n"
+            "Grade the answer comparing it with the answer key, do not call 'retrieve_context'."
+        ])
+        state["quiz_bank_question"] = None
+        return None
+
+    message = _student_message(llm_request)
+    if not message or _awaiting_answer(llm_request) or not topic_query(message):
+        return None
+
+    try:
+        question = await cassettes.call(session_id, callback_context.agent_name, "question_bank",
+                                        {"corpus_id": state.get("corpus_id"), "topic": message},
+                                        lambda: next_question(state.get("corpus_id"), message, state.get("user_id", "0")))
+    except Exception as e:
+        print(f"QUESTION BANK LOOKUP ERROR: {e}")
+        return None
+
+    tracing.record("question_bank", "info", session_id=session_id, invocation_id=callback_context.invocation_id,
+                   hit=question is not None, topic=message)
+    if not question:
+        question_bank.record_miss()
+        return None
+
+    question_bank.record_hit()
+    state["quiz_bank_question"] = {"id": question["id"], "question": question["question"], "answer_key": question["answer_key"]}
+    return LlmResponse(content=types.Content(role="model", parts=[types.Part(text=question["question"])]))
@@ -1,13 +1,29 @@
 import vertexai
 from vertexai import rag
 from vertexai.rag.utils import resources
-from typing import Dict, Optional, Any
+from typing import Dict, Optional, Any, List, Set, Tuple
+from types import SimpleNamespace
 import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 from google.cloud import storage
 
 from google.adk.tools import FunctionTool
 
+from ttl_cache import TTLCache
+from tool_executor import run_blocking
+from import_jobs import ImportJobQueue
+from gcs_tools import get_blob_metadata
+from gcs_client import get_storage_client
+import import_manifest
+import blob_index
+from context_packing import RETRIEVAL_TOP_K, RETRIEVAL_MAX_DISTANCE, pack_contexts, format_contexts, estimate_tokens
+from bm25_index import bm25_store, BM25_INDEX_ENABLED
+from pgvector_store import pgvector_store, RETRIEVAL_BACKEND, read_document, chunk_text
+from question_bank import question_bank
+
 from google.adk.tools.retrieval.vertex_ai_rag_retrieval import VertexAiRagRetrieval
 from vertexai.generative_models import Tool, grounding
 
@@ -22,6 +38,16 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 DEFAULT_CORPUS_NAME = os.getenv("DEFAULT_CORPUS_NAME")
 DEFAULT_BUCKET_NAME = os.getenv("DEFAULT_BUCKET_NAME")
 DEFAULT_CORPUS_ID = os.getenv("DEFAULT_CORPUS_ID")
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "256"))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "600"))
+IMPORT_MANIFEST_ENABLED = os.getenv("IMPORT_MANIFEST_ENABLED", "True") == "True"
+RAG_FILES_COUNT_CACHE_TTL = float(os.getenv("RAG_FILES_COUNT_CACHE_TTL", "60"))
+RAG_FILES_COUNT_CONCURRENCY = int(os.getenv("RAG_FILES_COUNT_CONCURRENCY", "8"))
+RAG_FILES_COUNT_TIMEOUT = float(os.getenv("RAG_FILES_COUNT_TIMEOUT", "20"))
+# 'vertex' (Vertex AI RAG only), 'local' (local BM25 index only, no network call), 'local_first' (the BM25 results
+# when the best one scores at least RETRIEVAL_LOCAL_MIN_SCORE, otherwise Vertex AI) or 'hybrid' (both, fused by rank)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vertex")
+RETRIEVAL_LOCAL_MIN_SCORE = float(os.getenv("RETRIEVAL_LOCAL_MIN_SCORE", "5"))
 
 PARSING_MODEL = "gemini-2.5-flash-lite"
 
@@ -30,6 +56,75 @@ RAG_CORPUS = f"projects/{GOOGLE_CLOUD_PROJECT_ID}/locations/{GOOGLE_CLOUD_LOCATI
 # Initialize Vertex AI API
 vertexai.init(project=GOOGLE_CLOUD_PROJECT_ID, location=GOOGLE_CLOUD_LOCATION)
 
+# Cache of retrieve_context results keyed on (corpus name, normalized query)
+retrieval_cache = TTLCache(max_entries=RETRIEVAL_CACHE_MAX_ENTRIES, ttl=RETRIEVAL_CACHE_TTL)
+# Cache of the number of files of each corpus keyed on corpus name (list_rag_corpora)
+files_count_cache = TTLCache(max_entries=1024, ttl=RAG_FILES_COUNT_CACHE_TTL)
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+def invalidate_corpus_cache(corpus_name: str) -> int:
+    """
+    Drop the cached retrieval results and file count of a corpus. Returns the number of removed retrieval entries.
+    """
+    files_count_cache.invalidate(lambda key: key == corpus_name)
+    return retrieval_cache.invalidate(lambda key: key[0] == corpus_name)
+
+def retrieval_cache_stats() -> Dict[str, Any]:
+    return retrieval_cache.stats()
+
+# the index of the default corpus is mapped at startup
+if RETRIEVAL_MODE != "vertex":
+    try:
+        bm25_store.get(DEFAULT_CORPUS_ID or "")
+    except Exception as e:
+        print(f"BM25 INDEX ERROR: {e}")
+
+def count_rag_files(corpus_name: str) -> int:
+    """
+    Count the files of a corpus, following every page of the listing.
+    """
+    return sum(1 for _ in rag.list_files(corpus_name=corpus_name))
+
+def get_files_counts(corpus_names: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Return the number of files of each corpus, keyed by corpus name, as {"count", "status"}.
+    Cached counts are used when available, the others are fetched concurrently
+    (at most RAG_FILES_COUNT_CONCURRENCY requests at a time, RAG_FILES_COUNT_TIMEOUT seconds overall).
+    The status is "cached", "ok", "error" or "timeout": with "error" and "timeout" the count is None (unknown).
+    """
+    counts = {}
+    missing = []
+    for name in corpus_names:
+        hit, count = files_count_cache.get(name)
+        if hit:
+            counts[name] = {"count": count, "status": "cached"}
+        else:
+            missing.append(name)
+
+    if not missing:
+        return counts
+
+    executor = ThreadPoolExecutor(max_workers=min(RAG_FILES_COUNT_CONCURRENCY, len(missing)), thread_name_prefix="rag-count")
+    try:
+        futures = {executor.submit(count_rag_files, name): name for name in missing}
+        done, _ = wait(futures, timeout=RAG_FILES_COUNT_TIMEOUT)
+        for future, name in futures.items():
+            if future not in done:
+                counts[name] = {"count": None, "status": "timeout"}
+            elif future.exception() is not None:
+                print(f"FILES COUNT ERROR {name}: {future.exception()}")
+                counts[name] = {"count": None, "status": "error"}
+            else:
+                files_count_cache.set(name, future.result())
+                counts[name] = {"count": future.result(), "status": "ok"}
+    finally:
+        # do not wait for the requests still running after the timeout
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return counts
+
 # tool definition for VertexAI RAG Engine Interaction
 
 def list_rag_corpora() -> Dict[str, Any]:
@@ -39,12 +134,16 @@ def list_rag_corpora() -> Dict[str, Any]:
     Returns:
         A dictionary containing the list of corpora:
         - status: "success" or "error"
-        - corpora: List of corpus objects with id, name, and display_name
+        - corpora: List of corpus objects with id, name, and display_name.
+          files_count is None when the number of files could not be retrieved (see files_count_status)
         - count: Number of corpora found
         - error_message: Present only if an error occurred
     """
     try:
-        corpora = rag.list_corpora()
+        corpora = list(rag.list_corpora())
+        
+        # Count the files of all the corpora at once (cached / concurrent requests)
+        files_counts = get_files_counts([corpus.name for corpus in corpora])
         
         corpus_list = []
         for corpus in corpora:
@@ -57,17 +156,7 @@ def list_rag_corpora() -> Dict[str, Any]:
             elif hasattr(corpus, "corpusStatus") and hasattr(corpus.corpusStatus, "state"):
                 status = corpus.corpusStatus.state
             
-            # Make an explicit API call to count files
-            files_count = 0
-            try:
-                # List all files to get the count
-                files_response = rag.list_files(corpus_name=corpus.name)
-                
-                if hasattr(files_response, "rag_files"):
-                    files_count = len(files_response.rag_files)
-            except Exception:
-                # If counting files fails, continue with zero count
-                pass
+            files_count = files_counts[corpus.name]
             
             corpus_list.append({
                 "id": corpus_id,
@@ -75,7 +164,8 @@ def list_rag_corpora() -> Dict[str, Any]:
                 "display_name": corpus.display_name,
                 "description": corpus.description if hasattr(corpus, "description") else None,
                 "create_time": str(corpus.create_time) if hasattr(corpus, "create_time") else None,
-                "files_count": files_count,
+                "files_count": files_count["count"],
+                "files_count_status": files_count["status"],
                 "status": status
             })
         
@@ -92,9 +182,10 @@ def list_rag_corpora() -> Dict[str, Any]:
             "message": f"Failed to list RAG corpora: {str(e)}"
         }
 
-def retrieve_context(query: str) -> str:
+async def retrieve_context(query: str) -> str:
     """
     Retrieve context from the RAG engine based on the query.
+    The contexts are merged, deduplicated and packed up to RETRIEVAL_TOKEN_BUDGET tokens (see context_packing.py).
     
     Args:
         query: The query to search for.
@@ -103,93 +194,386 @@ def retrieve_context(query: str) -> str:
     Returns:
         The retrieved context as a string.
     """
-    try:
+    cache_key = (RAG_CORPUS, normalize_query(query))
+    hit, context = retrieval_cache.get(cache_key)
+    if hit:
+        print("retrieval cache hit")
+        return context
 
-        retrival_config = resources.RagRetrievalConfig(top_k=5)
+    try:
 
-        response = rag.retrieval_query(
-            rag_resources=[rag.RagResource(rag_corpus=RAG_CORPUS)],
-            text=query
-        )
+        if RETRIEVAL_MODE == "local":
+            contexts = await run_blocking("retrieve_context", lexical_contexts, query)
+        elif RETRIEVAL_MODE == "local_first":
+            contexts = await run_blocking("retrieve_context", lexical_contexts, query)
+            if not contexts or contexts[0].score < RETRIEVAL_LOCAL_MIN_SCORE:
+                contexts = await dense_contexts(query)
+        elif RETRIEVAL_MODE == "hybrid":
+            # the dense and the lexical retrievals run at the same time
+            dense, lexical = await asyncio.gather(dense_contexts(query), run_blocking("retrieve_context", lexical_contexts, query))
+            contexts = fuse_rankings(dense, lexical)
+        else:
+            contexts = await dense_contexts(query)
         
         # Format the retrieved context
-        context = ""
-        if response.contexts and response.contexts.contexts:
-            print("found relevant context")
-            for i, ctx in enumerate(response.contexts.contexts):
-                context += f"Context {i+1}:\n{ctx.text}\n\n"
+        blocks = pack_contexts(contexts)
+        if blocks:
+            retrieved_tokens = sum(estimate_tokens(ctx.text or "") for ctx in contexts)
+            context = format_contexts(blocks)
+            print(f"found relevant context: {len(contexts)} contexts ({retrieved_tokens} tokens) "
+                  f"packed in {len(blocks)} ({estimate_tokens(context)} tokens)")
         else:
             context = "No relevant context found."
+
+        retrieval_cache.set(cache_key, context)
             
         return context
 
     except Exception as e:
         return f"Error retrieving context: {str(e)}"
 
+async def dense_contexts(query: str) -> List[Any]:
+    # semantic retrieval: Vertex AI RAG (blocking SDK call, in the tool thread pool) or pgvector (see pgvector_store.py)
+    if RETRIEVAL_BACKEND == "pgvector":
+        return await pgvector_store.search(DEFAULT_CORPUS_ID or "", query, RETRIEVAL_TOP_K, RETRIEVAL_MAX_DISTANCE)
+    return await run_blocking("retrieve_context", vertex_contexts, query)
+
+def vertex_contexts(query: str) -> List[Any]:
+    retrival_config = resources.RagRetrievalConfig(top_k=RETRIEVAL_TOP_K)
+    if RETRIEVAL_MAX_DISTANCE != float("inf"):
+        retrival_config.filter = resources.Filter(vector_distance_threshold=RETRIEVAL_MAX_DISTANCE)
+
+    response = rag.retrieval_query(
+        rag_resources=[rag.RagResource(rag_corpus=RAG_CORPUS)],
+        text=query,
+        rag_retrieval_config=retrival_config
+    )
+    return list(response.contexts.contexts) if response.contexts and response.contexts.contexts else []
+
+def lexical_contexts(query: str) -> List[Any]:
+    # contexts of the local BM25 index (no distance: best first)
+    return [SimpleNamespace(text=hit["text"], source_uri=hit["source_uri"], distance=None, score=hit["score"])
+            for hit in bm25_store.search(DEFAULT_CORPUS_ID or "", query, RETRIEVAL_TOP_K)]
+
+def fuse_rankings(*rankings: List[Any], k: int = 60) -> List[Any]:
+    """
+    Reciprocal rank fusion of lists of contexts, best first. The same chunk found by several rankings is counted once.
+    """
+    scores: Dict[str, float] = {}
+    fused: Dict[str, Any] = {}
+    for ranking in rankings:
+        for rank, ctx in enumerate(ranking):
+            key = " ".join((ctx.text or "").split())
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+            fused.setdefault(key, SimpleNamespace(text=ctx.text, source_uri=getattr(ctx, "source_uri", ""), distance=None))
+    return [fused[key] for key in sorted(scores, key=scores.get, reverse=True)][:RETRIEVAL_TOP_K]
+
 # Function for importing documents into a RAG corpus
-def import_document_to_corpus( corpus_id: str, bucket_name: str, file_name: str) -> Dict[str, Any]:
+def import_files_to_corpus(corpus_id: str, gcs_uris: List[str]) -> Dict[str, Any]:
     """
-    Imports a document from Google Cloud Storage into a RAG corpus.
-    Uses the minimal required parameters to avoid any compatibility issues.
+    Imports a batch of documents from Google Cloud Storage into a RAG corpus with a single import request.
+    Blocking call: it waits for the Vertex AI parsing and embedding of all the files.
+    
+    Args:
+        corpus_id: The ID of the corpus to import the documents into
+        gcs_uris: GCS paths of the documents to import (gs://bucket-name/file-name)
+    
+    Returns:
+        A dictionary containing:
+        - imported: Number of files imported
+        - failed: Number of files that failed to import
+        - skipped: Number of files skipped
+    """
+    # Construct full corpus name
+    corpus_name = f"projects/{GOOGLE_CLOUD_PROJECT_ID}/locations/{GOOGLE_CLOUD_LOCATION}/ragCorpora/{corpus_id}"
+    
+    print(corpus_name)
+    print(gcs_uris)
+
+    # Create the configuration object first for clarity
+    chunking = rag.ChunkingConfig(
+        chunk_size=1024,
+        chunk_overlap=200
+    )
+
+    # Define the LLM Parser Configuration
+    # This tells Vertex AI to use a Generative Model to read the file
+    llm_parser = rag.LlmParserConfig(
+        model_name=PARSING_MODEL,
+        max_parsing_requests_per_min=100  # Throttle to avoid hitting GenAI quotas
+    )
+
+    transformation = rag.TransformationConfig(
+        chunking_config=chunking
+    )
+
+    result = rag.import_files(
+        corpus_name,
+        gcs_uris,
+        transformation_config=transformation ,
+        llm_parser=llm_parser,
+    )
+
+    print(f"------------ RESULT ------------")
+    print(f"Successfully Imported: {result.imported_rag_files_count}")
+    print(f"Failed to Import:      {result.failed_rag_files_count}")
+    print(f"Skipped:               {result.skipped_rag_files_count}")
+    print(f"-----------------------------")
+    if result.failed_rag_files_count > 0:
+        print("ERROR: The Vertex AI Service Agent failed to import.")
+
+    if result.imported_rag_files_count > 0:
+        # the corpus changed: cached retrievals may miss the new document
+        removed = invalidate_corpus_cache(corpus_name)
+        print(f"Retrieval cache entries invalidated: {removed}")
+
+    return {
+        "imported": result.imported_rag_files_count,
+        "failed": result.failed_rag_files_count,
+        "skipped": result.skipped_rag_files_count
+    }
+
+def list_rag_files(corpus_id: str, gcs_uris: List[str]) -> Dict[str, List[Any]]:
+    """
+    Return the RAG files of the corpus created from the given GCS URIs, keyed by URI.
+    Only the GCS source of the files is matched.
+    """
+    corpus_name = f"projects/{GOOGLE_CLOUD_PROJECT_ID}/locations/{GOOGLE_CLOUD_LOCATION}/ragCorpora/{corpus_id}"
+    wanted = set(gcs_uris)
+
+    found = {}
+    for f in rag.list_files(corpus_name=corpus_name):
+        if not f.gcs_source:
+            continue
+        for uri in f.gcs_source.uris:
+            if uri in wanted:
+                found.setdefault(uri, []).append(f)
+    return found
+
+def find_rag_files(corpus_id: str, gcs_uris: List[str]) -> Dict[str, str]:
+    """
+    Return the RAG file names (resource ids) of the corpus created from the given GCS URIs, keyed by URI.
+    """
+    return {uri: files[-1].name for uri, files in list_rag_files(corpus_id, gcs_uris).items()}
+
+def changed_since(rag_file: Any, since: float) -> Optional[bool]:
+    """
+    True if the RAG file was created or updated after 'since' (epoch seconds), None if it has no timestamps.
+    """
+    times = [t for t in (getattr(rag_file, "create_time", None), getattr(rag_file, "update_time", None)) if t]
+    if not times:
+        return None
+    return max(t.timestamp() for t in times) >= since
+
+def fetch_file_chunks(gcs_uris: List[str]) -> Dict[str, List[str]]:
+    """
+    Chunks of the whole documents of the given GCS URIs, keyed by URI. Blocking call.
+    Vertex AI does not export the parsed text of a RAG file: the blobs are downloaded, parsed and chunked here
+    like the pgvector backend does (pgvector_store.read_document and chunk_text).
+    """
+    chunks = {}
+    for uri in gcs_uris:
+        try:
+            chunks[uri] = chunk_text(read_document(uri))
+        except Exception as e:
+            print(f"BM25 INDEX ERROR {uri}: {e}")
+    return chunks
+
+async def index_imported_files(corpus_id: str, gcs_uris: List[str], only_missing: bool = False):
+    """
+    Add the chunks of the imported files to the local BM25 index of the corpus (see bm25_index.py).
+    With only_missing the files already in the index are left as they are.
+    """
+    try:
+        if only_missing:
+            gcs_uris = await run_blocking("bm25_index", bm25_store.missing, corpus_id, gcs_uris)
+            if not gcs_uris:
+                return
+        if RETRIEVAL_BACKEND == "pgvector":
+            # the chunks stored by the pgvector import are read_document / chunk_text of the whole document
+            chunks = {uri: await pgvector_store.file_chunks(corpus_id, uri) for uri in gcs_uris}
+        else:
+            chunks = await run_blocking("bm25_index", fetch_file_chunks, gcs_uris)
+        size = await run_blocking("bm25_index", bm25_store.replace_documents, corpus_id, chunks)
+        invalidate_corpus_cache(f"projects/{GOOGLE_CLOUD_PROJECT_ID}/locations/{GOOGLE_CLOUD_LOCATION}/ragCorpora/{corpus_id}")
+        print(f"BM25 INDEX: {sum(len(c) for c in chunks.values())} chunk(s) of {len(chunks)} file(s) indexed, {size} in corpus {corpus_id}")
+    except Exception as e:
+        print(f"BM25 INDEX ERROR: {e}")
+
+_index_tasks = set()
+
+def schedule_lexical_index(corpus_id: str, gcs_uris: List[str], only_missing: bool = False):
+    # with RETRIEVAL_MODE=vertex the index is never queried: the documents are not downloaded and parsed again
+    if not BM25_INDEX_ENABLED or RETRIEVAL_MODE == "vertex" or not gcs_uris:
+        return
+    task = asyncio.get_running_loop().create_task(index_imported_files(corpus_id, gcs_uris, only_missing))
+    _index_tasks.add(task)
+    task.add_done_callback(_index_tasks.discard)
+
+def delete_rag_file(rag_file_id: str):
+    rag.delete_file(name=rag_file_id)
+    print(f"Deleted RAG file {rag_file_id}")
+
+def import_outcome(before: Optional[Set[str]], after: List[Any], started: float, changed_blob: bool) -> Tuple[str, Optional[str]]:
+    """
+    Outcome of the import of a URI ('imported', 'failed', 'skipped' or 'unknown') and its new RAG file, from the
+    RAG files of the URI before the import (names, None if they could not be listed) and after it.
+    A file is imported only if its RAG file is new or was created / updated after the import started.
+    """
+    if not after:
+        return "failed", None
+    new = [f for f in after if before is not None and f.name not in before]
+    updated = [f for f in after if changed_since(f, started)]
+    if new or updated:
+        return "imported", (new or updated)[-1].name
+    if before is None or any(changed_since(f, started) is None for f in after):
+        # the file was in the corpus already and there is no timestamp to tell if this import replaced it
+        return "unknown", None
+    # Vertex AI kept the file it had: a changed blob failed to import, an unchanged one was skipped
+    return ("failed" if changed_blob else "skipped"), None
+
+async def run_import_batch(corpus_id: str, gcs_uris: List[str]) -> Dict[str, Any]:
+    """
+    Import a batch of GCS URIs checking the import manifest first:
+    - unchanged blobs (same generation and md5) are skipped without calling Vertex AI
+    - changed blobs replace the RAG file created by their previous import, once the new one is in the corpus
+    - missing blobs are not imported
+    The blocking calls run in the tool thread pool.
+    With RETRIEVAL_BACKEND=pgvector the documents are chunked and embedded in Postgres instead (see pgvector_store.py).
+    The result always has the counts of every URI in 'files' (see import_jobs.py); the totals are their sums.
+    """
+    corpus_name = f"projects/{GOOGLE_CLOUD_PROJECT_ID}/locations/{GOOGLE_CLOUD_LOCATION}/ragCorpora/{corpus_id}"
+    if RETRIEVAL_BACKEND == "pgvector":
+        result = await pgvector_store.import_files(corpus_id, gcs_uris)
+        imported = [uri for uri, f in result["files"].items() if f["imported"]]
+        if imported:
+            invalidate_corpus_cache(corpus_name)
+            question_bank.schedule(corpus_id, imported)
+            schedule_lexical_index(corpus_id, imported)
+        schedule_lexical_index(corpus_id, [uri for uri, f in result["files"].items() if f["skipped"]], only_missing=True)
+        return result
+
+    files = {}
+    metadata = {}
+    # RAG files of the previous import of the changed blobs, deleted after the new import
+    previous = {}
+    to_import = list(gcs_uris)
+    if IMPORT_MANIFEST_ENABLED:
+        try:
+            blobs = await asyncio.gather(*[run_blocking("get_blob_metadata", get_blob_metadata, uri) for uri in gcs_uris])
+            metadata = dict(zip(gcs_uris, blobs))
+            manifest = await import_manifest.lookup(corpus_id, gcs_uris)
+
+            to_import = []
+            for uri in gcs_uris:
+                entry = manifest.get(uri)
+                if metadata[uri] is None:
+                    print(f"IMPORT SKIPPED (not found): {uri}")
+                    files[uri] = {"imported": 0, "failed": 1, "skipped": 0, "error_message": f"{uri} not found"}
+                    continue
+                if import_manifest.is_unchanged(entry, metadata[uri]):
+                    print(f"IMPORT SKIPPED (unchanged): {uri}")
+                    files[uri] = {"imported": 0, "failed": 0, "skipped": 1}
+                    continue
+                if entry and entry.get("rag_file_id"):
+                    previous[uri] = entry["rag_file_id"]
+                to_import.append(uri)
+        except Exception as e:
+            # without the manifest everything is imported again
+            print(f"IMPORT MANIFEST ERROR: {e}")
+            metadata = {}
+            files = {}
+            previous = {}
+            to_import = list(gcs_uris)
+
+    rag_files = {}
+    if to_import:
+        # the import only returns the counts of the batch: the RAG files of the URIs are compared before and after it
+        try:
+            listed = await run_blocking("import_document_to_corpus", list_rag_files, corpus_id, to_import)
+            before = {f.name for found in listed.values() for f in found}
+        except Exception as e:
+            print(f"IMPORT CHECK ERROR: {e}")
+            before = None
+        started = time.time()
+        await run_blocking("import_document_to_corpus", import_files_to_corpus, corpus_id, to_import)
+
+        try:
+            after = await run_blocking("import_document_to_corpus", list_rag_files, corpus_id, to_import)
+        except Exception as e:
+            print(f"IMPORT CHECK ERROR: {e}")
+            for uri in to_import:
+                files[uri] = {"imported": 0, "failed": 0, "skipped": 0, "unknown": 1,
+                              "error_message": f"Cannot check the import of {uri}: {e}"}
+            after = None
+
+        for uri in (to_import if after is not None else []):
+            outcome, rag_file = import_outcome(before, after.get(uri, []), started, uri in previous)
+            files[uri] = {key: int(key == outcome) for key in ("imported", "failed", "skipped", "unknown")}
+            if rag_file:
+                rag_files[uri] = rag_file
+
+        # the new version is in the corpus: remove the old one. A failed import keeps the old version and its manifest entry.
+        replaced = [uri for uri in rag_files if uri in previous and previous[uri] != rag_files[uri]]
+        for uri in replaced:
+            try:
+                await run_blocking("import_document_to_corpus", delete_rag_file, previous[uri])
+            except Exception as e:
+                print(f"DELETE RAG FILE ERROR {previous[uri]}: {e}")
+        if replaced:
+            invalidate_corpus_cache(corpus_name)
+
+        if metadata:
+            await import_manifest.record(corpus_id, [
+                {
+                    "gcs_uri": uri,
+                    "generation": metadata[uri]["generation"],
+                    "md5_hash": metadata[uri]["md5_hash"],
+                    "rag_file_id": rag_file
+                }
+                for uri, rag_file in rag_files.items()
+            ])
+        # questions of the new documents for the question bank, see question_bank.py
+        question_bank.schedule(corpus_id, list(rag_files))
+        schedule_lexical_index(corpus_id, list(rag_files))
+
+    # unchanged documents imported before the local index was used (e.g. with RETRIEVAL_MODE=vertex)
+    schedule_lexical_index(corpus_id, [uri for uri, f in files.items() if f.get("skipped")], only_missing=True)
+
+    return dict({key: sum(f.get(key, 0) for f in files.values()) for key in ("imported", "failed", "skipped", "unknown")},
+                files=files)
+
+# Background queue of the imports, see import_jobs.py
+import_queue = ImportJobQueue(run_import_batch)
+
+async def import_document_to_corpus( corpus_id: str, bucket_name: str, file_name: str) -> Dict[str, Any]:
+    """
+    Starts the import of a document from Google Cloud Storage into a RAG corpus.
+    The import runs in background: the reply contains the job id to use with 'get_import_status' tool.
     
     Args:
         corpus_id: The ID of the corpus to import the document into
-        gcs_uri: GCS path of the document to import (gs://bucket-name/file-name)
+        bucket_name: The name of the bucket containing the document
+        file_name: The name of the document in the bucket
     
     Returns:
         A dictionary containing:
-        - status: "success" or "error"
+        - status: "queued" or "error"
+        - job_id: The id of the import job
         - corpus_id: The ID of the corpus
         - message: Status message
     """
     try:
-        # Construct full corpus name
-        corpus_name = f"projects/{GOOGLE_CLOUD_PROJECT_ID}/locations/{GOOGLE_CLOUD_LOCATION}/ragCorpora/{corpus_id}"
         gcs_uri = f"gs://{bucket_name}/{file_name}"
-        
-        print(corpus_name)
-        print(gcs_uri)
-
-        # Import document with minimal configuration
-        # Use the most basic form of the API call to avoid parameter issues
-
-        # Create the configuration object first for clarity
-        chunking = rag.ChunkingConfig(
-            chunk_size=1024,
-            chunk_overlap=200
-        )
-
-        # Define the LLM Parser Configuration
-        # This tells Vertex AI to use a Generative Model to read the file
-        llm_parser = rag.LlmParserConfig(
-            model_name=PARSING_MODEL,
-            max_parsing_requests_per_min=100  # Throttle to avoid hitting GenAI quotas
-        )
-
-        transformation = rag.TransformationConfig(
-            chunking_config=chunking
-        )
-
-        result = rag.import_files(
-            corpus_name,
-            [gcs_uri], # Single path in a list
-            transformation_config=transformation ,
-            llm_parser=llm_parser,
-        )
-
-        print(f"------------ RESULT ------------")
-        print(f"Successfully Imported: {result.imported_rag_files_count}")
-        print(f"Failed to Import:      {result.failed_rag_files_count}")
-        print(f"Skipped:               {result.skipped_rag_files_count}")
-        print(f"-----------------------------")
-        if result.failed_rag_files_count > 0:
-            print("ERROR: The Vertex AI Service Agent failed to import.")
-
-        # Return success result
+        job = await import_queue.submit(corpus_id, gcs_uri)
+        # the listing of the bucket is refreshed in background on the next query
+        blob_index.invalidate(bucket_name)
+
         return {
-            "status": "success",
+            "status": "queued",
+            "job_id": job["job_id"],
             "corpus_id": corpus_id,
-            "message": f"Successfully imported document {gcs_uri} to corpus '{corpus_id}'"
+            "message": f"Import of document {gcs_uri} to corpus '{corpus_id}' started. Job id: {job['job_id']}"
         }
     except Exception as e:
         return {
@@ -199,6 +583,40 @@ def import_document_to_corpus( corpus_id: str, bucket_name: str, file_name: str)
             "message": f"Failed to import document: {str(e)}"
         }
 
+async def get_import_status(job_id: str) -> Dict[str, Any]:
+    """
+    Get the status of a document import started with 'import_document_to_corpus' tool.
+    
+    Args:
+        job_id: The id of the import job
+    
+    Returns:
+        A dictionary containing:
+        - status: "queued", "running", "done" or "error"
+        - imported, failed, skipped: Number of files imported, failed and skipped (when finished)
+        - message: Status message
+    """
+    try:
+        job = await import_queue.get(job_id)
+    except Exception as e:
+        return {
+            "status": "error",
+            "job_id": job_id,
+            "error_message": str(e),
+            "message": f"Failed to get the status of import job '{job_id}': {str(e)}"
+        }
+    if job is None:
+        return {
+            "status": "error",
+            "job_id": job_id,
+            "message": f"Import job '{job_id}' not found"
+        }
+
+    return {
+        **job,
+        "message": f"Import of {job['gcs_uri']} is {job['status']}"
+    }
+
 def verify_corpus_files(corpus_id: str):
     corpus_name = f"projects/{GOOGLE_CLOUD_PROJECT_ID}/locations/{GOOGLE_CLOUD_LOCATION}/ragCorpora/{corpus_id}"
     
@@ -218,6 +636,8 @@ def verify_corpus_files(corpus_id: str):
         print(f"Total files verified: {count}")
 
 import_document_to_corpus_tool = FunctionTool(func=import_document_to_corpus)
+get_import_status_tool = FunctionTool(func=get_import_status)
+# the blocking Vertex AI calls of the function run in the tool thread pool
 retrieve_context_tool = FunctionTool(func=retrieve_context)
 
 def check_file_status(uri: str):
@@ -230,7 +650,7 @@ def check_file_status(uri: str):
     blob_name = parts[1]
 
     try:
-        storage_client = storage.Client()
+        storage_client = get_storage_client()
         bucket = storage_client.bucket(bucket_name)
         blob = bucket.blob(blob_name)
         
@@ -254,7 +674,7 @@ if __name__ == "__main__":
     print("-----------------------------------------------------------")
     check_file_status("gs://"+DEFAULT_BUCKET_NAME+"/book2.jpg")
     print("-----------------------------------------------------------")
-    print(import_document_to_corpus(DEFAULT_CORPUS_ID, DEFAULT_BUCKET_NAME, "book2.jpg"))
+    print(import_files_to_corpus(DEFAULT_CORPUS_ID, ["gs://"+DEFAULT_BUCKET_NAME+"/book2.jpg"]))
     print("-----------------------------------------------------------")
     print(verify_corpus_files(DEFAULT_CORPUS_ID))
     print("-----------------------------------------------------------")
\ No newline at end of file
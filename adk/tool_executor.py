@@ -0,0 +1,55 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable
+from dotenv import load_dotenv
+
+load_dotenv()
+TOOL_EXECUTOR_MAX_WORKERS = int(os.getenv("TOOL_EXECUTOR_MAX_WORKERS", "16"))
+# comma separated list of tool_name=limit, e.g. "retrieve_context=8,import_document_to_corpus=2"
+TOOL_CONCURRENCY_LIMITS = os.getenv("TOOL_CONCURRENCY_LIMITS", "")
+TOOL_DEFAULT_CONCURRENCY = int(os.getenv("TOOL_DEFAULT_CONCURRENCY", "4"))
+
+# Blocking tools (Vertex AI / GCS SDK calls) must not run on the event loop driving runner.run_async,
+# otherwise one slow call freezes every other conversation served by the worker.
+# They are offloaded to a bounded thread pool, with a per-tool limit of concurrent calls.
+
+_executor = ThreadPoolExecutor(max_workers=TOOL_EXECUTOR_MAX_WORKERS, thread_name_prefix="tool")
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+def _parse_limits(value: str) -> Dict[str, int]:
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, limit = item.split("=", 1)
+            limits[name.strip()] = int(limit)
+    return limits
+
+_limits = _parse_limits(TOOL_CONCURRENCY_LIMITS)
+
+def _semaphore(name: str) -> asyncio.Semaphore:
+    if name not in _semaphores:
+        _semaphores[name] = asyncio.Semaphore(_limits.get(name, TOOL_DEFAULT_CONCURRENCY))
+    return _semaphores[name]
+
+async def run_blocking(name: str, func: Callable, *args, **kwargs) -> Any:
+    """
+    Run a blocking function in the tool thread pool, waiting for a free slot of the 'name' limit first.
+    """
+    async with _semaphore(name):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+def offload(func: Callable, name: str = None) -> Callable:
+    """
+    Wrap a blocking tool function into a coroutine function running it with run_blocking().
+    Name, docstring and signature are preserved, so FunctionTool exposes the same tool to the model.
+    """
+    limit_name = name or func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_blocking(limit_name, func, *args, **kwargs)
+
+    return wrapper
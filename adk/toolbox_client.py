@@ -0,0 +1,129 @@
+import os
+import asyncio
+import functools
+import aiohttp
+from typing import Dict, Any, List, Optional
+from dotenv import load_dotenv
+
+from google.adk.agents.readonly_context import ReadonlyContext
+from google.adk.tools import BaseTool, FunctionTool
+from google.adk.tools.base_toolset import BaseToolset
+
+# to use MCP Toolbox for Database
+from toolbox_core import ToolboxClient
+
+load_dotenv()
+MCP_TOOLBOX_URL = os.getenv("MCP_TOOLBOX_URL")
+TOOLBOX_POOL_SIZE = int(os.getenv("TOOLBOX_POOL_SIZE", "16"))
+TOOLBOX_KEEPALIVE = float(os.getenv("TOOLBOX_KEEPALIVE", "30"))
+TOOLBOX_LOAD_RETRIES = int(os.getenv("TOOLBOX_LOAD_RETRIES", "3"))
+TOOLBOX_RETRY_DELAY = float(os.getenv("TOOLBOX_RETRY_DELAY", "1"))
+
+# Async client of the MCP Toolbox for Database, shared by the agents.
+# Nothing is contacted at import time: the client and its keep-alive HTTP session are created on first use,
+# and the toolsets / tools are loaded on first use (retrying while the toolbox container is starting) and cached.
+# Tool calls are awaited on the event loop instead of blocking it with synchronous HTTP requests.
+
+_session: Optional[aiohttp.ClientSession] = None
+_client: Optional[ToolboxClient] = None
+_toolsets: Dict[str, List[Any]] = {}
+_tools: Dict[str, Any] = {}
+_load_lock: Optional[asyncio.Lock] = None
+
+def get_toolbox_client() -> ToolboxClient:
+    """
+    Return the shared toolbox client, creating it (and its HTTP session) on first use.
+    Must be called from the event loop.
+    """
+    global _session, _client
+
+    if _client is None:
+        connector = aiohttp.TCPConnector(limit=TOOLBOX_POOL_SIZE, keepalive_timeout=TOOLBOX_KEEPALIVE)
+        _session = aiohttp.ClientSession(connector=connector)
+        _client = ToolboxClient(MCP_TOOLBOX_URL, session=_session)
+        print(f"TOOLBOX CLIENT CREATED ({MCP_TOOLBOX_URL}, pool size={TOOLBOX_POOL_SIZE})")
+    return _client
+
+async def _load_with_retry(what: str, load):
+    delay = TOOLBOX_RETRY_DELAY
+    for attempt in range(1, TOOLBOX_LOAD_RETRIES + 1):
+        try:
+            return await load()
+        except Exception as e:
+            print(f"TOOLBOX LOAD ERROR {what} (attempt {attempt}/{TOOLBOX_LOAD_RETRIES}): {e}")
+            if attempt == TOOLBOX_LOAD_RETRIES:
+                raise
+            await asyncio.sleep(delay)
+            delay *= 2
+
+async def load_toolset(name: str) -> List[Any]:
+    """
+    Return the tools of a toolbox toolset, loading them on first use.
+    """
+    global _load_lock
+
+    if name not in _toolsets:
+        if _load_lock is None:
+            _load_lock = asyncio.Lock()
+        async with _load_lock:
+            if name not in _toolsets:
+                _toolsets[name] = await _load_with_retry(f"toolset {name}", lambda: get_toolbox_client().load_toolset(name))
+                print(f"TOOLBOX TOOLSET LOADED: {name} {[t.__name__ for t in _toolsets[name]]}")
+    return _toolsets[name]
+
+async def load_tool(name: str) -> Any:
+    """
+    Return a single toolbox tool, loading it on first use.
+    """
+    global _load_lock
+
+    if name not in _tools:
+        if _load_lock is None:
+            _load_lock = asyncio.Lock()
+        async with _load_lock:
+            if name not in _tools:
+                _tools[name] = await _load_with_retry(f"tool {name}", lambda: get_toolbox_client().load_tool(name))
+    return _tools[name]
+
+async def close_toolbox():
+    """
+    Close the HTTP session of the shared client and forget the loaded tools.
+    """
+    global _session, _client, _load_lock
+
+    if _session is not None:
+        await _session.close()
+    _session = None
+    _client = None
+    _load_lock = None
+    _toolsets.clear()
+    _tools.clear()
+
+def as_function_tool(tool: Any) -> FunctionTool:
+    """
+    Expose a toolbox tool as a FunctionTool. The tool is wrapped in a coroutine function,
+    so the runner awaits it; name, description and parameters come from the toolbox manifest.
+    """
+    @functools.wraps(tool)
+    async def call(**kwargs):
+        return await tool(**kwargs)
+
+    return FunctionTool(func=call)
+
+class LazyToolboxToolset(BaseToolset):
+    """
+    Toolset of the agents backed by a toolbox toolset, loaded the first time the agent needs its tools.
+    """
+
+    def __init__(self, toolset_name: str):
+        super().__init__()
+        self.toolset_name = toolset_name
+        self._function_tools: Optional[List[BaseTool]] = None
+
+    async def get_tools(self, readonly_context: Optional[ReadonlyContext] = None) -> List[BaseTool]:
+        if self._function_tools is None:
+            self._function_tools = [as_function_tool(t) for t in await load_toolset(self.toolset_name)]
+        return self._function_tools
+
+    async def close(self):
+        self._function_tools = None
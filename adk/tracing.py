@@ -0,0 +1,120 @@
+import os
+import sys
+import json
+import time
+import queue
+import random
+import threading
+from collections import deque
+from typing import Dict, Any, Optional, List
+from dotenv import load_dotenv
+
+load_dotenv()
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "2000"))
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "10000"))
+# comma separated list of level=rate, e.g. "debug=0.01,info=1,error=1"
+TRACE_SAMPLE_RATES = os.getenv("TRACE_SAMPLE_RATES", "debug=0,info=1,error=1")
+TRACE_MAX_PAYLOAD = int(os.getenv("TRACE_MAX_PAYLOAD", "500"))
+TRACE_VERBOSE_MAX_PAYLOAD = int(os.getenv("TRACE_VERBOSE_MAX_PAYLOAD", "20000"))
+# 'stdout' writes the trace events as json lines, 'none' keeps them only in the ring buffer
+TRACE_OUTPUT = os.getenv("TRACE_OUTPUT", "stdout")
+
+# Structured trace events of the agents and tools (see callback.py), replacing the prints on the request path.
+# Recording an event is cheap: it is sampled per level, its payload is truncated, it is appended to a bounded
+# ring buffer (GET /trace) and queued to a writer thread. When the queue is full the event is not written (dropped).
+# A session with 'trace_verbose' = True in its state records every level with the full payload.
+
+LEVELS = ("debug", "info", "error")
+
+def _parse_rates(value: str) -> Dict[str, float]:
+    rates = {"debug": 0.0, "info": 1.0, "error": 1.0}
+    for item in value.split(","):
+        if "=" in item:
+            level, rate = item.split("=", 1)
+            rates[level.strip()] = float(rate)
+    return rates
+
+_rates = _parse_rates(TRACE_SAMPLE_RATES)
+_buffer: deque = deque(maxlen=TRACE_BUFFER_SIZE)
+_queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+_counters = {"recorded": 0, "sampled_out": 0, "dropped": 0, "written": 0}
+_writer: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+
+def truncate(value: Any, limit: int) -> Any:
+    """
+    Serialize a payload and cut it to 'limit' characters.
+    """
+    if value is None:
+        return None
+    try:
+        text = value if isinstance(value, str) else json.dumps(value, default=str, ensure_ascii=False)
+    except Exception:
+        text = str(value)
+    if len(text) > limit:
+        return text[:limit] + f"...[{len(text) - limit} more]"
+    return text
+
+def sampled(level: str, verbose: bool = False) -> bool:
+    """
+    True if an event of the given level has to be recorded.
+    """
+    if verbose:
+        return True
+    rate = _rates.get(level, 1.0)
+    return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+
+def _write_loop():
+    while True:
+        event = _queue.get()
+        try:
+            sys.stdout.write(json.dumps(event, default=str, ensure_ascii=False) + "\n")
+            sys.stdout.flush()
+            _counters["written"] += 1
+        except Exception:
+            pass
+
+def _ensure_writer():
+    global _writer
+
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = threading.Thread(target=_write_loop, name="trace-writer", daemon=True)
+                _writer.start()
+
+def record(kind: str, level: str = "info", verbose: bool = False, payload: Any = None, **fields):
+    """
+    Record a trace event. 'payload' (tool arguments / results) is serialized only if the event is sampled.
+    """
+    if not sampled(level, verbose):
+        _counters["sampled_out"] += 1
+        return
+
+    event = {"ts": time.time(), "kind": kind, "level": level}
+    event.update(fields)
+    if payload is not None:
+        event["payload"] = truncate(payload, TRACE_VERBOSE_MAX_PAYLOAD if verbose else TRACE_MAX_PAYLOAD)
+
+    _buffer.append(event)
+    _counters["recorded"] += 1
+
+    if TRACE_OUTPUT == "stdout":
+        _ensure_writer()
+        try:
+            _queue.put_nowait(event)
+        except queue.Full:
+            _counters["dropped"] += 1
+
+def recent(limit: int = 100, session_id: Optional[str] = None, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Return the most recent events of the ring buffer (at most 'limit'), optionally filtered by session and kind.
+    """
+    if limit <= 0:
+        return []
+    events = [e for e in list(_buffer)
+              if (session_id is None or e.get("session_id") == session_id) and (kind is None or e.get("kind") == kind)]
+    return events[-limit:]
+
+def stats() -> Dict[str, Any]:
+    return dict(_counters, buffered=len(_buffer), queued=_queue.qsize(), sample_rates=_rates)
@@ -0,0 +1,134 @@
+import os
+import asyncio
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+from dotenv import load_dotenv
+
+from db import get_pool
+import metrics
+
+load_dotenv()
+USAGE_ENABLED = os.getenv("USAGE_ENABLED", "True") == "True"
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "5"))
+
+# Token accounting of the model calls (table public.model_usage).
+# after_model_callback (callback.py) records the usage metadata of each model response; the counts are summed
+# in memory per (day, student, session, agent, model) and added to the table in batches by a background task.
+
+USAGE_FIELDS = ("calls", "prompt_tokens", "response_tokens", "cached_tokens", "thoughts_tokens", "total_tokens")
+GROUP_BY_COLUMNS = {"agent": "agent", "session": "session_id", "student": "student_id", "model": "model", "day": "day"}
+
+class UsageRecorder:
+
+    def __init__(self, flush_interval: float = USAGE_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._pending: Dict[Tuple, Dict[str, int]] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    def record(self, student_id: str, session_id: str, agent: str, model: str, usage_metadata: Any):
+        """
+        Add a model call and its token counts (google.genai usage metadata, may be None) to the pending totals.
+        """
+        counts = {
+            "calls": 1,
+            "prompt_tokens": getattr(usage_metadata, "prompt_token_count", None) or 0,
+            "response_tokens": getattr(usage_metadata, "candidates_token_count", None) or 0,
+            "cached_tokens": getattr(usage_metadata, "cached_content_token_count", None) or 0,
+            "thoughts_tokens": getattr(usage_metadata, "thoughts_token_count", None) or 0,
+            "total_tokens": getattr(usage_metadata, "total_token_count", None) or 0
+        }
+        for kind in ("prompt", "response", "cached", "thoughts"):
+            if counts[f"{kind}_tokens"]:
+                metrics.TOKENS.labels(agent=agent, model=model, kind=kind).inc(counts[f"{kind}_tokens"])
+
+        if not USAGE_ENABLED:
+            return
+
+        day = datetime.now(timezone.utc).date()
+        key = (day, student_id or "0", session_id or "", agent, model or "")
+        totals = self._pending.setdefault(key, dict.fromkeys(USAGE_FIELDS, 0))
+        for field in USAGE_FIELDS:
+            totals[field] += counts[field]
+
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"USAGE FLUSH ERROR: {e}")
+
+    async def flush(self) -> None:
+        """
+        Add the pending totals to the table in one batch.
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return
+
+            batch = self._pending
+            self._pending = {}
+            rows = [key + tuple(totals[f] for f in USAGE_FIELDS) for key, totals in batch.items()]
+
+            try:
+                pool = await get_pool()
+                await pool.executemany(
+                    "INSERT INTO public.model_usage (day, student_id, session_id, agent, model, "
+                    "calls, prompt_tokens, response_tokens, cached_tokens, thoughts_tokens, total_tokens, updated_at) "
+                    "VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, now()) "
+                    "ON CONFLICT (day, student_id, session_id, agent, model) DO UPDATE SET "
+                    "calls = model_usage.calls + EXCLUDED.calls, "
+                    "prompt_tokens = model_usage.prompt_tokens + EXCLUDED.prompt_tokens, "
+                    "response_tokens = model_usage.response_tokens + EXCLUDED.response_tokens, "
+                    "cached_tokens = model_usage.cached_tokens + EXCLUDED.cached_tokens, "
+                    "thoughts_tokens = model_usage.thoughts_tokens + EXCLUDED.thoughts_tokens, "
+                    "total_tokens = model_usage.total_tokens + EXCLUDED.total_tokens, "
+                    "updated_at = now()",
+                    rows
+                )
+            except Exception:
+                # merge the batch back, it will be retried by the next flush
+                for key, totals in batch.items():
+                    pending = self._pending.setdefault(key, dict.fromkeys(USAGE_FIELDS, 0))
+                    for field in USAGE_FIELDS:
+                        pending[field] += totals[field]
+                raise
+
+            print(f"USAGE FLUSH: {len(rows)} row(s)")
+
+    async def totals(self, group_by: List[str], student_id: Optional[str] = None, session_id: Optional[str] = None,
+                     agent: Optional[str] = None, days: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Sum the usage grouped by the given dimensions (agent, session, student, model, day), optionally filtered.
+        Rows are sorted by total tokens, highest first.
+        """
+        columns = [GROUP_BY_COLUMNS[g] for g in group_by]
+        conditions = []
+        args = []
+        for column, value in (("student_id", student_id), ("session_id", session_id), ("agent", agent)):
+            if value is not None:
+                args.append(value)
+                conditions.append(f"{column} = ${len(args)}")
+        if days is not None:
+            args.append(datetime.now(timezone.utc).date() - timedelta(days=days))
+            conditions.append(f"day > ${len(args)}")
+
+        select = ", ".join(columns + [f"sum({f})::bigint AS {f}" for f in USAGE_FIELDS])
+        query = f"SELECT {select} FROM public.model_usage"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        if columns:
+            query += " GROUP BY " + ", ".join(columns)
+        query += " ORDER BY total_tokens DESC NULLS LAST"
+
+        # include the calls not written yet
+        await self.flush()
+        pool = await get_pool()
+        rows = await pool.fetch(query, *args)
+        return [dict(r) for r in rows]
+
+usage_recorder = UsageRecorder()
@@ -199,6 +199,271 @@ ALTER TABLE ONLY public.sessions
     ADD CONSTRAINT sessions_users_fk FOREIGN KEY (student_id) REFERENCES public.students(id);
 
 
+--
+-- Name: sessions_student_id_idx; Type: INDEX; Schema: public; Owner: postgres
+-- Last session of a student (login)
+--
+
+CREATE INDEX sessions_student_id_idx ON public.sessions USING btree (student_id, id DESC);
+
+
+--
+-- Name: adk_sessions; Type: TABLE; Schema: public; Owner: postgres
+-- Sessions of the ADK agents (PostgresSessionService). 'id' is the guid stored in public.sessions
+--
+
+CREATE TABLE public.adk_sessions (
+    app_name character varying NOT NULL,
+    user_id character varying NOT NULL,
+    id character varying NOT NULL,
+    state jsonb DEFAULT '{}'::jsonb NOT NULL,
+    create_time timestamp with time zone DEFAULT now() NOT NULL,
+    update_time double precision NOT NULL
+);
+
+
+ALTER TABLE public.adk_sessions OWNER TO postgres;
+
+ALTER TABLE ONLY public.adk_sessions
+    ADD CONSTRAINT adk_sessions_pk PRIMARY KEY (app_name, user_id, id);
+
+
+--
+-- Name: adk_events; Type: TABLE; Schema: public; Owner: postgres
+-- Events of the ADK sessions, written in batches by PostgresSessionService
+--
+
+CREATE TABLE public.adk_events (
+    id bigserial NOT NULL,
+    app_name character varying NOT NULL,
+    user_id character varying NOT NULL,
+    session_id character varying NOT NULL,
+    event_id character varying NOT NULL,
+    "timestamp" double precision NOT NULL,
+    event jsonb NOT NULL
+);
+
+
+ALTER TABLE public.adk_events OWNER TO postgres;
+
+ALTER TABLE ONLY public.adk_events
+    ADD CONSTRAINT adk_events_pk PRIMARY KEY (id);
+
+CREATE INDEX adk_events_session_idx ON public.adk_events USING btree (app_name, user_id, session_id, id);
+
+
+--
+-- Name: import_manifest; Type: TABLE; Schema: public; Owner: postgres
+-- GCS blobs imported into the RAG corpora: blob generation / md5 at import time and RAG file created
+--
+
+CREATE TABLE public.import_manifest (
+    corpus_id character varying NOT NULL,
+    gcs_uri character varying NOT NULL,
+    generation bigint,
+    md5_hash character varying,
+    rag_file_id character varying,
+    imported_at timestamp with time zone DEFAULT now() NOT NULL
+);
+
+
+ALTER TABLE public.import_manifest OWNER TO postgres;
+
+ALTER TABLE ONLY public.import_manifest
+    ADD CONSTRAINT import_manifest_pk PRIMARY KEY (corpus_id, gcs_uri);
+
+
+--
+-- Name: import_jobs; Type: TABLE; Schema: public; Owner: postgres
+-- Status of the background import jobs, written by the agent API with IMPORT_JOBS_STORE=postgres (import_jobs.py)
+--
+
+CREATE TABLE public.import_jobs (
+    job_id character varying NOT NULL,
+    created timestamp with time zone NOT NULL,
+    job jsonb NOT NULL
+);
+
+
+ALTER TABLE public.import_jobs OWNER TO postgres;
+
+ALTER TABLE ONLY public.import_jobs
+    ADD CONSTRAINT import_jobs_pk PRIMARY KEY (job_id);
+
+CREATE INDEX import_jobs_created_idx ON public.import_jobs USING btree (created);
+
+
+--
+-- Name: model_usage; Type: TABLE; Schema: public; Owner: postgres
+-- Model calls and tokens per day, student, ADK session, agent and model, added in batches by the agent API (usage.py)
+--
+
+CREATE TABLE public.model_usage (
+    day date NOT NULL,
+    student_id character varying NOT NULL,
+    session_id character varying NOT NULL,
+    agent character varying NOT NULL,
+    model character varying NOT NULL,
+    calls bigint DEFAULT 0 NOT NULL,
+    prompt_tokens bigint DEFAULT 0 NOT NULL,
+    response_tokens bigint DEFAULT 0 NOT NULL,
+    cached_tokens bigint DEFAULT 0 NOT NULL,
+    thoughts_tokens bigint DEFAULT 0 NOT NULL,
+    total_tokens bigint DEFAULT 0 NOT NULL,
+    updated_at timestamp with time zone DEFAULT now() NOT NULL
+);
+
+
+ALTER TABLE public.model_usage OWNER TO postgres;
+
+ALTER TABLE ONLY public.model_usage
+    ADD CONSTRAINT model_usage_pk PRIMARY KEY (day, student_id, session_id, agent, model);
+
+
+--
+-- Name: question_bank; Type: TABLE; Schema: public; Owner: postgres
+-- Quiz questions generated in background from the chunks of the imported documents (question_bank.py)
+--
+
+CREATE TABLE public.question_bank (
+    id bigserial NOT NULL,
+    corpus_id character varying NOT NULL,
+    topic character varying NOT NULL,
+    keywords character varying DEFAULT '' NOT NULL,
+    source_uri character varying NOT NULL,
+    chunk_hash character varying NOT NULL,
+    question text NOT NULL,
+    answer_key text NOT NULL,
+    created_at timestamp with time zone DEFAULT now() NOT NULL
+);
+
+
+ALTER TABLE public.question_bank OWNER TO postgres;
+
+ALTER TABLE ONLY public.question_bank
+    ADD CONSTRAINT question_bank_pk PRIMARY KEY (id);
+
+CREATE UNIQUE INDEX question_bank_question_idx ON public.question_bank USING btree (corpus_id, chunk_hash, md5(question));
+
+CREATE INDEX question_bank_topic_idx ON public.question_bank USING btree (corpus_id, lower((topic)::text));
+
+CREATE INDEX question_bank_search_idx ON public.question_bank USING gin (to_tsvector('simple'::regconfig, (((topic)::text || ' '::text) || (keywords)::text)));
+
+
+--
+-- Name: question_bank_served; Type: TABLE; Schema: public; Owner: postgres
+-- Questions of the bank already asked to each student
+--
+
+CREATE TABLE public.question_bank_served (
+    student_id character varying NOT NULL,
+    question_id bigint NOT NULL,
+    served_at timestamp with time zone DEFAULT now() NOT NULL
+);
+
+
+ALTER TABLE public.question_bank_served OWNER TO postgres;
+
+ALTER TABLE ONLY public.question_bank_served
+    ADD CONSTRAINT question_bank_served_pk PRIMARY KEY (student_id, question_id);
+
+ALTER TABLE ONLY public.question_bank_served
+    ADD CONSTRAINT question_bank_served_question_fk FOREIGN KEY (question_id) REFERENCES public.question_bank(id) ON DELETE CASCADE;
+
+
+
+--
+-- Name: document_chunks; Type: TABLE; Schema: public; Owner: postgres
+-- Chunks and embeddings of the documents imported with RETRIEVAL_BACKEND=pgvector (pgvector_store.py).
+-- The dimension of the embedding column must match EMBEDDING_DIMENSIONS.
+--
+
+CREATE EXTENSION IF NOT EXISTS vector WITH SCHEMA public;
+
+CREATE TABLE public.document_chunks (
+    id bigserial NOT NULL,
+    corpus_id character varying NOT NULL,
+    source_uri character varying NOT NULL,
+    source_version character varying NOT NULL,
+    chunk_index integer NOT NULL,
+    content text NOT NULL,
+    embedding public.vector(768) NOT NULL,
+    embedder character varying NOT NULL,
+    created_at timestamp with time zone DEFAULT now() NOT NULL
+);
+
+
+ALTER TABLE public.document_chunks OWNER TO postgres;
+
+ALTER TABLE ONLY public.document_chunks
+    ADD CONSTRAINT document_chunks_pk PRIMARY KEY (id);
+
+CREATE INDEX document_chunks_source_idx ON public.document_chunks USING btree (corpus_id, source_uri, chunk_index);
+
+CREATE INDEX document_chunks_embedding_idx ON public.document_chunks USING hnsw (embedding public.vector_cosine_ops) WITH (m = 16, ef_construction = 64);
+
+--
+-- Name: login_student(character varying, character varying, character varying, character varying); Type: FUNCTION; Schema: public; Owner: postgres
+-- Login in one round trip: get or add the student, then get the last session of the student or add a new one.
+-- Empty email / session name mean "not provided yet": the reply status tells which one is missing.
+--
+
+CREATE FUNCTION public.login_student(p_username character varying, p_email character varying, p_session_name character varying, p_guid character varying) RETURNS json
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    v_student public.students%ROWTYPE;
+    v_session public.sessions%ROWTYPE;
+    v_new_student boolean := false;
+    v_new_session boolean := false;
+BEGIN
+    SELECT * INTO v_student FROM public.students WHERE username = lower(p_username);
+
+    IF NOT FOUND THEN
+        IF coalesce(p_email, '') = '' THEN
+            RETURN json_build_object('status', 'email_required', 'username', lower(p_username));
+        END IF;
+
+        INSERT INTO public.students (id, username, email, created_at, updated_at)
+            VALUES (nextval('public.users_id_seq'::regclass), lower(p_username), p_email, now(), now())
+            ON CONFLICT DO NOTHING
+            RETURNING * INTO v_student;
+
+        IF NOT FOUND THEN
+            -- added meanwhile by a concurrent login, or email used by another student
+            SELECT * INTO v_student FROM public.students WHERE username = lower(p_username);
+            IF NOT FOUND THEN
+                RETURN json_build_object('status', 'email_in_use', 'username', lower(p_username), 'email', p_email);
+            END IF;
+        ELSE
+            v_new_student := true;
+        END IF;
+    END IF;
+
+    SELECT * INTO v_session FROM public.sessions WHERE student_id = v_student.id ORDER BY id DESC LIMIT 1;
+
+    IF NOT FOUND THEN
+        IF coalesce(p_session_name, '') = '' THEN
+            RETURN json_build_object('status', 'session_name_required', 'student_id', v_student.id, 'username', v_student.username,
+                                     'new_student', v_new_student);
+        END IF;
+
+        INSERT INTO public.sessions (id, student_id, name, guid)
+            VALUES (nextval('public.sessions_id_seq'::regclass), v_student.id, p_session_name, p_guid)
+            RETURNING * INTO v_session;
+        v_new_session := true;
+    END IF;
+
+    RETURN json_build_object('status', 'ok', 'student_id', v_student.id, 'username', v_student.username, 'email', v_student.email,
+                             'guid', v_session.guid, 'session_name', v_session.name,
+                             'new_student', v_new_student, 'new_session', v_new_session);
+END;
+$$;
+
+
+ALTER FUNCTION public.login_student(p_username character varying, p_email character varying, p_session_name character varying, p_guid character varying) OWNER TO postgres;
+
+
 -- Completed on 2025-11-30 12:33:42
 
 --